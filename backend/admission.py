@@ -0,0 +1,207 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import metriques
+from executeur import TAILLE_POOL
+
+# ===================== CONTROLE D'ADMISSION =====================
+# Chaque famille de rendus (dossier, facture, lot) a sa limite de rendus
+# simultanés et sa file d'attente bornée. Au-delà, la requête est refusée
+# tout de suite au lieu de s'empiler sur les workers :
+#   - 429 si la file est pleine ;
+#   - 503 si la place ne s'est pas libérée après EDEN_ADMISSION_<NOM>_ATTENTE s.
+# Les deux réponses portent un Retry-After estimé d'après la durée moyenne
+# des rendus et la longueur de la file.
+#
+# Seuls les rendus passent par l'admission : une facture servie depuis le
+# cache (ou un 304) ne prend jamais de place.
+#
+# EDEN_ADMISSION_<NOM>_CONCURRENCE : rendus simultanés (défaut : taille du pool)
+# EDEN_ADMISSION_<NOM>_FILE        : requêtes en attente au plus (défaut : 4 x concurrence)
+# EDEN_ADMISSION_<NOM>_ATTENTE     : attente maximale en secondes (défaut : 5)
+
+CONCURRENCE_DEFAUT = max(TAILLE_POOL, 1)
+
+ATTENTES = metriques.enregistrer(metriques.Histogramme(
+    "eden_admission_attente_secondes", "Attente avant le début d'un rendu, par file.", "file"
+))
+REFUS = metriques.enregistrer(metriques.Compteur(
+    "eden_admission_refus_total", "Requêtes refusées par le contrôle d'admission.", ("file", "statut")
+))
+
+
+class Refus(Exception):
+    def __init__(self, statut, message, retry_after):
+        super().__init__(message)
+        self.statut = statut
+        self.message = message
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    """Place obtenue dans une file ; `liberer()` peut être appelé plusieurs fois."""
+
+    def __init__(self, admission):
+        self._admission = admission
+        self._debut = time.perf_counter()
+        self._libre = False
+
+    def liberer(self):
+        if not self._libre:
+            self._libre = True
+            self._admission._liberer(time.perf_counter() - self._debut)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.liberer()
+
+
+class Admission:
+    def __init__(self, nom, concurrence=CONCURRENCE_DEFAUT, file=None, attente_max=5.0):
+        self.nom = nom
+        self.concurrence = max(concurrence, 1)
+        self.file = 4 * self.concurrence if file is None else file
+        self.attente_max = attente_max
+        self._actifs = 0
+        # Réveils des requêtes en attente, dans l'ordre d'arrivée
+        self._attente = deque()
+        # Durée moyenne (glissante) d'un rendu, pour estimer Retry-After
+        self._duree = 1.0
+        self._verrou = threading.Lock()
+
+    @classmethod
+    def depuis_env(cls, nom, concurrence=CONCURRENCE_DEFAUT, file=None, attente_max=5.0):
+        prefixe = f"EDEN_ADMISSION_{nom.upper()}_"
+        concurrence = int(os.environ.get(prefixe + "CONCURRENCE", concurrence))
+        file = os.environ.get(prefixe + "FILE", file)
+        attente_max = float(os.environ.get(prefixe + "ATTENTE", attente_max))
+        return cls(nom, concurrence, None if file is None else int(file), attente_max)
+
+    # ---------- état ----------
+    def profondeur(self):
+        return len(self._attente)
+
+    def actifs(self):
+        return self._actifs
+
+    def _retry_after(self):
+        # Appelé sous le verrou
+        return max(1, math.ceil(self._duree * (len(self._attente) + 1) / self.concurrence))
+
+    def _refuser(self, statut, message):
+        REFUS.incrementer(self.nom, statut)
+        return Refus(statut, message, self._retry_after())
+
+    def _admettre(self, debut):
+        attente = time.perf_counter() - debut
+        ATTENTES.observer(self.nom, attente)
+        metriques.observer("admission_attente", attente)
+        return _Ticket(self)
+
+    def _place_libre(self):
+        # Appelé sous le verrou. Retourne False si la file est pleine.
+        if self._actifs < self.concurrence and not self._attente:
+            self._actifs += 1
+            return True
+        if len(self._attente) >= self.file:
+            raise self._refuser(429, "Trop de rendus en attente")
+        return False
+
+    def _liberer(self, duree=None):
+        with self._verrou:
+            if duree is not None:
+                self._duree = 0.8 * self._duree + 0.2 * duree
+            if not self._attente:
+                self._actifs -= 1
+                return
+            # La place passe directement à la requête suivante
+            reveil = self._attente.popleft()
+        reveil()
+
+    # ---------- entrée (threads) ----------
+    def entrer(self):
+        """Attend une place. Retourne un ticket à libérer, ou lève `Refus`."""
+        debut = time.perf_counter()
+        with self._verrou:
+            if self._place_libre():
+                return self._admettre(debut)
+            evenement = threading.Event()
+            reveil = evenement.set
+            self._attente.append(reveil)
+
+        if not evenement.wait(self.attente_max):
+            with self._verrou:
+                try:
+                    self._attente.remove(reveil)
+                except ValueError:
+                    pass  # la place a été donnée entre-temps
+                else:
+                    raise self._refuser(503, "Service surchargé")
+        return self._admettre(debut)
+
+    # ---------- entrée (asyncio) ----------
+    async def entrer_async(self):
+        """Comme `entrer`, sans bloquer la boucle asyncio."""
+        debut = time.perf_counter()
+        boucle = asyncio.get_running_loop()
+        with self._verrou:
+            if self._place_libre():
+                return self._admettre(debut)
+            obtenue = boucle.create_future()
+
+            def reveil():
+                boucle.call_soon_threadsafe(lambda: obtenue.done() or obtenue.set_result(True))
+
+            self._attente.append(reveil)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(obtenue), self.attente_max)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._verrou:
+                try:
+                    self._attente.remove(reveil)
+                except ValueError:
+                    donnee = True  # la place a été donnée entre-temps
+                else:
+                    donnee = False
+            if isinstance(e, asyncio.CancelledError):
+                # Client parti : la place éventuellement reçue est rendue
+                if donnee:
+                    self._liberer()
+                raise
+            if not donnee:
+                with self._verrou:
+                    raise self._refuser(503, "Service surchargé")
+        return self._admettre(debut)
+
+
+files = {
+    "dossier": Admission.depuis_env("dossier"),
+    "facture": Admission.depuis_env("facture"),
+    # Lots et archives : un seul à la fois, ils occupent tout le pool
+    "lot": Admission.depuis_env("lot", concurrence=1, file=2),
+}
+
+metriques.enregistrer(metriques.Jauge(
+    "eden_admission_file", "Requêtes en attente d'un rendu, par file.", "file",
+    lambda: {nom: f.profondeur() for nom, f in files.items()},
+))
+metriques.enregistrer(metriques.Jauge(
+    "eden_admission_actifs", "Rendus en cours, par file.", "file",
+    lambda: {nom: f.actifs() for nom, f in files.items()},
+))
+
+
+def admission(nom):
+    """Ticket pour un rendu de la famille `nom` (à utiliser avec `with`)."""
+    return files[nom].entrer()
+
+
+async def admission_async(nom):
+    return await files[nom].entrer_async()
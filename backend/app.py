@@ -1,79 +1,413 @@
-from flask import Flask, Response, request, send_file, make_response
+from flask import Flask, Response, g, request
 from flask_cors import CORS
-from creationdossier import create_dossier
-from supabase import create_client
+import hmac
 import json
-from creationfacture import generer_facture_eden_dynamique
-from io import BytesIO
 import os
+from creationfacture import file_uploads
+from cache_pdf import cache_factures, cle_cache
+from donnees import factures_data, invalider_facture
+from executeur import (
+    CHEMIN_ENTETE, TAILLE_POOL, TIMEOUT_RENDU, DelaiDepasse, deballer, pool,
+    rendre_facture, version_facture,
+)
+import metriques
+import profilage
+import routes
+from metriques import etape
+from prerendu import prerendu, secret_valide
+from admission import Refus, admission
+from resilience import Indisponible
+from demarrage import PRECHARGEMENT, demarrer_worker, precharger, premiere_requete
+from archive import bornes_mois, construire_archive, factures_archive
+from collections import deque
+import tempfile
+import zipfile
+import time
+from urllib.parse import quote
 
 app = Flask(__name__)
 CORS(
     app,
     resources={r"/*": {
-        "origins": [
-            "https://eden-tir.vercel.app"
-        ]
+        "origins": list(routes.ORIGINES_AUTORISEES)
     }},
     supports_credentials=True
 )
 
-    
-supabase = create_client(
-    "https://qsuagjwscgsftgfyfket.supabase.co",
-    "sb_publishable_DTloeTjwsaJ4GntCpzRzbQ_pe1Yc2St"  
 
-)
+# Sous gunicorn avec gunicorn.conf.py, le maître ne fait que précharger les
+# ressources : les services et le pool démarrent après le fork, dans chaque
+# worker (post_worker_init). Sinon tout démarre ici, avant la première requête.
+if PRECHARGEMENT:
+    precharger()
+else:
+    demarrer_worker()
+
+MAX_FACTURES_LOT = 500
+
+# Routes d'administration (file d'upload) : en-tête X-Admin-Secret égal à
+# EDEN_ADMIN_SECRET. Sans secret configuré, elles refusent tous les appels.
+SECRET_ADMIN = os.environ.get("EDEN_ADMIN_SECRET", "")
+
+
+def admin_autorise():
+    if not SECRET_ADMIN:
+        return False
+    valeur = request.headers.get("X-Admin-Secret") or ""
+    return hmac.compare_digest(valeur.encode(), SECRET_ADMIN.encode())
+
+
+# ===================== REPONSES PDF =====================
+TAILLE_MORCEAU = 64 * 1024
+
+
+def _morceaux(contenu, taille=TAILLE_MORCEAU):
+    vue = memoryview(contenu)
+    for debut in range(0, len(vue), taille):
+        # Les serveurs WSGI n'acceptent que des bytes : seul le morceau en
+        # cours est copié, jamais le PDF entier
+        yield bytes(vue[debut:debut + taille])
+
+
+def reponse_flask(reponse):
+    """Convertit une `routes.Reponse` ; le corps est envoyé par morceaux, sans copie."""
+    response = Response(
+        _morceaux(reponse.corps), status=reponse.statut, headers=reponse.entetes, direct_passthrough=True
+    )
+    response.content_length = memoryview(reponse.corps).nbytes
+    return response
+
+
+def reponse_refus(refus):
+    """Réponse rapide d'une requête refusée (contrôle d'admission, Supabase indisponible)."""
+    return reponse_flask(routes.reponse_refus(refus))
+
+
+# ===================== METRIQUES =====================
+@app.before_request
+def debut_mesures():
+    g.debut_requete = time.perf_counter()
+    g.jeton_mesures = metriques.debut_collecte()
+
 
+@app.after_request
+def fin_mesures(response):
+    jeton = g.pop("jeton_mesures", None)
+    if jeton is None:
+        return response
+    mesures = metriques.fin_collecte(jeton)
+    duree = time.perf_counter() - g.debut_requete
+    metriques.publier(mesures)
+    metriques.REQUETES.observer(request.endpoint or "inconnue", duree)
+    premiere_requete(duree)
+    response.headers["Server-Timing"] = metriques.server_timing(mesures + [("total", duree)])
+    return response
+
+
+@app.teardown_request
+def nettoyer_mesures(exc):
+    # Requête interrompue par une exception : la collecte ne doit pas fuir
+    # vers la requête suivante servie par le même thread
+    jeton = g.pop("jeton_mesures", None)
+    if jeton is not None:
+        metriques.fin_collecte(jeton)
+
+
+# /metrics exige "Authorization: Bearer <EDEN_METRIQUES_JETON>" (option
+# authorization de Prometheus). Sans jeton configuré, il refuse tous les appels.
+JETON_METRIQUES = os.environ.get("EDEN_METRIQUES_JETON", "")
+
+
+@app.route("/metrics", methods=["GET"])
+def exposer_metriques():
+    valeur = request.headers.get("Authorization") or ""
+    if not JETON_METRIQUES or not hmac.compare_digest(valeur.encode(), f"Bearer {JETON_METRIQUES}".encode()):
+        return {"error": "Non autorisé"}, 401
+    return Response(metriques.exposition(), mimetype="text/plain; version=0.0.4")
+
+
+# Logique commune avec asgi.py : voir routes.py
 @app.route('/generate-pdf', methods=['POST'])
 def handle_pdf():
+    return reponse_flask(routes.executer(routes.dossier(request.get_data(), request.headers)))
+
+
+@app.route("/facture/<int:facture_id>", methods=["GET"])
+def telecharger_facture(facture_id):
+    return reponse_flask(routes.executer(routes.facture(facture_id, request.headers)))
+
+
+class _FluxZip:
+    """Sortie non positionnable pour zipfile : les octets écrits sont
+    récupérés au fur et à mesure pour être envoyés au client."""
+
+    def __init__(self):
+        self.morceaux = []
+
+    def write(self, octets):
+        self.morceaux.append(bytes(octets))
+        return len(octets)
+
+    def flush(self):
+        pass
+
+    def vider(self):
+        morceaux, self.morceaux = self.morceaux, []
+        return b"".join(morceaux)
+
+
+def _rendre_lot(factures, en_avance=None):
+    """Génère (facture_id, numero, contenu | None, erreur | None) au fil des
+    rendus : les PDF en cache sont servis directement, les autres sont rendus
+    dans le pool. Seuls `en_avance` rendus du lot sont en cours à la fois :
+    un rendu interactif n'attend jamais derrière tout le lot."""
+    version = version_facture()
+    executeur = pool() if TAILLE_POOL > 0 else None
+    en_avance = en_avance or max(TAILLE_POOL, 1)
+    en_cours = deque()
+
+    def recevoir():
+        facture_id, numero, cle, futur = en_cours.popleft()
+        try:
+            contenu = deballer(futur.result(timeout=TIMEOUT_RENDU))
+        except DelaiDepasse:
+            futur.cancel()
+            return facture_id, numero, None, "Délai de génération dépassé"
+        except Exception as e:
+            return facture_id, numero, None, str(e)
+        cache_factures.ecrire(cle, contenu)
+        cache_factures.associer(facture_id, cle, numero)
+        return facture_id, numero, contenu, None
+
+    for facture_id, data in factures:
+        numero = data.get("facture", {}).get("numero", facture_id)
+        cle = cle_cache(data, version)
+        contenu = cache_factures.lire(cle)
+        if contenu is not None:
+            cache_factures.associer(facture_id, cle, numero)
+            yield facture_id, numero, contenu, None
+            continue
+        if executeur is None:
+            # Sans pool : rendu dans le thread de la requête
+            try:
+                contenu = deballer(rendre_facture(CHEMIN_ENTETE, data))
+            except Exception as e:
+                yield facture_id, numero, None, str(e)
+                continue
+            cache_factures.ecrire(cle, contenu)
+            cache_factures.associer(facture_id, cle, numero)
+            yield facture_id, numero, contenu, None
+            continue
+        try:
+            futur = executeur.submit(rendre_facture, CHEMIN_ENTETE, data)
+        except Exception as e:
+            yield facture_id, numero, None, str(e)
+            continue
+        en_cours.append((facture_id, numero, cle, futur))
+        if len(en_cours) >= en_avance:
+            yield recevoir()
+
+    while en_cours:
+        yield recevoir()
+
+
+@app.route("/factures/batch", methods=["POST"])
+def factures_lot():
+    body = request.get_json(silent=True) or {}
+    ids = body.get("ids")
+    format_sortie = body.get("format", "zip")
+
+    if not isinstance(ids, list) or not ids:
+        return {"error": "Liste d'ids requise"}, 400
+    if len(ids) > MAX_FACTURES_LOT:
+        return {"error": f"Maximum {MAX_FACTURES_LOT} factures par lot"}, 400
+    if format_sortie not in ("zip", "pdf"):
+        return {"error": "Format inconnu (zip ou pdf)"}, 400
     try:
-        data = request.json
-        if not data:
-            return {"error": "No data provided"}, 400
+        ids = list(dict.fromkeys(int(i) for i in ids))
+    except (TypeError, ValueError):
+        return {"error": "Ids invalides"}, 400
 
-        # Appel de la fonction modifiée qui renvoie un buffer
-        pdf_buffer = create_dossier(data)
-        
-        return send_file(
-            pdf_buffer,
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=f"Dossier_{data.get('dossier_no', 'export')}.pdf"
-        )
-    except Exception as e:
-        print(f"Erreur: {e}")
-        return make_response({"error": str(e)}, 500)
+    try:
+        lignes = factures_data(ids)
+    except Indisponible as e:
+        return reponse_refus(e)
 
+    erreurs = [{"id": i, "error": "Facture introuvable"} for i in ids if not lignes.get(i)]
+    factures = [(i, lignes[i]) for i in ids if lignes.get(i)]
 
+    try:
+        ticket = admission("lot")
+    except Refus as e:
+        return reponse_refus(e)
 
+    if format_sortie == "pdf":
+        # Même construction que les archives : écrite au fil des rendus dans
+        # un fichier temporaire, avec une seule copie de l'entête. Les erreurs
+        # sont jointes au PDF (erreurs.json) : un en-tête serait trop petit
+        fichier = tempfile.TemporaryFile()
+        try:
+            with ticket, etape("archive"):
+                rapport = construire_archive(factures, fichier, erreurs=erreurs)
+        except (Refus, Indisponible) as e:
+            fichier.close()
+            return reponse_refus(e)
+        except Exception:
+            fichier.close()
+            raise
+        if rapport["factures"] == 0:
+            fichier.close()
+            return {"error": "Aucune facture générée", "erreurs": rapport["erreurs"]}, 500
 
-@app.route("/facture/<int:facture_id>", methods=["GET"])
-def telecharger_facture(facture_id):
-    base_path = os.path.dirname(os.path.abspath(__file__))
-    chemin_entete = os.path.join(base_path, "Entete EDEN.pdf")
-
-    res = (
-        supabase
-        .table("factures")
-        .select("data_json")
-        .eq("id", facture_id)
-        .single()
-        .execute()
+        response = reponse_fichier_pdf(fichier, rapport["octets"], "Factures.pdf")
+        response.headers["X-Factures-Erreurs-Nombre"] = str(len(rapport["erreurs"]))
+        return response
+
+    def generer_zip():
+        flux = _FluxZip()
+        with ticket, zipfile.ZipFile(flux, "w", zipfile.ZIP_STORED) as archive:
+            for facture_id, numero, contenu, erreur in _rendre_lot(factures):
+                if erreur:
+                    erreurs.append({"id": facture_id, "error": erreur})
+                    continue
+                archive.writestr(f"Facture_{numero}.pdf", contenu)
+                yield flux.vider()
+            archive.writestr("erreurs.json", json.dumps(erreurs, ensure_ascii=False, indent=2))
+        yield flux.vider()
+
+    response = Response(
+        generer_zip(),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=Factures.zip"}
     )
+    # La place est rendue à la fin du zip, ou à la fermeture si le client part avant
+    response.call_on_close(ticket.liberer)
+    return response
 
-    if not res.data or not res.data.get("data_json"):
-        return {"error": "Facture introuvable"}, 404
 
-    data = res.data["data_json"]
-    numero = data["facture"]["numero"]
+def _lire_fichier(fichier, taille=TAILLE_MORCEAU):
+    with fichier:
+        while True:
+            morceau = fichier.read(taille)
+            if not morceau:
+                return
+            yield morceau
 
-    pdf_buffer = generer_facture_eden_dynamique(chemin_entete, data)
-    pdf_buffer.seek(0)
 
-    return send_file(
-        pdf_buffer,
-        mimetype="application/pdf",
-        as_attachment=True,
-        download_name=f"Facture_{numero}.pdf"
-    )
+def reponse_fichier_pdf(fichier, octets, nom_fichier):
+    """Envoie par morceaux un PDF écrit dans un fichier temporaire (fermé à la fin)."""
+    fichier.seek(0)
+    response = Response(_lire_fichier(fichier), mimetype="application/pdf", direct_passthrough=True)
+    response.content_length = octets
+    response.headers.set("Content-Disposition", "attachment", filename=nom_fichier)
+    return response
+
+
+@app.route("/archives", methods=["GET"])
+def exporter_archive():
+    """Un seul PDF pour toutes les factures d'un client et/ou d'un mois (?client=&mois=AAAA-MM)."""
+    code_client = request.args.get("client")
+    mois = request.args.get("mois")
+    if not code_client and not mois:
+        return {"error": "Paramètre client ou mois requis"}, 400
+    if mois and bornes_mois(mois) is None:
+        return {"error": "Mois invalide (AAAA-MM)"}, 400
+
+    # L'archive est construite dans un fichier temporaire puis envoyée par
+    # morceaux : la mémoire du worker ne dépend pas du nombre de factures
+    fichier = tempfile.TemporaryFile()
+    try:
+        with admission("lot"), etape("archive"):
+            rapport = construire_archive(factures_archive(code_client, mois), fichier)
+    except (Refus, Indisponible) as e:
+        fichier.close()
+        return reponse_refus(e)
+    except Exception:
+        fichier.close()
+        raise
+    if rapport["factures"] == 0:
+        fichier.close()
+        return {"error": "Aucune facture", "erreurs": rapport["erreurs"]}, 404
+
+    nom = "_".join(["Archive"] + [p for p in (code_client, mois) if p]) + ".pdf"
+    response = reponse_fichier_pdf(fichier, rapport["octets"], nom)
+    # Le détail des erreurs est joint au PDF (erreurs.json), seul leur nombre
+    # est dans l'en-tête
+    response.headers["X-Archive-Rapport"] = json.dumps(dict(rapport, erreurs=len(rapport["erreurs"])))
+    return response
+
+
+@app.route("/factures/<int:facture_id>/invalider", methods=["POST"])
+def invalider(facture_id):
+    """Invalidation manuelle (scripts, modifications faites hors de la base) :
+    la prochaine lecture repart de Supabase. Les modifications de la table
+    factures arrivent d'elles-mêmes par le webhook ; même secret que lui."""
+    if not secret_valide(request.headers.get("X-Webhook-Secret")):
+        return {"error": "Non autorisé"}, 401
+    invalider_facture(facture_id)
+    return {"success": True, "id": facture_id}
+
+
+@app.route("/webhooks/factures", methods=["POST"])
+def webhook_factures():
+    """Webhook de base de données Supabase sur la table factures."""
+    if not secret_valide(request.headers.get("X-Webhook-Secret")):
+        return {"error": "Non autorisé"}, 401
+    facture_id = prerendu.recevoir(request.get_json(silent=True))
+    if facture_id is None:
+        return {"error": "Événement ignoré"}, 400
+    return {"success": True, "id": facture_id}, 202
+
+
+@app.route("/uploads/<int:job_id>", methods=["GET"])
+def statut_upload(job_id):
+    if not admin_autorise():
+        return {"error": "Non autorisé"}, 401
+    tache = file_uploads.statut(job_id)
+    if tache is None:
+        return {"error": "Tâche introuvable"}, 404
+    return tache
+
+
+@app.route("/uploads/<int:job_id>/relancer", methods=["POST"])
+def relancer_upload(job_id):
+    """Remet en file un upload en échec (voir file_upload.py)."""
+    if not admin_autorise():
+        return {"error": "Non autorisé"}, 401
+    if file_uploads.statut(job_id) is None:
+        return {"error": "Tâche introuvable"}, 404
+    resultat = file_uploads.relancer(job_id)
+    return resultat, 202 if resultat["success"] else 409
+
+
+@app.route("/uploads", methods=["GET"])
+def liste_uploads():
+    if not admin_autorise():
+        return {"error": "Non autorisé"}, 401
+    fichier = request.args.get("fichier")
+    limite = request.args.get("limite", 50, type=int)
+    return {"uploads": file_uploads.taches(fichier, min(limite, 500))}
+
+
+@app.route("/profils", methods=["GET"])
+def liste_profils():
+    """Profils de rendu enregistrés (voir profilage.py)."""
+    if not profilage.autorise(request.headers.get(profilage.ENTETE)):
+        return {"error": "Profilage désactivé ou non autorisé"}, 404
+    return {"profils": profilage.index()}
+
+
+@app.route("/profils/<nom>", methods=["GET"])
+def telecharger_profil(nom):
+    if not profilage.autorise(request.headers.get(profilage.ENTETE)):
+        return {"error": "Profilage désactivé ou non autorisé"}, 404
+    chemin = profilage.chemin_profil(nom)
+    if chemin is None:
+        return {"error": "Profil introuvable"}, 404
+    if request.args.get("format") == "texte":
+        return Response(profilage.texte(chemin), mimetype="text/plain; charset=utf-8")
+    with open(chemin, "rb") as f:
+        contenu = f.read()
+    response = Response(contenu, mimetype="application/octet-stream")
+    response.headers.set("Content-Disposition", "attachment", filename=nom)
+    return response
@@ -0,0 +1,443 @@
+"""Export d'archives PDF : toutes les factures d'un client et/ou d'un mois.
+
+Usage :
+    python archive.py --client C0042 --mois 2026-10 -o archive.pdf
+    python archive.py --json factures.json -o archive.pdf   # hors ligne
+
+Affiche un rapport de taille et de débit.
+"""
+import argparse
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+
+from pypdf import PdfReader
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+# ===================== EXPORT D'ARCHIVES =====================
+# Une archive est un seul PDF où chaque page pose l'entête comme un form
+# XObject unique, écrit une seule fois : 300 factures ne contiennent qu'une
+# copie de l'image de l'entête au lieu de 300.
+#
+# Le PDF est écrit objet par objet dans un fichier au fil des rendus
+# (EcrivainPdf) : seuls les offsets des objets restent en mémoire, quel que
+# soit le nombre de factures. Les overlays (textes, QR code) sont dessinés
+# dans le pool de processus, quelques-uns en avance sur l'écriture.
+#
+# DocumentEntete (une suite de pages posées sur l'entête) sert aussi au PDF
+# d'une seule facture, écrit page par page (voir creationfacture.py).
+
+TAILLE_LOT_LECTURE = 100
+NOM_ENTETE = "EdenEntete"
+
+_MOIS = re.compile(r"^(\d{4})-(\d{2})$")
+
+
+class EcrivainPdf:
+    """Écrit un PDF objet par objet dans un flux, sans retour en arrière."""
+
+    def __init__(self, flux, niveau=6, debut=None):
+        """`debut` : (octets, état) d'un début de document déjà écrit (voir `etat`)."""
+        self.flux = flux
+        self.niveau = niveau
+        self.position = 0
+        self.offsets = {}
+        self._prochain = 1
+        if debut is None:
+            self._ecrire(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        else:
+            octets, (offsets, prochain) = debut
+            self._ecrire(octets)
+            self.offsets.update(offsets)
+            self._prochain = prochain
+
+    def etat(self):
+        """Objets écrits et prochain numéro, pour reprendre ce début ailleurs."""
+        return dict(self.offsets), self._prochain
+
+    def _ecrire(self, octets):
+        self.flux.write(octets)
+        self.position += len(octets)
+
+    def reserver(self):
+        numero = self._prochain
+        self._prochain += 1
+        return numero
+
+    def objet(self, numero, corps):
+        self.offsets[numero] = self.position
+        self._ecrire(b"%d 0 obj\n%s\nendobj\n" % (numero, corps))
+
+    def flux_objet(self, numero, entrees, donnees, compresser=True):
+        """Objet flux : `entrees` est le contenu du dictionnaire (sans /Length)."""
+        if compresser:
+            donnees = zlib.compress(donnees, self.niveau)
+            entrees += b" /Filter /FlateDecode"
+        self.offsets[numero] = self.position
+        self._ecrire(b"%d 0 obj\n<< %s /Length %d >>\nstream\n" % (numero, entrees, len(donnees)))
+        self._ecrire(donnees)
+        self._ecrire(b"\nendstream\nendobj\n")
+
+    def terminer(self, racine, info=None, ident=None):
+        debut_xref = self.position
+        lignes = [b"xref\n0 %d\n0000000000 65535 f \n" % self._prochain]
+        for numero in range(1, self._prochain):
+            lignes.append(b"%010d 00000 n \n" % self.offsets[numero])
+        self._ecrire(b"".join(lignes))
+        trailer = b"/Size %d /Root %d 0 R" % (self._prochain, racine)
+        if info is not None:
+            trailer += b" /Info %d 0 R" % info
+        if ident is not None:
+            # Les deux moitiés de /ID sont égales pour un document écrit d'un seul jet
+            trailer += b" /ID [<%s> <%s>]" % (ident.hex().encode(), ident.hex().encode())
+        self._ecrire(b"trailer\n<< %s >>\nstartxref\n%d\n%%%%EOF\n" % (trailer, debut_xref))
+
+
+class _Copieur:
+    """Recopie des objets pypdf (et tout ce qu'ils référencent) dans un EcrivainPdf."""
+
+    def __init__(self, ecrivain):
+        self.ecrivain = ecrivain
+        self._numeros = {}
+        self._a_ecrire = deque()
+
+    def reference(self, indirect):
+        numero = self._numeros.get(indirect.idnum)
+        if numero is None:
+            numero = self._numeros[indirect.idnum] = self.ecrivain.reserver()
+            self._a_ecrire.append((numero, indirect.get_object()))
+        return numero
+
+    def entrees(self, dictionnaire, exclure=()):
+        return b" ".join(
+            self.serialiser(cle) + b" " + self.serialiser(valeur)
+            for cle, valeur in dictionnaire.items() if cle not in exclure
+        )
+
+    def serialiser(self, obj):
+        if isinstance(obj, IndirectObject):
+            return b"%d 0 R" % self.reference(obj)
+        if isinstance(obj, DictionaryObject):
+            return b"<< " + self.entrees(obj) + b" >>"
+        if isinstance(obj, ArrayObject):
+            return b"[" + b" ".join(self.serialiser(valeur) for valeur in obj) + b"]"
+        tampon = io.BytesIO()
+        obj.write_to_stream(tampon)
+        return tampon.getvalue()
+
+    def vider(self):
+        """Écrit les objets référencés qui ne l'ont pas encore été."""
+        while self._a_ecrire:
+            numero, obj = self._a_ecrire.popleft()
+            if isinstance(obj, StreamObject):
+                # Données encodées recopiées telles quelles (JPEG de l'entête...)
+                entrees = self.entrees(obj, exclure=("/Length",))
+                self.ecrivain.flux_objet(numero, entrees, obj._data, compresser=False)
+            else:
+                self.ecrivain.objet(numero, self.serialiser(obj))
+
+
+def _nombres(valeurs):
+    return b" ".join(("%.4f" % float(v)).rstrip("0").rstrip(".").encode() for v in valeurs)
+
+
+def _texte_pdf(texte):
+    return b"(" + texte.encode("latin-1").replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+# Début commun à tous les documents posés sur un même entête (numéros
+# d'objets fixes) : écrit une fois par processus, recopié ensuite.
+_debuts = {}
+_verrou_debuts = threading.Lock()
+NUMERO_PAGES, NUMERO_ENTETE = 1, 2
+
+
+def _debut_document(chemin_entete, niveau):
+    """(octets, état, boîte) du début de document : en-tête du fichier, form
+    XObject de l'entête et ses ressources (l'image)."""
+    from entete import registre as registre_entetes
+
+    cle = (chemin_entete, registre_entetes.version(chemin_entete), niveau)
+    debut = _debuts.get(cle)
+    if debut is not None:
+        return debut
+    with _verrou_debuts:
+        debut = _debuts.get(cle)
+        if debut is None:
+            tampon = io.BytesIO()
+            ecrivain = EcrivainPdf(tampon, niveau)
+            ecrivain.reserver()  # NUMERO_PAGES, écrit par terminer()
+            ecrivain.reserver()  # NUMERO_ENTETE
+            entete = PdfReader(io.BytesIO(registre_entetes.contenu(chemin_entete))).pages[0]
+            boite = _nombres(float(v) for v in entete.mediabox)
+            copieur = _Copieur(ecrivain)
+            ressources = copieur.serialiser(entete["/Resources"]) if "/Resources" in entete else b"<< >>"
+            ecrivain.flux_objet(
+                NUMERO_ENTETE,
+                b"/Type /XObject /Subtype /Form /BBox [%s] /Resources %s" % (boite, ressources),
+                entete.get_contents().get_data(),
+            )
+            copieur.vider()
+            # Une seule version gardée par entête et niveau
+            for ancienne in [c for c in _debuts if c[0] == chemin_entete and c[2] == niveau]:
+                del _debuts[ancienne]
+            debut = _debuts[cle] = (tampon.getvalue(), ecrivain.etat(), boite)
+    return debut
+
+
+class DocumentEntete:
+    """PDF écrit page par page dans un flux, l'entête posé sous chaque page.
+
+    L'entête est un form XObject écrit une seule fois. Les pages arrivent
+    comme (flux de contenu, {nom: (police, encodage)}) (voir pages_pdf) et
+    sont écrites aussitôt : seuls leurs numéros d'objet restent en mémoire.
+    """
+
+    def __init__(self, flux, chemin_entete=None, compresser=True, niveau=6):
+        from executeur import CHEMIN_ENTETE
+
+        octets, etat, self._boite = _debut_document(os.path.abspath(chemin_entete or CHEMIN_ENTETE), niveau)
+        self.compresser = compresser
+        self.ecrivain = EcrivainPdf(flux, niveau, debut=(octets, etat))
+        self.taille_entete = self.ecrivain.position
+        self.pages = 0
+        self._numero_pages = NUMERO_PAGES
+        self._numero_entete = NUMERO_ENTETE
+        self._polices = {}
+        self._kids = []
+        self._pieces_jointes = []
+
+    def _police(self, cle):
+        numero = self._polices.get(cle)
+        if numero is None:
+            numero = self._polices[cle] = self.ecrivain.reserver()
+            self.ecrivain.objet(
+                numero,
+                b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /%s >>" % (cle[0].encode(), cle[1].encode()),
+            )
+        return numero
+
+    def ajouter_page(self, contenu, polices):
+        refs = b" ".join(b"/%s %d 0 R" % (nom.encode(), self._police(cle)) for nom, cle in polices.items())
+        numero_contenu = self.ecrivain.reserver()
+        self.ecrivain.flux_objet(
+            numero_contenu, b"",
+            b"q /%s Do Q\nq\n%s\nQ\n" % (NOM_ENTETE.encode(), contenu),
+            compresser=self.compresser,
+        )
+        numero_page = self.ecrivain.reserver()
+        self.ecrivain.objet(numero_page, (
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [%s] /Contents %d 0 R "
+            b"/Resources << /Font << %s >> /XObject << /%s %d 0 R >> /ProcSet [/PDF /Text] >> >>"
+        ) % (self._numero_pages, self._boite, numero_contenu, refs, NOM_ENTETE.encode(), self._numero_entete))
+        self._kids.append(numero_page)
+        self.pages += 1
+
+    def joindre(self, nom, octets, type_mime):
+        """Joint un fichier au document (pièce jointe, listée par les lecteurs PDF)."""
+        ecrivain = self.ecrivain
+        numero_fichier = ecrivain.reserver()
+        ecrivain.flux_objet(
+            numero_fichier, b"/Type /EmbeddedFile /Subtype /%s" % type_mime.replace("/", "#2F").encode(),
+            octets, compresser=self.compresser,
+        )
+        numero_spec = ecrivain.reserver()
+        ecrivain.objet(numero_spec, b"<< /Type /Filespec /F %s /UF %s /EF << /F %d 0 R >> >>" % (
+            _texte_pdf(nom), _texte_pdf(nom), numero_fichier))
+        self._pieces_jointes.append((nom, numero_spec))
+
+    def terminer(self, info=None, ident=None):
+        """Écrit l'arbre des pages, le catalogue et la fin du fichier.
+
+        `info` : {clé: texte} du dictionnaire /Info ; `ident` : /ID (octets).
+        Retourne la taille du PDF.
+        """
+        ecrivain = self.ecrivain
+        ecrivain.objet(self._numero_pages, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            b" ".join(b"%d 0 R" % k for k in self._kids), len(self._kids)))
+        racine = ecrivain.reserver()
+        catalogue = b"/Type /Catalog /Pages %d 0 R" % self._numero_pages
+        if self._pieces_jointes:
+            # Le tableau /Names doit être trié par nom
+            noms = b" ".join(b"%s %d 0 R" % (_texte_pdf(nom), numero) for nom, numero in sorted(self._pieces_jointes))
+            catalogue += b" /Names << /EmbeddedFiles << /Names [%s] >> >>" % noms
+        ecrivain.objet(racine, b"<< %s >>" % catalogue)
+        numero_info = ecrivain.reserver()
+        info = info or {"Producer": "EDEN TIR"}
+        ecrivain.objet(numero_info, b"<< %s >>" % b" ".join(
+            b"/%s %s" % (cle.encode(), _texte_pdf(valeur)) for cle, valeur in info.items()))
+        ecrivain.terminer(racine, numero_info, ident)
+        return ecrivain.position
+
+
+# ---------- rendu des overlays (processus du pool) ----------
+def pages_pdf(contenu):
+    """Pages d'un PDF ReportLab sans image : [(flux de contenu, {nom: (police, encodage)}), ...]."""
+    pages = []
+    for page in PdfReader(io.BytesIO(contenu)).pages:
+        polices = {}
+        for nom, police in page["/Resources"].get("/Font", {}).items():
+            police = police.get_object()
+            polices[str(nom)[1:]] = (str(police["/BaseFont"])[1:], str(police.get("/Encoding", "/WinAnsiEncoding"))[1:])
+        pages.append((page.get_contents().get_data(), polices))
+    return pages
+
+
+def pages_facture(data):
+    """Overlay de la facture, page par page : [(flux de contenu, {nom: (police, encodage)}), ...]."""
+    from creationfacture import dessiner_facture, fichier_facture
+
+    _, url = fichier_facture(data)
+    pages = []
+    dessiner_facture(data, url, lambda contenu, polices: pages.append((contenu, polices)))
+    return pages
+
+
+# ---------- construction ----------
+def construire_archive(factures, flux, chemin_entete=None, en_avance=None, erreurs=None):
+    """Écrit dans `flux` l'archive des `factures` [(facture_id, data_json), ...].
+
+    Les erreurs (celles déjà connues, `erreurs`, puis celles des rendus) sont
+    jointes au PDF dans erreurs.json, comme dans les lots au format zip.
+    Retourne le rapport de construction (tailles, débit, erreurs).
+    """
+    from executeur import TAILLE_POOL, TIMEOUT_RENDU, pool
+
+    en_avance = en_avance or 2 * max(TAILLE_POOL, 1)
+    debut = time.perf_counter()
+
+    document = DocumentEntete(flux, chemin_entete)
+    taille_entete = document.taille_entete
+    rapport = {"factures": 0, "pages": 0, "erreurs": list(erreurs or [])}
+
+    def ecrire_facture(facture_id, pages):
+        for contenu, polices_page in pages:
+            document.ajouter_page(contenu, polices_page)
+        rapport["factures"] += 1
+        rapport["pages"] += len(pages)
+
+    # --- factures : rendues dans le pool, écrites dans l'ordre ---
+    executeur = pool() if TAILLE_POOL > 0 else None
+    en_cours = deque()
+
+    def recevoir():
+        facture_id, futur = en_cours.popleft()
+        try:
+            pages = futur.result(timeout=TIMEOUT_RENDU) if executeur else futur()
+        except Exception as e:
+            rapport["erreurs"].append({"id": facture_id, "error": str(e)})
+            return
+        ecrire_facture(facture_id, pages)
+
+    for facture_id, data in factures:
+        if executeur:
+            en_cours.append((facture_id, executeur.submit(pages_facture, data)))
+        else:
+            en_cours.append((facture_id, lambda data=data: pages_facture(data)))
+        if len(en_cours) >= en_avance:
+            recevoir()
+    while en_cours:
+        recevoir()
+
+    document.joindre(
+        "erreurs.json", json.dumps(rapport["erreurs"], ensure_ascii=False, indent=2).encode(), "application/json"
+    )
+    octets = document.terminer({"Producer": "EDEN TIR - archive"})
+
+    duree = time.perf_counter() - debut
+    n = rapport["factures"]
+    rapport.update({
+        "octets": octets,
+        "octets_entete": taille_entete,
+        # Taille qu'aurait l'archive avec une copie de l'entête par facture
+        "octets_sans_partage": octets + max(n - 1, 0) * taille_entete,
+        "octets_par_facture": round(octets / n) if n else 0,
+        "duree_s": round(duree, 3),
+        "factures_par_s": round(n / duree, 2) if duree else 0,
+    })
+    return rapport
+
+
+# ---------- lecture des factures ----------
+def bornes_mois(mois):
+    """"2026-10" -> ("2026-10", "2026-11"), ou None si le format est invalide."""
+    m = _MOIS.match(mois or "")
+    if not m or not 1 <= int(m.group(2)) <= 12:
+        return None
+    annee, numero = int(m.group(1)), int(m.group(2))
+    suivant = f"{annee + 1}-01" if numero == 12 else f"{annee}-{numero + 1:02d}"
+    return mois, suivant
+
+
+def factures_archive(code_client=None, mois=None):
+    """Factures (id, data_json) d'un client et/ou d'un mois, lues par lots et triées par date."""
+    from donnees import client, lire
+
+    debut = 0
+    while True:
+        requete = client().table("factures").select("id, data_json")
+        if code_client:
+            requete = requete.eq("data_json->client->>code_client", code_client)
+        if mois:
+            premier, suivant = bornes_mois(mois)
+            requete = requete.gte("data_json->facture->>date", premier).lt("data_json->facture->>date", suivant)
+        requete = (
+            requete
+            .order("data_json->facture->>date")
+            .order("id")
+            .range(debut, debut + TAILLE_LOT_LECTURE - 1)
+        )
+        res = lire(requete)
+        lignes = res.data or []
+        for ligne in lignes:
+            if ligne.get("data_json"):
+                yield ligne["id"], ligne["data_json"]
+        if len(lignes) < TAILLE_LOT_LECTURE:
+            return
+        debut += TAILLE_LOT_LECTURE
+
+
+def afficher_rapport(rapport):
+    mo = 1024 * 1024
+    print(f"Factures            : {rapport['factures']} ({rapport['pages']} pages)")
+    print(f"Taille              : {rapport['octets'] / mo:.2f} Mo "
+          f"({rapport['octets_par_facture'] / 1024:.1f} Ko par facture)")
+    print(f"Entête (une fois)   : {rapport['octets_entete'] / 1024:.1f} Ko")
+    print(f"Sans partage        : {rapport['octets_sans_partage'] / mo:.2f} Mo")
+    print(f"Durée               : {rapport['duree_s']:.2f} s ({rapport['factures_par_s']:.1f} factures/s)")
+    for erreur in rapport["erreurs"]:
+        print(f"  Erreur facture {erreur['id']} : {erreur['error']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--client", help="code client (data_json.client.code_client)")
+    parser.add_argument("--mois", help="mois de facturation, AAAA-MM")
+    parser.add_argument("--json", metavar="FICHIER", help="liste de data_json à archiver, sans Supabase")
+    parser.add_argument("-o", "--sortie", required=True, help="fichier PDF à écrire")
+    args = parser.parse_args(argv)
+
+    if args.json:
+        with open(args.json) as f:
+            factures = list(enumerate(json.load(f), start=1))
+    elif args.client or args.mois:
+        if args.mois and bornes_mois(args.mois) is None:
+            parser.error("--mois doit être au format AAAA-MM")
+        factures = factures_archive(args.client, args.mois)
+    else:
+        parser.error("--client, --mois ou --json requis")
+
+    with open(args.sortie, "wb") as flux:
+        rapport = construire_archive(factures, flux)
+    afficher_rapport(rapport)
+    return 1 if rapport["erreurs"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
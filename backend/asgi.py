@@ -0,0 +1,153 @@
+import re
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import Headers
+
+import metriques
+import routes
+from app import app as application_flask
+from demarrage import demarrer_worker, premiere_requete
+
+# ===================== MODE ASGI =====================
+# /generate-pdf et /facture/<id> sont servies par une boucle asyncio : la
+# lecture Supabase se fait avec le client asynchrone et le rendu part dans le
+# pool de processus sans bloquer la boucle. Un worker garde ainsi de
+# nombreuses requêtes en vol, et la lecture de la suivante se fait pendant le
+# rendu de la précédente. L'upload reste confié à la file persistante
+# (file_upload.py), déjà hors du temps de réponse.
+#
+# La logique de ces deux routes est celle de app.py (routes.py) ; ce module ne
+# fait que l'adapter au protocole ASGI. Toutes les autres routes sont celles
+# de l'app Flask, servies telles quelles par WsgiToAsgi (une à la fois par
+# worker, dans un thread : elles ne sont pas sur le chemin critique).
+#
+# Lancement : WEB_CONCURRENCY=2 uvicorn asgi:app --host 0.0.0.0 --port 8000
+# (uvicorn lit WEB_CONCURRENCY comme --workers ; executeur.py aussi, pour
+# partager les cœurs entre les pools de rendu des workers)
+
+TAILLE_MORCEAU = 64 * 1024
+TAILLE_CORPS_MAX = 1024 * 1024
+
+_ROUTE_FACTURE = re.compile(r"^/facture/(\d+)$")
+
+_flask = WsgiToAsgi(application_flask)
+
+
+async def _router(methode, chemin, entetes, receive):
+    """Retourne (nom de la route, réponse) ; les noms sont ceux des vues Flask."""
+    if chemin == "/generate-pdf":
+        corps = await _lire_corps(receive)
+        if corps is None:
+            return "handle_pdf", routes.reponse_json(413, {"error": "Requête trop volumineuse"})
+        return "handle_pdf", await routes.executer_async(routes.dossier(corps, entetes))
+
+    facture = routes.facture(int(_ROUTE_FACTURE.match(chemin).group(1)), entetes)
+    return "telecharger_facture", await routes.executer_async(facture)
+
+
+def _asynchrone(methode, chemin):
+    """Vrai pour les requêtes servies ici plutôt que par l'app Flask."""
+    if chemin == "/generate-pdf":
+        return methode in ("POST", "OPTIONS")
+    return _ROUTE_FACTURE.match(chemin) is not None and methode in ("GET", "OPTIONS")
+
+
+# ---------- protocole ASGI ----------
+async def _lire_corps(receive):
+    morceaux = []
+    taille = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return b""
+        morceau = message.get("body", b"")
+        taille += len(morceau)
+        if taille > TAILLE_CORPS_MAX:
+            return None
+        morceaux.append(morceau)
+        if not message.get("more_body"):
+            return b"".join(morceaux)
+
+
+def _entetes_cors(entetes, preflight=False):
+    origine = entetes.get("Origin")
+    if origine not in routes.ORIGINES_AUTORISEES:
+        return []
+    cors = [
+        ("Access-Control-Allow-Origin", origine),
+        ("Access-Control-Allow-Credentials", "true"),
+        ("Vary", "Origin"),
+    ]
+    if preflight:
+        cors += [
+            ("Access-Control-Allow-Methods", "GET, POST, OPTIONS"),
+            ("Access-Control-Allow-Headers", entetes.get("Access-Control-Request-Headers", "")),
+        ]
+    return cors
+
+
+async def _envoyer(send, reponse):
+    vue = memoryview(reponse.corps)
+    entetes = reponse.entetes + [("Content-Length", str(vue.nbytes))]
+    await send({
+        "type": "http.response.start",
+        "status": reponse.statut,
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in entetes],
+    })
+    if vue.nbytes == 0:
+        await send({"type": "http.response.body", "body": b""})
+        return
+    for debut in range(0, vue.nbytes, TAILLE_MORCEAU):
+        fin = debut + TAILLE_MORCEAU
+        await send({
+            "type": "http.response.body",
+            "body": bytes(vue[debut:fin]),
+            "more_body": fin < vue.nbytes,
+        })
+
+
+async def _cycle_de_vie(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            # Déjà fait à l'import de app.py, sauf si l'app a été préchargée
+            demarrer_worker()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _cycle_de_vie(receive, send)
+    if scope["type"] != "http":
+        return
+    if not _asynchrone(scope["method"], scope["path"]):
+        return await _flask(scope, receive, send)
+
+    entetes = Headers([(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]])
+    methode = scope["method"]
+
+    if methode == "OPTIONS":
+        return await _envoyer(send, routes.Reponse(200, entetes=_entetes_cors(entetes, preflight=True)))
+
+    debut = time.perf_counter()
+    jeton = metriques.debut_collecte()
+    route = "inconnue"
+    try:
+        route, reponse = await _router(methode, scope["path"], entetes, receive)
+    except Exception as e:
+        print(f"Erreur: {e}")
+        reponse = routes.reponse_json(500, {"error": str(e)})
+    finally:
+        mesures = metriques.fin_collecte(jeton)
+
+    duree = time.perf_counter() - debut
+    metriques.publier(mesures)
+    metriques.REQUETES.observer(route, duree)
+    premiere_requete(duree)
+    reponse.entetes += _entetes_cors(entetes)
+    reponse.entetes.append(("Server-Timing", metriques.server_timing(mesures + [("total", duree)])))
+    await _envoyer(send, reponse)
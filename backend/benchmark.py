@@ -0,0 +1,217 @@
+"""Micro-benchmarks des chemins chauds du rendu PDF.
+
+Usage :
+    python benchmark.py                         # affiche les mesures
+    python benchmark.py --save base.json        # enregistre une référence
+    python benchmark.py --compare base.json     # échoue (code 1) si régression
+
+Supabase n'est jamais appelé : la file d'upload est remplacée par un stub
+local et le QR code pointe vers une URL fictive.
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# La file d'upload ne doit rien écrire hors d'un répertoire temporaire
+_TMP = tempfile.mkdtemp(prefix="eden_bench_")
+os.environ.setdefault("EDEN_UPLOAD_DB", os.path.join(_TMP, "uploads.sqlite3"))
+os.environ.setdefault("EDEN_UPLOAD_SPOOL", os.path.join(_TMP, "spool"))
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas
+
+import creationdossier
+import creationfacture
+from executeur import CHEMIN_ENTETE, initialiser_processus
+
+URL_QR = "https://example.invalid/storage/v1/object/public/Facture/facture_BENCH.pdf"
+
+
+class _UploadsLocaux:
+    """Remplace la file d'upload : garde seulement la taille des PDF soumis."""
+
+    def __init__(self):
+        self.tailles = []
+
+    def soumettre(self, contenu, fichier):
+        self.tailles.append(len(contenu))
+        return len(self.tailles)
+
+
+creationfacture.file_uploads = _UploadsLocaux()
+
+
+# ===================== JEUX DE DONNEES =====================
+def _lignes(prefixe, n):
+    return [
+        {"label": f"{prefixe} {i} - frais de manutention et de passage portuaire", "montant": 12.5 + i}
+        for i in range(n)
+    ]
+
+
+def facture(n_lignes, mode):
+    return {
+        "client": {"code_client": "C0042", "nom": "Société Méditerranéenne de Négoce",
+                   "adresse": "12 rue de Marseille, 1000 Tunis", "code_tva": "1234567/A/M/000"},
+        "facture": {"numero": "F-2026-0123", "date": "2026-10-01T10:00:00", "mode": mode,
+                    "dossier_no": "D-2026-0456", "navire": "MSC ISTANBUL", "date_arrivee": "2026-09-28",
+                    "conteneur": "MSCU1234567", "marque": "SMN", "declaration_c": "123456",
+                    "declaration_uc": "654321", "escale": "2026/812", "rubrique": "12",
+                    "colisage": "24 palettes", "poids_brut": "18 450 kg", "valeur_douane": "125 300.000"},
+        "lignes": {"debours": _lignes("Débours", n_lignes), "transit": _lignes("Transit", n_lignes),
+                   "transport": _lignes("Transport", n_lignes)},
+        "totaux": {"total_non_taxable": 1523.5, "total_taxable": 842.0, "tva_7": 12.6,
+                   "tva_19": 136.2, "timbre": 1.0, "total_final": 2515.3},
+    }
+
+
+def dossier(texte_long, mode):
+    repetitions = 6 if texte_long else 1
+    return {
+        "dossier_no": "D-2026-0456", "mode": mode,
+        "expediteur": "SOCIETE GENERALE D'IMPORTATION ZONE INDUSTRIELLE " * repetitions,
+        "destinataire": "SOCIETE MEDITERRANEENNE DE NEGOCE RUE DE MARSEILLE " * repetitions,
+        "marchandise": "PIECES DETACHEES AUTOMOBILES " * repetitions,
+        "nature_chargement": "complet", "agent_marit": "MSC TUNISIE", "magasin": "STAM",
+        "port_emb": "GENES", "date_emb": "2026-09-20", "port_dest": "RADES", "date_dest": "2026-09-28",
+        "ctu_lta": "MSCU1234567", "navire": "MSC ISTANBUL", "escale": "2026/812", "rubrique": "12",
+        "colisage": "24 palettes", "pb": "18 450", "valeur_devise": "40 000 EUR",
+        "valeur_dinars": "125 300.000", "dg": "D-17", "type_declaration": "IM4",
+        "declaration_no": "123456", "date_declaration": "2026-09-29", "repertoire": "R-88",
+        "banque": "BIAT",
+    }
+
+
+# ===================== CAS MESURES =====================
+def _cas_facture(n_lignes, mode):
+    data = facture(n_lignes, mode)
+
+    return {
+        f"facture.complete[{n_lignes}l,{mode}]":
+            lambda: creationfacture.generer_facture_eden_dynamique(CHEMIN_ENTETE, data),
+        f"facture.dessin[{n_lignes}l,{mode}]":
+            lambda: creationfacture.dessiner_facture(data, URL_QR, lambda contenu, polices: None),
+        f"facture.ecriture[{n_lignes}l,{mode}]":
+            lambda: creationfacture.ecrire_facture(CHEMIN_ENTETE, data, URL_QR, io.BytesIO()),
+    }
+
+
+def _qr_froid():
+    creationfacture.segments_qr.cache_clear()
+    creationfacture.segments_qr(URL_QR)
+
+
+def _qr_dessin():
+    c = canvas.Canvas(io.BytesIO(), pagesize=A4)
+    creationfacture.dessiner_qr(c, URL_QR, 10*mm, A4[1]-40*mm, 30*mm)
+
+
+def cas():
+    mesures = {}
+    for texte_long in (False, True):
+        for mode in ("import", "export"):
+            data = dossier(texte_long, mode)
+            nom = f"dossier[{'long' if texte_long else 'court'},{mode}]"
+            mesures[nom] = lambda data=data: creationdossier.create_dossier(data)
+    for n_lignes in (3, 60):
+        for mode in ("import", "export"):
+            mesures.update(_cas_facture(n_lignes, mode))
+    mesures["qr.matrice_froide"] = _qr_froid
+    mesures["qr.dessin"] = _qr_dessin
+    mesures["montant_en_lettres"] = lambda: creationfacture.montant_en_lettres(123456.789)
+    return mesures
+
+
+# ===================== MESURE =====================
+def mesurer(fonction, repetitions, echauffement=2):
+    for _ in range(echauffement):
+        fonction()
+
+    durees = []
+    gc.collect()
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        fonction()
+        durees.append(time.perf_counter() - debut)
+
+    # Passe séparée : tracemalloc ralentit fortement l'exécution
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    avant, _ = tracemalloc.get_traced_memory()
+    fonction()
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "median_ms": statistics.median(durees) * 1000,
+        "min_ms": min(durees) * 1000,
+        "moyenne_ms": statistics.fmean(durees) * 1000,
+        "pic_alloc_ko": (pic - avant) / 1024,
+    }
+
+
+def comparer(resultats, reference, tolerance):
+    regressions = []
+    for nom, mesure in resultats.items():
+        base = reference.get(nom)
+        if base is None:
+            continue
+        limite = base["median_ms"] * (1 + tolerance)
+        if mesure["median_ms"] > limite:
+            regressions.append(
+                f"{nom} : {mesure['median_ms']:.3f} ms > {limite:.3f} ms "
+                f"(référence {base['median_ms']:.3f} ms)"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--repetitions", type=int, default=30)
+    parser.add_argument("-k", "--filtre", default="", help="ne mesure que les cas contenant ce texte")
+    parser.add_argument("--save", metavar="FICHIER", help="enregistre les mesures comme référence")
+    parser.add_argument("--compare", metavar="FICHIER", help="compare à une référence enregistrée")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="écart relatif toléré sur la médiane (défaut : 0.25)")
+    args = parser.parse_args(argv)
+    # Mêmes réglages ReportLab que dans les processus de rendu
+    initialiser_processus(prechauffer=False)
+
+    resultats = {}
+    print(f"{'cas':<42} {'médiane':>10} {'min':>10} {'moyenne':>10} {'pic alloc':>12}")
+    for nom, fonction in cas().items():
+        if args.filtre not in nom:
+            continue
+        m = mesurer(fonction, args.repetitions)
+        resultats[nom] = m
+        print(f"{nom:<42} {m['median_ms']:>8.3f}ms {m['min_ms']:>8.3f}ms "
+              f"{m['moyenne_ms']:>8.3f}ms {m['pic_alloc_ko']:>9.1f} Ko")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(resultats, f, indent=2, sort_keys=True)
+        print(f"Référence enregistrée dans {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+        regressions = comparer(resultats, reference, args.tolerance)
+        if regressions:
+            print("\nRégressions :")
+            for ligne in regressions:
+                print(f"  {ligne}")
+            return 1
+        print("\nAucune régression par rapport à la référence.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
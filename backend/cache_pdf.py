@@ -0,0 +1,204 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# ===================== CACHE DES PDF GENERES =====================
+# Cache adressé par contenu : la clé est un hash du `data_json` de la facture
+# et de la version du gabarit (entête + code de rendu). Deux niveaux :
+#   - un LRU borné en mémoire, propre à chaque worker ;
+#   - un répertoire sur disque partagé par tous les workers gunicorn, élagué
+#     en arrière-plan : les PDF non lus depuis EDEN_CACHE_DISQUE_JOURS sont
+#     supprimés, puis les plus anciens tant que le total dépasse
+#     EDEN_CACHE_DISQUE_MO (une lecture sur disque rafraîchit la date du fichier).
+#
+# Le cache garde aussi, par facture, la clé du dernier PDF servi (alias
+# facture_id -> clé) : si Supabase est indisponible, ce PDF est servi tel
+# quel, même si la facture a pu changer depuis (voir resilience.py).
+
+CACHE_DIR = os.environ.get(
+    "EDEN_CACHE_DIR", os.path.join(tempfile.gettempdir(), "eden_factures")
+)
+CACHE_TAILLE_MEMOIRE = int(os.environ.get("EDEN_CACHE_TAILLE", "64"))
+CACHE_DISQUE_MO = float(os.environ.get("EDEN_CACHE_DISQUE_MO", "1024"))
+CACHE_DISQUE_JOURS = float(os.environ.get("EDEN_CACHE_DISQUE_JOURS", "30"))
+# Secondes entre deux élagages lancés par un même processus
+INTERVALLE_ELAGAGE = 600
+# Fichiers temporaires laissés par une écriture interrompue
+AGE_MAX_TEMPORAIRE = 3600
+# Alias déjà écrits sur disque, retenus en mémoire pour ne pas les réécrire
+TAILLE_ALIAS_MEMOIRE = 4096
+
+
+def cle_cache(data, version):
+    brut = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    h = hashlib.sha256()
+    h.update(version.encode("utf-8"))
+    h.update(b"\0")
+    h.update(brut.encode("utf-8"))
+    return h.hexdigest()
+
+
+class CachePdf:
+    def __init__(self, dossier=CACHE_DIR, taille_max=CACHE_TAILLE_MEMOIRE,
+                 disque_mo=CACHE_DISQUE_MO, disque_jours=CACHE_DISQUE_JOURS):
+        self.dossier = dossier
+        self.taille_max = taille_max
+        self.disque_octets = disque_mo * 1024 * 1024
+        self.disque_age = disque_jours * 86400
+        self._dernier_elagage = None
+        self._verrou_elagage = threading.Lock()
+        self._memoire = OrderedDict()
+        self._alias = OrderedDict()
+        self._verrou = threading.Lock()
+
+    def _chemin(self, cle):
+        return os.path.join(self.dossier, cle[:2], f"{cle}.pdf")
+
+    def lire(self, cle):
+        with self._verrou:
+            contenu = self._memoire.get(cle)
+            if contenu is not None:
+                self._memoire.move_to_end(cle)
+                return contenu
+
+        chemin = self._chemin(cle)
+        try:
+            with open(chemin, "rb") as f:
+                contenu = f.read()
+        except OSError:
+            return None
+        try:
+            # Date de dernière lecture, utilisée par l'élagage
+            os.utime(chemin)
+        except OSError:
+            pass
+
+        self._garder_en_memoire(cle, contenu)
+        return contenu
+
+    def existe(self, cle):
+        with self._verrou:
+            if cle in self._memoire:
+                return True
+        return os.path.exists(self._chemin(cle))
+
+    def ecrire(self, cle, contenu, memoire=True):
+        """`memoire=False` n'écrit que sur disque (pré-rendu : ne pas évincer
+        les PDF servis récemment du LRU)."""
+        if memoire:
+            self._garder_en_memoire(cle, contenu)
+
+        self._ecrire_fichier(self._chemin(cle), contenu)
+        self._elaguer_si_besoin()
+
+    def _ecrire_fichier(self, chemin, contenu):
+        try:
+            os.makedirs(os.path.dirname(chemin), exist_ok=True)
+            # Écriture atomique : un autre worker ne doit jamais lire un fichier partiel
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(chemin), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(contenu)
+            os.replace(tmp, chemin)
+        except OSError as e:
+            print(f"Cache disque indisponible : {e}")
+
+    # ---------- élagage du disque ----------
+    def _elaguer_si_besoin(self):
+        maintenant = time.monotonic()
+        with self._verrou:
+            if self._dernier_elagage is not None and maintenant - self._dernier_elagage < INTERVALLE_ELAGAGE:
+                return
+            self._dernier_elagage = maintenant
+        threading.Thread(target=self.elaguer, name="cache-elagage", daemon=True).start()
+
+    def elaguer(self):
+        """Supprime les PDF trop anciens puis les moins récemment lus au-delà de
+        la taille maximale. Retourne le nombre de fichiers supprimés."""
+        if not self._verrou_elagage.acquire(blocking=False):
+            return 0
+        try:
+            maintenant = time.time()
+            fichiers = []
+            try:
+                sous_dossiers = [e.path for e in os.scandir(self.dossier) if e.is_dir() and len(e.name) == 2]
+            except OSError:
+                return 0
+            for sous_dossier in sous_dossiers:
+                try:
+                    entrees = list(os.scandir(sous_dossier))
+                except OSError:
+                    continue
+                for entree in entrees:
+                    try:
+                        infos = entree.stat()
+                    except OSError:
+                        continue
+                    if entree.name.endswith(".tmp"):
+                        if infos.st_mtime < maintenant - AGE_MAX_TEMPORAIRE:
+                            _supprimer(entree.path)
+                    elif entree.name.endswith(".pdf"):
+                        fichiers.append((infos.st_mtime, infos.st_size, entree.path))
+
+            fichiers.sort()
+            total = sum(taille for _, taille, _ in fichiers)
+            supprimes = 0
+            for date, taille, chemin in fichiers:
+                if date >= maintenant - self.disque_age and total <= self.disque_octets:
+                    break
+                _supprimer(chemin)
+                total -= taille
+                supprimes += 1
+            return supprimes
+        finally:
+            self._verrou_elagage.release()
+
+    def _garder_en_memoire(self, cle, contenu):
+        if self.taille_max <= 0:
+            return
+        with self._verrou:
+            self._memoire[cle] = contenu
+            self._memoire.move_to_end(cle)
+            while len(self._memoire) > self.taille_max:
+                self._memoire.popitem(last=False)
+
+    # ---------- alias facture -> dernier PDF ----------
+    def _chemin_alias(self, facture_id):
+        return os.path.join(self.dossier, "alias", f"{facture_id}.json")
+
+    def associer(self, facture_id, cle, numero):
+        """Retient `cle` comme dernier PDF de la facture `facture_id`."""
+        with self._verrou:
+            if self._alias.get(facture_id) == cle:
+                self._alias.move_to_end(facture_id)
+                return
+            self._alias[facture_id] = cle
+            while len(self._alias) > TAILLE_ALIAS_MEMOIRE:
+                self._alias.popitem(last=False)
+        alias = json.dumps({"cle": cle, "numero": numero}).encode("utf-8")
+        self._ecrire_fichier(self._chemin_alias(facture_id), alias)
+
+    def dernier(self, facture_id):
+        """(clé, numéro, contenu) du dernier PDF connu de la facture, ou None."""
+        try:
+            with open(self._chemin_alias(facture_id), "rb") as f:
+                alias = json.load(f)
+        except (OSError, ValueError):
+            return None
+        contenu = self.lire(alias["cle"])
+        if contenu is None:
+            return None
+        return alias["cle"], alias["numero"], contenu
+
+
+def _supprimer(chemin):
+    try:
+        os.remove(chemin)
+    except OSError:
+        pass
+
+
+cache_factures = CachePdf()
@@ -0,0 +1,351 @@
+"""Test de charge de bout en bout, hors ligne.
+
+Usage :
+    python charge.py                                        # 20 s, 8 clients, mix par défaut
+    python charge.py --duree 60 --clients 32 --mix dossier=1,facture=4
+    python charge.py --latence-db 0.03 --echecs-storage 0.2 --asgi
+    python charge.py --json rapport.json
+
+L'application est lancée (gunicorn, ou uvicorn avec --asgi) contre une
+doublure locale de Supabase : PostgREST pour la table `factures` et Storage
+pour les uploads, avec latence et pannes injectables. Le rapport donne le
+débit, les centiles de latence, les taux d'erreur et la mémoire des workers.
+"""
+import argparse
+import collections
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from tests.doublure import DoublureSupabase, Injection
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# ===================== DONNEES =====================
+def facture_exemple(facture_id, rng):
+    """data_json d'une facture factice, de 1 à 40 lignes par section."""
+    def lignes(prefixe):
+        return [{"label": f"{prefixe} {i} - frais de manutention", "montant": round(rng.uniform(5, 900), 3)}
+                for i in range(rng.randint(1, 40))]
+
+    return {
+        "client": {"code_client": f"C{facture_id % 50:04d}", "nom": f"Client {facture_id % 50}",
+                   "adresse": "12 rue de Marseille, 1000 Tunis", "code_tva": "1234567/A/M/000"},
+        "facture": {"numero": f"F-2026-{facture_id:05d}", "date": f"2026-{1 + facture_id % 12:02d}-15T10:00:00",
+                    "mode": rng.choice(["import", "export"]), "dossier_no": f"D-{facture_id}",
+                    "navire": "MSC ISTANBUL", "date_arrivee": "2026-09-28"},
+        "lignes": {"debours": lignes("Débours"), "transit": lignes("Transit"), "transport": lignes("Transport")},
+        "totaux": {"total_non_taxable": 1523.5, "total_taxable": 842.0, "tva_7": 12.6,
+                   "tva_19": 136.2, "timbre": 1.0, "total_final": 2515.3},
+    }
+
+
+def dossier_exemple(numero, rng):
+    texte = "SOCIETE MEDITERRANEENNE DE NEGOCE " * rng.randint(1, 6)
+    return {
+        "dossier_no": f"D-{numero}", "mode": "import", "expediteur": texte, "destinataire": texte,
+        "marchandise": "PIECES DETACHEES", "port_emb": "GENES", "date_emb": "2026-09-20",
+        "port_dest": "RADES", "date_dest": "2026-09-28", "date_declaration": "2026-09-29",
+    }
+
+
+# ===================== APPLICATION SOUS TEST =====================
+JETON_METRIQUES = "jeton-charge"
+
+def lancer_app(url_supabase, port, workers, asgi, repertoire):
+    env = dict(
+        os.environ,
+        SUPABASE_URL=url_supabase,
+        SUPABASE_KEY="cle-service-doublure",
+        EDEN_METRIQUES_JETON=JETON_METRIQUES,
+        EDEN_METRIQUES_DIR=os.path.join(repertoire, "metriques"),
+        EDEN_BIND=f"127.0.0.1:{port}",
+        WEB_CONCURRENCY=str(workers),
+        EDEN_CACHE_DIR=os.path.join(repertoire, "cache"),
+        EDEN_UPLOAD_DB=os.path.join(repertoire, "uploads.sqlite3"),
+        EDEN_UPLOAD_SPOOL=os.path.join(repertoire, "spool"),
+        EDEN_DONNEES_JOURNAL=os.path.join(repertoire, "donnees.invalidations"),
+        EDEN_PRERENDU_VERROU=os.path.join(repertoire, "prerendu.lock"),
+        EDEN_UPLOAD_DELAI=os.environ.get("EDEN_UPLOAD_DELAI", "0.2"),
+    )
+    if asgi:
+        commande = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1",
+                    "--port", str(port), "--workers", str(workers), "--no-access-log"]
+    else:
+        commande = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"]
+    journal = open(os.path.join(repertoire, "serveur.log"), "wb")
+    serveur = subprocess.Popen(commande, cwd=BASE_DIR, env=env, stdout=journal, stderr=subprocess.STDOUT)
+    journal.close()
+
+    debut = time.perf_counter()
+    while time.perf_counter() - debut < 60:
+        if serveur.poll() is not None:
+            raise RuntimeError(f"Le serveur s'est arrêté, voir {repertoire}/serveur.log")
+        try:
+            cnx = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            cnx.request("GET", "/metrics", headers={"Authorization": f"Bearer {JETON_METRIQUES}"})
+            if cnx.getresponse().status == 200:
+                cnx.close()
+                return serveur
+        except OSError:
+            time.sleep(0.05)
+    serveur.terminate()
+    raise TimeoutError("Le serveur ne répond pas après 60 s")
+
+
+# ---------- mémoire ----------
+def _processus(pid, profondeur=0):
+    """(pid, profondeur) du processus et de ses descendants."""
+    pids = [(pid, profondeur)]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            for enfant in f.read().split():
+                pids += _processus(int(enfant), profondeur + 1)
+    except OSError:
+        pass
+    return pids
+
+
+def _rss_ko(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for ligne in f:
+                if ligne.startswith("VmRSS:"):
+                    return int(ligne.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+# Maître gunicorn/uvicorn, ses workers, puis les processus du pool de rendu
+ROLES = ("maitre", "worker", "rendu")
+
+
+class SondeMemoire:
+    """Relève la RSS de l'arbre de processus du serveur à intervalle régulier."""
+
+    def __init__(self, pid, intervalle=0.5):
+        self.pid = pid
+        self.intervalle = intervalle
+        self.max_ko = collections.Counter()
+        self.dernier_ko = {}
+        self._arret = threading.Event()
+        self._thread = threading.Thread(target=self._boucle, name="sonde-memoire", daemon=True)
+
+    def relever(self):
+        par_role = collections.Counter()
+        nombre = collections.Counter()
+        for pid, profondeur in _processus(self.pid):
+            role = ROLES[min(profondeur, len(ROLES) - 1)]
+            rss = _rss_ko(pid)
+            par_role[role] += rss
+            nombre[role] += 1
+            self.max_ko[f"{role}_max_processus"] = max(self.max_ko[f"{role}_max_processus"], rss)
+        for role, total in par_role.items():
+            self.max_ko[role] = max(self.max_ko[role], total)
+        self.dernier_ko = {role: (par_role[role], nombre[role]) for role in par_role}
+
+    def _boucle(self):
+        while not self._arret.wait(self.intervalle):
+            self.relever()
+
+    def demarrer(self):
+        self.relever()
+        self._thread.start()
+
+    def arreter(self):
+        self._arret.set()
+        self._thread.join()
+        self.relever()
+
+
+# ===================== GENERATION DE CHARGE =====================
+def _mix(texte):
+    poids = {}
+    for element in texte.split(","):
+        route, _, valeur = element.partition("=")
+        if route not in ("dossier", "facture"):
+            raise argparse.ArgumentTypeError(f"Route inconnue : {route}")
+        poids[route] = float(valeur or 1)
+    return poids
+
+
+class Client(threading.Thread):
+    """Un client HTTP keep-alive qui enchaîne des requêtes jusqu'à l'échéance."""
+
+    def __init__(self, numero, port, mix, ids, inconnues, echeance, resultats, graine):
+        super().__init__(name=f"client-{numero}", daemon=True)
+        self.port = port
+        self.routes = list(mix)
+        self.poids = [mix[r] for r in self.routes]
+        self.ids = ids
+        self.inconnues = inconnues
+        self.echeance = echeance
+        self.resultats = resultats
+        self.rng = random.Random(graine)
+        self._cnx = None
+
+    def _requete(self, route):
+        if route == "dossier":
+            corps = json.dumps(dossier_exemple(self.rng.randint(1, 10**6), self.rng)).encode()
+            return "POST", "/generate-pdf", corps, {"Content-Type": "application/json"}
+        if self.rng.random() < self.inconnues:
+            facture_id = max(self.ids) + self.rng.randint(1, 10**6)
+        else:
+            facture_id = self.rng.choice(self.ids)
+        return "GET", f"/facture/{facture_id}", None, {}
+
+    def run(self):
+        while time.perf_counter() < self.echeance:
+            route = self.rng.choices(self.routes, self.poids)[0]
+            methode, chemin, corps, entetes = self._requete(route)
+            debut = time.perf_counter()
+            try:
+                if self._cnx is None:
+                    self._cnx = http.client.HTTPConnection("127.0.0.1", self.port, timeout=60)
+                self._cnx.request(methode, chemin, body=corps, headers=entetes)
+                reponse = self._cnx.getresponse()
+                reponse.read()
+                statut = reponse.status
+                if reponse.getheader("Connection", "").lower() == "close":
+                    self._cnx.close()
+                    self._cnx = None
+            except (OSError, http.client.HTTPException):
+                statut = "connexion"
+                if self._cnx is not None:
+                    self._cnx.close()
+                self._cnx = None
+            self.resultats.append((route, statut, time.perf_counter() - debut, debut))
+        if self._cnx is not None:
+            self._cnx.close()
+
+
+# ===================== RAPPORT =====================
+def centile(valeurs_triees, p):
+    if not valeurs_triees:
+        return 0.0
+    rang = min(len(valeurs_triees) - 1, max(0, round(p / 100 * len(valeurs_triees) + 0.5) - 1))
+    return valeurs_triees[rang]
+
+
+def _stats_route(resultats, duree):
+    latences = sorted(r[2] for r in resultats)
+    statuts = collections.Counter(str(r[1]) for r in resultats)
+    erreurs = sum(n for s, n in statuts.items() if not s.startswith(("2", "3")) and s != "404")
+    return {
+        "requetes": len(resultats),
+        "debit": len(resultats) / duree if duree else 0.0,
+        "p50_ms": centile(latences, 50) * 1000,
+        "p95_ms": centile(latences, 95) * 1000,
+        "p99_ms": centile(latences, 99) * 1000,
+        "max_ms": (latences[-1] if latences else 0.0) * 1000,
+        "taux_erreur": erreurs / len(resultats) if resultats else 0.0,
+        "statuts": dict(sorted(statuts.items())),
+    }
+
+
+def construire_rapport(resultats, duree, sonde, doublure, options):
+    par_route = collections.defaultdict(list)
+    for resultat in resultats:
+        par_route[resultat[0]].append(resultat)
+    return {
+        "options": options,
+        "duree_s": duree,
+        "total": _stats_route(resultats, duree),
+        "routes": {route: _stats_route(r, duree) for route, r in sorted(par_route.items())},
+        "memoire_ko": {
+            "max": dict(sonde.max_ko),
+            "fin": {role: {"total": total, "processus": n} for role, (total, n) in sonde.dernier_ko.items()},
+        },
+        "doublure": dict(doublure.stats),
+    }
+
+
+def afficher_rapport(rapport):
+    total = rapport["total"]
+    print(f"\nDurée : {rapport['duree_s']:.1f} s   requêtes : {total['requetes']}   "
+          f"débit : {total['debit']:.1f} req/s   erreurs : {total['taux_erreur'] * 100:.2f} %")
+    print(f"\n{'route':<10} {'req':>7} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} {'erreurs':>8}  statuts")
+    for route, s in list(rapport["routes"].items()) + [("total", total)]:
+        print(f"{route:<10} {s['requetes']:>7} {s['debit']:>8.1f} {s['p50_ms']:>7.1f}ms {s['p95_ms']:>7.1f}ms "
+              f"{s['p99_ms']:>7.1f}ms {s['max_ms']:>7.1f}ms {s['taux_erreur'] * 100:>7.2f}%  {s['statuts']}")
+
+    memoire = rapport["memoire_ko"]
+    print(f"\n{'mémoire (RSS)':<14} {'processus':>9} {'fin':>10} {'max':>10} {'max/proc.':>10}")
+    for role, fin in sorted(memoire["fin"].items()):
+        print(f"{role:<14} {fin['processus']:>9} {fin['total'] / 1024:>8.1f}Mo "
+              f"{memoire['max'].get(role, 0) / 1024:>8.1f}Mo "
+              f"{memoire['max'].get(role + '_max_processus', 0) / 1024:>8.1f}Mo")
+
+    print("\nDoublure Supabase : " + ", ".join(f"{k}={v}" for k, v in sorted(rapport["doublure"].items())))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test de charge hors ligne du backend")
+    parser.add_argument("--duree", type=float, default=20, help="secondes de charge")
+    parser.add_argument("--clients", type=int, default=8, help="clients simultanés")
+    parser.add_argument("--mix", type=_mix, default=_mix("dossier=1,facture=3"),
+                        help="poids des routes, ex: dossier=1,facture=3")
+    parser.add_argument("--factures", type=int, default=200, help="factures dans la doublure")
+    parser.add_argument("--inconnues", type=float, default=0.0, help="part de factures inexistantes (404)")
+    parser.add_argument("--latence-db", type=float, default=0.01)
+    parser.add_argument("--echecs-db", type=float, default=0.0)
+    parser.add_argument("--latence-storage", type=float, default=0.05)
+    parser.add_argument("--echecs-storage", type=float, default=0.0)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--asgi", action="store_true", help="uvicorn asgi:app au lieu de gunicorn")
+    parser.add_argument("--port", type=int, default=8795)
+    parser.add_argument("--graine", type=int, default=1)
+    parser.add_argument("--json", help="écrit aussi le rapport dans ce fichier")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.graine)
+    factures = {i: facture_exemple(i, rng) for i in range(1, args.factures + 1)}
+    doublure = DoublureSupabase(
+        factures,
+        db=Injection(args.latence_db, args.echecs_db, random.Random(args.graine + 1)),
+        storage=Injection(args.latence_storage, args.echecs_storage, random.Random(args.graine + 2)),
+    )
+    url_supabase = doublure.demarrer()
+
+    with tempfile.TemporaryDirectory(prefix="eden_charge_") as repertoire:
+        serveur = lancer_app(url_supabase, args.port, args.workers, args.asgi, repertoire)
+        sonde = SondeMemoire(serveur.pid)
+        sonde.demarrer()
+        try:
+            resultats = []
+            debut = time.perf_counter()
+            clients = [
+                Client(i, args.port, args.mix, list(factures), args.inconnues,
+                       debut + args.duree, resultats, args.graine * 1000 + i)
+                for i in range(args.clients)
+            ]
+            for client in clients:
+                client.start()
+            for client in clients:
+                client.join()
+            duree = time.perf_counter() - debut
+            sonde.arreter()
+        finally:
+            serveur.terminate()
+            serveur.wait(timeout=30)
+            doublure.arreter()
+
+    options = {k: v for k, v in vars(args).items() if k != "json"}
+    rapport = construire_rapport(resultats, duree, sonde, doublure, options)
+    afficher_rapport(rapport)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rapport, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""Démarrage des workers : préchargement, services et rendu de préchauffage.
+
+Usage :
+    python demarrage.py               # mesure le démarrage à froid sous gunicorn
+    python demarrage.py --workers 4
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+import metriques
+
+# ===================== DEMARRAGE DES WORKERS =====================
+# Sous gunicorn avec gunicorn.conf.py (preload_app), le maître importe l'app
+# et précharge une fois les ressources de rendu (polices, entête, logo,
+# gabarits compilés) : les workers forkés les partagent en copie sur
+# écriture. Les threads (upload, pré-rendu) et le pool de rendu ne démarrent
+# qu'après le fork, dans chaque worker, suivis d'un rendu de préchauffage
+# avant d'accepter des requêtes. Les processus du pool font eux aussi un
+# rendu de préchauffage à leur initialisation.
+#
+# Les durées (préchargement, démarrage du worker, première requête) sont
+# écrites dans le journal et exposées par /metrics.
+#
+# EDEN_PRECHARGEMENT : 1 quand le maître gunicorn précharge l'app (positionné
+#                      par gunicorn.conf.py)
+
+PRECHARGEMENT = os.environ.get("EDEN_PRECHARGEMENT", "0") == "1"
+
+DEMARRAGE = metriques.enregistrer(metriques.Histogramme(
+    "eden_demarrage_duree_secondes",
+    "Durées de démarrage : préchargement, worker prêt, première requête.",
+    "phase",
+))
+
+URL_EXEMPLE = "https://example.invalid/storage/v1/object/public/Facture/facture_PRECHAUFFAGE.pdf"
+
+FACTURE_EXEMPLE = {
+    "client": {"code_client": "C0000", "nom": "Préchauffage", "adresse": "Tunis", "code_tva": "0000000/A/M/000"},
+    "facture": {"numero": "PRECHAUFFAGE", "date": "2026-01-01T00:00:00", "mode": "import",
+                "dossier_no": "D-0", "navire": "-", "date_arrivee": "2026-01-01"},
+    "lignes": {"debours": [{"label": "Débours", "montant": 1.0}],
+               "transit": [{"label": "Transit", "montant": 1.0}],
+               "transport": [{"label": "Transport", "montant": 1.0}]},
+    "totaux": {"total_non_taxable": 1.0, "total_taxable": 2.0, "tva_7": 0.07,
+               "tva_19": 0.19, "timbre": 1.0, "total_final": 4.26},
+}
+
+DOSSIER_EXEMPLE = {
+    "dossier_no": "PRECHAUFFAGE", "mode": "import", "expediteur": "Préchauffage",
+    "destinataire": "Préchauffage", "marchandise": "-", "date_declaration": "2026-01-01",
+}
+
+_pid_premiere_requete = None
+_pid_demarre = None
+
+
+def _age_processus():
+    """Secondes écoulées depuis la création du processus (fork compris), ou None."""
+    try:
+        with open("/proc/self/stat") as f:
+            debut = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - debut / os.sysconf("SC_CLK_TCK")
+
+
+def _noter(phase, duree):
+    DEMARRAGE.observer(phase, duree)
+    print(f"[démarrage {os.getpid()}] {phase} : {duree:.3f} s")
+
+
+# ---------- rendus de préchauffage ----------
+def rendu_exemple():
+    """Rend une facture et un dossier factices, sans upload ni cache."""
+    from creationdossier import create_dossier
+    from creationfacture import ecrire_facture
+    from executeur import CHEMIN_ENTETE
+
+    # Les étapes chronométrées ne doivent pas compter dans les métriques
+    jeton = metriques.debut_collecte()
+    try:
+        ecrire_facture(CHEMIN_ENTETE, FACTURE_EXEMPLE, URL_EXEMPLE, io.BytesIO())
+        create_dossier(DOSSIER_EXEMPLE)
+    finally:
+        metriques.fin_collecte(jeton)
+
+
+# ---------- étapes ----------
+def precharger():
+    """Charge les ressources de rendu dans le processus courant (maître gunicorn)."""
+    from executeur import initialiser_processus
+
+    debut = time.perf_counter()
+    initialiser_processus()
+    # Modules des clients de service : importés ici, clients créés à la demande
+    import httpx  # noqa: F401
+    import supabase  # noqa: F401
+    _noter("prechargement", time.perf_counter() - debut)
+
+
+def demarrer_worker():
+    """Démarre les services du worker et attend son préchauffage (une fois par processus)."""
+    global _pid_demarre
+    if _pid_demarre == os.getpid():
+        return
+    _pid_demarre = os.getpid()
+    from creationfacture import file_uploads
+    from donnees import SUPABASE_KEY
+    from executeur import TAILLE_POOL, initialiser_processus, pool, pret
+    from prerendu import prerendu
+
+    if not SUPABASE_KEY:
+        print("SUPABASE_KEY non définie : les PDF ne seront pas envoyés vers Supabase Storage")
+    debut = time.perf_counter()
+    metriques.demarrer()
+    file_uploads.demarrer()
+    prerendu.demarrer()
+    if TAILLE_POOL > 0:
+        # Chaque processus du pool se préchauffe dans son initialisation
+        pool()
+        pret()
+    else:
+        initialiser_processus()
+    _noter("prechauffage", time.perf_counter() - debut)
+
+    age = _age_processus()
+    if age is not None:
+        _noter("worker_pret", age)
+
+
+def premiere_requete(duree):
+    """Note la durée de la première requête servie par ce processus."""
+    global _pid_premiere_requete
+    if _pid_premiere_requete == os.getpid():
+        return
+    _pid_premiere_requete = os.getpid()
+    _noter("premiere_requete", duree)
+
+
+# ===================== MESURE DU DEMARRAGE A FROID =====================
+JETON_MESURE = "mesure-demarrage"
+
+def _attendre(url, limite):
+    debut = time.perf_counter()
+    requete = urllib.request.Request(url, headers={"Authorization": f"Bearer {JETON_MESURE}"})
+    while time.perf_counter() - debut < limite:
+        try:
+            with urllib.request.urlopen(requete, timeout=1) as reponse:
+                return reponse.read()
+        except OSError:
+            time.sleep(0.02)
+    raise TimeoutError(f"{url} ne répond pas après {limite} s")
+
+
+def _dossier(url):
+    requete = urllib.request.Request(
+        url + "/generate-pdf", data=json.dumps(DOSSIER_EXEMPLE).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    debut = time.perf_counter()
+    with urllib.request.urlopen(requete, timeout=30) as reponse:
+        reponse.read()
+    return time.perf_counter() - debut
+
+
+def _pss_ko(pid):
+    """Mémoire proportionnelle (Ko) du processus et de ses descendants."""
+    total = 0
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            total += next(int(l.split()[1]) for l in f if l.startswith("Pss:"))
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            enfants = [int(p) for p in f.read().split()]
+    except (OSError, StopIteration):
+        return total
+    return total + sum(_pss_ko(enfant) for enfant in enfants)
+
+
+def mesurer(precharge, workers, port):
+    env = dict(os.environ, EDEN_PRECHARGEMENT="1" if precharge else "0",
+               EDEN_BIND=f"127.0.0.1:{port}", WEB_CONCURRENCY=str(workers),
+               EDEN_METRIQUES_JETON=JETON_MESURE)
+    url = f"http://127.0.0.1:{port}"
+    debut = time.perf_counter()
+    serveur = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        _attendre(url + "/metrics", 60)
+        pret = time.perf_counter() - debut
+        premiere = _dossier(url)
+        suivante = _dossier(url)
+        return {"pret": pret, "premiere": premiere, "suivante": suivante, "pss": _pss_ko(serveur.pid)}
+    finally:
+        serveur.terminate()
+        serveur.wait(timeout=30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Démarrage à froid sous gunicorn")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8790)
+    args = parser.parse_args(argv)
+
+    print(f"{'mode':<20} {'prêt':>8} {'1re requête':>12} {'suivante':>10} {'PSS total':>11}")
+    for precharge in (False, True):
+        r = mesurer(precharge, args.workers, args.port)
+        mode = "préchargé" if precharge else "sans préchargement"
+        print(f"{mode:<20} {r['pret']:>7.2f}s {r['premiere'] * 1000:>10.1f}ms "
+              f"{r['suivante'] * 1000:>8.1f}ms {r['pss'] / 1024:>9.1f}Mo")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
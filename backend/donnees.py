@@ -0,0 +1,327 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import resilience
+from metriques import etape
+
+# ===================== ACCES AUX DONNEES =====================
+# Deux clients Supabase par processus, créés à la première utilisation :
+#   - client() lit la table factures avec la clé publique, pour que les
+#     règles RLS de la base s'appliquent comme avant ;
+#   - client_storage() envoie les PDF au bucket avec la clé service_role.
+# Chacun a un client HTTP qui garde ses connexions ouvertes (keep-alive) : les
+# requêtes ne repaient plus la poignée de main TLS. Celui de Storage a ses
+# propres délais : connexion, envoi, réponse et attente d'une connexion libre
+# en prennent chacun au plus un quart de resilience.DELAI_STORAGE, si bien
+# qu'un envoi abandonné par resilience se termine lui-même peu après au lieu
+# d'aboutir bien plus tard, par-dessus un envoi plus récent du même fichier.
+# Les modules supabase/httpx eux-mêmes ne sont importés qu'à ce moment-là
+# (ou par le préchargement du maître gunicorn, voir demarrage.py).
+#
+# Les data_json des factures sont gardés dans un cache LRU à durée de vie
+# limitée. Quand une facture est modifiée, `invalider()` l'oublie dans ce
+# worker et ajoute son id à un journal commun : à leur prochain accès, les
+# autres workers lisent les lignes ajoutées depuis et n'oublient que ces
+# factures. Le journal commence par une ligne d'en-tête tirée au hasard ; au-delà
+# de JOURNAL_TAILLE_MAX il est remplacé (jamais supprimé) par un nouveau
+# journal vide : les workers qui voient l'en-tête changer ne savent plus ce
+# que contenait l'ancien et vident tout leur cache, une fois.
+# Les invalidations viennent du webhook de base de données (prerendu.py) ;
+# sans lui, une modification est vue au plus tard après EDEN_DONNEES_TTL.
+#
+# Chaque requête passe par resilience.db (délai, disjoncteur, lecture de
+# secours) : une base lente ou en panne lève `resilience.Indisponible`.
+#
+# SUPABASE_URL peut pointer vers un PostgREST local (http://127.0.0.1:3000/,
+# le client ajoute "rest/v1") pour tester sans le vrai projet.
+
+SUPABASE_URL = os.environ.get("SUPABASE_URL", "https://qsuagjwscgsftgfyfket.supabase.co/").rstrip("/") + "/"
+# Note: Attention à ne pas exposer tes clés secrètes publiquement
+SUPABASE_PUBLISHABLE_KEY = os.environ.get("SUPABASE_PUBLISHABLE_KEY") or "sb_publishable_DTloeTjwsaJ4GntCpzRzbQ_pe1Yc2St"
+# Clé service_role : lue uniquement dans l'environnement. Sans elle, les
+# envois vers Storage échouent avec un message explicite (le rendu marche)
+SUPABASE_KEY = os.environ.get("SUPABASE_KEY", "")
+
+CONNEXIONS_MAX = int(os.environ.get("EDEN_HTTP_CONNEXIONS", "20"))
+KEEPALIVE_SECONDES = float(os.environ.get("EDEN_HTTP_KEEPALIVE", "60"))
+TIMEOUT_HTTP = float(os.environ.get("EDEN_HTTP_TIMEOUT", "10"))
+
+CACHE_TTL = float(os.environ.get("EDEN_DONNEES_TTL", "300"))
+CACHE_TAILLE = int(os.environ.get("EDEN_DONNEES_TAILLE", "1024"))
+JOURNAL_INVALIDATIONS = os.environ.get(
+    "EDEN_DONNEES_JOURNAL", os.path.join(tempfile.gettempdir(), "eden_donnees.invalidations")
+)
+JOURNAL_TAILLE_MAX = 1024 * 1024
+
+_clients = {}
+_http = None
+_http_storage = None
+_clients_pid = None
+_verrou_client = threading.Lock()
+
+# Client asynchrone (mode ASGI) : lié à la boucle asyncio qui l'a créé
+_client_async = None
+_boucle_async = None
+
+
+def _limites():
+    import httpx
+
+    return httpx.Limits(
+        max_connections=CONNEXIONS_MAX,
+        max_keepalive_connections=CONNEXIONS_MAX,
+        keepalive_expiry=KEEPALIVE_SECONDES,
+    )
+
+
+def _client_cle(cle, stockage=False):
+    """Client Supabase du processus pour la clé `cle` (recréés après un fork)."""
+    global _clients, _http, _http_storage, _clients_pid
+    if _clients_pid == os.getpid() and cle in _clients:
+        return _clients[cle]
+    with _verrou_client:
+        if _clients_pid != os.getpid():
+            import httpx
+
+            _clients, _clients_pid = {}, os.getpid()
+            _http = httpx.Client(timeout=TIMEOUT_HTTP, limits=_limites())
+            _http_storage = httpx.Client(timeout=resilience.DELAI_STORAGE / 4, limits=_limites())
+        if cle not in _clients:
+            from supabase import ClientOptions, create_client
+
+            http = _http_storage if stockage else _http
+            _clients[cle] = create_client(SUPABASE_URL, cle, options=ClientOptions(httpx_client=http))
+    return _clients[cle]
+
+
+def client():
+    """Client des lectures PostgREST (clé publique, RLS appliquée)."""
+    return _client_cle(SUPABASE_PUBLISHABLE_KEY)
+
+
+def client_storage():
+    """Client des envois vers Storage (clé service_role)."""
+    if not SUPABASE_KEY:
+        raise RuntimeError("SUPABASE_KEY non définie : clé service_role requise pour Supabase Storage")
+    return _client_cle(SUPABASE_KEY, stockage=True)
+
+
+async def client_async():
+    """Client Supabase asynchrone partagé par la boucle asyncio courante
+    (lectures seulement : clé publique)."""
+    global _client_async, _boucle_async
+    boucle = asyncio.get_running_loop()
+    if _client_async is not None and _boucle_async is boucle:
+        return _client_async
+    import httpx
+    from supabase import AsyncClientOptions, acreate_client
+
+    http = httpx.AsyncClient(timeout=TIMEOUT_HTTP, limits=_limites())
+    nouveau = await acreate_client(
+        SUPABASE_URL, SUPABASE_PUBLISHABLE_KEY, options=AsyncClientOptions(httpx_client=http)
+    )
+    if _boucle_async is boucle:
+        # Une autre requête l'a créé pendant l'attente
+        await http.aclose()
+        return _client_async
+    _client_async, _boucle_async = nouveau, boucle
+    return _client_async
+
+
+class CacheFactures:
+    """Cache de lecture des data_json : facture_id -> (expire_le, data_json)."""
+
+    def __init__(self, ttl=CACHE_TTL, taille=CACHE_TAILLE, journal=JOURNAL_INVALIDATIONS,
+                 taille_journal=JOURNAL_TAILLE_MAX):
+        self.ttl = ttl
+        self.taille = taille
+        self.journal = journal
+        self.taille_journal = taille_journal
+        self._entrees = OrderedDict()
+        self._inode, self._entete, self._position = None, None, 0
+        self._verrou = threading.Lock()
+        self._nouveau_journal(remplacer=False)
+        # Les invalidations écrites avant le démarrage ne concernent pas ce cache
+        self._suivre_journal(rejouer=False)
+
+    def _nouveau_journal(self, remplacer):
+        """Crée le journal (ou le remplace) avec son en-tête, en une opération."""
+        temporaire = f"{self.journal}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporaire, "wb") as f:
+                f.write(b"#%s\n" % os.urandom(8).hex().encode())
+            if remplacer:
+                os.replace(temporaire, self.journal)
+            else:
+                try:
+                    os.link(temporaire, self.journal)
+                except FileExistsError:
+                    pass
+                os.remove(temporaire)
+        except OSError as e:
+            print(f"Journal d'invalidation indisponible ({self.journal}) : {e}")
+
+    def _suivre_journal(self, rejouer=True):
+        # Appelé sous le verrou : applique les invalidations des autres workers
+        try:
+            etat = os.stat(self.journal)
+        except OSError:
+            return
+        if etat.st_ino == self._inode and etat.st_size == self._position:
+            return
+        try:
+            with open(self.journal, "rb") as f:
+                entete = f.readline()
+                if entete != self._entete or os.fstat(f.fileno()).st_size < self._position:
+                    # Journal remplacé : ce qu'il contenait avant n'est plus connu
+                    if self._entete is not None:
+                        self._entrees.clear()
+                    self._entete, self._position = entete, len(entete)
+                self._inode = os.fstat(f.fileno()).st_ino
+                f.seek(self._position)
+                lignes = f.read()
+        except OSError:
+            return
+        # Une ligne en cours d'écriture sera lue au prochain accès
+        lignes = lignes[:lignes.rfind(b"\n") + 1]
+        self._position += len(lignes)
+        if not rejouer:
+            return
+        for ligne in lignes.split():
+            if ligne == b"*":
+                self._entrees.clear()
+            elif not ligne.startswith(b"#"):
+                self._entrees.pop(int(ligne), None)
+
+    def lire(self, facture_id):
+        with self._verrou:
+            self._suivre_journal()
+            entree = self._entrees.get(facture_id)
+            if entree is None:
+                return None
+            expire_le, data = entree
+            if expire_le < time.monotonic():
+                del self._entrees[facture_id]
+                return None
+            self._entrees.move_to_end(facture_id)
+            return data
+
+    def ecrire(self, facture_id, data):
+        if self.ttl <= 0 or self.taille <= 0:
+            return
+        with self._verrou:
+            self._entrees[facture_id] = (time.monotonic() + self.ttl, data)
+            self._entrees.move_to_end(facture_id)
+            while len(self._entrees) > self.taille:
+                self._entrees.popitem(last=False)
+
+    def invalider(self, facture_id=None):
+        """Oublie une facture (ou tout le cache), dans tous les workers."""
+        with self._verrou:
+            self._suivre_journal()
+            if facture_id is None:
+                self._entrees.clear()
+            else:
+                self._entrees.pop(facture_id, None)
+            ligne = b"*\n" if facture_id is None else b"%d\n" % facture_id
+            try:
+                # Une ligne courte écrite en O_APPEND n'est jamais mêlée à une autre
+                fd = os.open(self.journal, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, ligne)
+                    taille = os.fstat(fd).st_size
+                finally:
+                    os.close(fd)
+                if taille > self.taille_journal:
+                    self._nouveau_journal(remplacer=True)
+            except OSError as e:
+                print(f"Invalidation non partagée ({self.journal}) : {e}")
+            # Relit aussi sa propre ligne, sans effet : celles des autres
+            # workers écrites entre-temps ne sont pas sautées
+            self._suivre_journal()
+
+
+cache_donnees = CacheFactures()
+
+
+# ---------- lectures ----------
+def lire(requete):
+    """Exécute une lecture PostgREST, bornée par resilience.db.
+
+    Les reprises internes de postgrest (jusqu'à 7 s de pauses sur un 503)
+    sont coupées : la lecture de secours et le disjoncteur les remplacent.
+    """
+    return resilience.db.appeler(requete.retry(False).execute, idempotent=True)
+
+
+def _select_facture(supabase, facture_id):
+    return (
+        supabase
+        .table("factures")
+        .select("data_json")
+        .eq("id", facture_id)
+        .maybe_single()
+    )
+
+
+def _garder(facture_id, res):
+    data = res.data.get("data_json") if res and res.data else None
+    if data:
+        cache_donnees.ecrire(facture_id, data)
+    return data
+
+
+def facture_data(facture_id):
+    """data_json de la facture `facture_id`, ou None si elle n'existe pas."""
+    data = cache_donnees.lire(facture_id)
+    if data is not None:
+        return data
+
+    with etape("supabase_select"):
+        res = lire(_select_facture(client(), facture_id))
+    return _garder(facture_id, res)
+
+
+async def facture_data_async(facture_id):
+    """Comme `facture_data`, sans bloquer la boucle asyncio."""
+    data = cache_donnees.lire(facture_id)
+    if data is not None:
+        return data
+
+    supabase = await client_async()
+    with etape("supabase_select"):
+        res = await resilience.db.appeler_async(
+            lambda: _select_facture(supabase, facture_id).retry(False).execute(), idempotent=True
+        )
+    return _garder(facture_id, res)
+
+
+def factures_data(ids):
+    """{facture_id: data_json} pour les factures trouvées parmi `ids`."""
+    trouvees = {}
+    manquantes = []
+    for facture_id in ids:
+        data = cache_donnees.lire(facture_id)
+        if data is not None:
+            trouvees[facture_id] = data
+        else:
+            manquantes.append(facture_id)
+
+    if manquantes:
+        with etape("supabase_select"):
+            requete = client().table("factures").select("id, data_json").in_("id", manquantes)
+            res = lire(requete)
+        for ligne in res.data or []:
+            data = ligne.get("data_json")
+            if data:
+                trouvees[ligne["id"]] = data
+                cache_donnees.ecrire(ligne["id"], data)
+    return trouvees
+
+
+def invalider_facture(facture_id=None):
+    cache_donnees.invalider(facture_id)
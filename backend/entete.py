@@ -0,0 +1,59 @@
+import hashlib
+import os
+import threading
+from optimisation_pdf import reduire_images
+
+# ===================== REGISTRE DES ENTETES =====================
+# Chaque fichier d'entête (ex: "Entete EDEN.pdf") est lu et analysé une seule
+# fois par processus. La version en mémoire est rechargée automatiquement si
+# le mtime du fichier change sur le disque.
+# Avec EDEN_PDF_ENTETE_DPI, les images de l'entête sont ré-échantillonnées au
+# chargement : la version (et donc les clés de cache) suit le contenu réduit.
+
+class _Entete:
+    def __init__(self, chemin, mtime, contenu):
+        self.chemin = chemin
+        self.mtime = mtime
+        self.contenu = contenu
+        self.version = hashlib.sha256(contenu).hexdigest()[:16]
+
+
+class RegistreEntetes:
+    def __init__(self):
+        self._entetes = {}
+        self._verrou = threading.Lock()
+
+    def _charger(self, chemin):
+        chemin = os.path.abspath(chemin)
+        mtime = os.stat(chemin).st_mtime_ns
+
+        entete = self._entetes.get(chemin)
+        if entete is not None and entete.mtime == mtime:
+            return entete
+
+        with self._verrou:
+            entete = self._entetes.get(chemin)
+            if entete is None or entete.mtime != mtime:
+                with open(chemin, "rb") as f:
+                    contenu = f.read()
+                entete = _Entete(chemin, mtime, reduire_images(contenu))
+                self._entetes[chemin] = entete
+        return entete
+
+    def version(self, chemin):
+        """Empreinte du contenu de l'entête, utilisée dans les clés de cache."""
+        return self._charger(chemin).version
+
+    def contenu(self, chemin):
+        """PDF de l'entête tel qu'il est posé sous les factures."""
+        return self._charger(chemin).contenu
+
+    def invalider(self, chemin=None):
+        with self._verrou:
+            if chemin is None:
+                self._entetes.clear()
+            else:
+                self._entetes.pop(os.path.abspath(chemin), None)
+
+
+registre = RegistreEntetes()
@@ -0,0 +1,203 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as DelaiDepasse, wait
+from concurrent.futures.process import BrokenProcessPool
+import metriques
+
+# ===================== POOL DE PROCESSUS DE RENDU =====================
+# Le rendu ReportLab/pypdf est du Python pur limité par le CPU : un pool de
+# processus permet d'utiliser tous les cœurs malgré le GIL. Chaque processus
+# est initialisé au démarrage (entête, polices, logo déjà chargés, puis un
+# rendu de préchauffage) pour que le premier rendu ne paie pas ce coût.
+#
+# Les processus sont créés par un serveur « forkserver » qui a importé
+# rendu_precharge.py : ils sont forkés depuis un processus où polices,
+# entête, logo et gabarits sont déjà chargés, et partagent ces pages mémoire
+# en copie sur écriture. Le serveur est un interpréteur neuf (pas un fork du
+# worker et de ses threads) ; chaque worker gunicorn démarre le sien. Le
+# préchargement du maître gunicorn (gunicorn.conf.py) ne profite qu'aux
+# workers, pas aux processus de rendu. Sans forkserver (Windows), les
+# processus sont lancés en « spawn » et se chargent dans leur initialisation.
+#
+# Chaque worker (gunicorn ou uvicorn) a son propre pool : le nombre total de
+# processus de rendu est WEB_CONCURRENCY x EDEN_RENDU_PROCESSUS. Par défaut
+# les cœurs sont donc partagés entre les workers. Les limites d'admission
+# (admission.py) sont dérivées de cette taille, par worker elles aussi.
+#
+# EDEN_RENDU_PROCESSUS : taille du pool de chaque worker (défaut : nombre de
+#                        cœurs / WEB_CONCURRENCY, au moins 1 ;
+#                        0 : rendu directement dans le thread de la requête)
+# EDEN_RENDU_TIMEOUT   : délai maximum d'attente d'un rendu, en secondes
+
+_taille = os.environ.get("EDEN_RENDU_PROCESSUS", "")
+_workers = max(int(os.environ.get("WEB_CONCURRENCY", "1") or 1), 1)
+TAILLE_POOL = int(_taille) if _taille.strip() else max((os.cpu_count() or 1) // _workers, 1)
+TIMEOUT_RENDU = float(os.environ.get("EDEN_RENDU_TIMEOUT", "30"))
+
+CHEMIN_ENTETE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Entete EDEN.pdf")
+
+_pool = None
+_pool_pid = None
+_prechauffage = []
+_verrou = threading.Lock()
+
+
+def initialiser_processus(prechauffer=True):
+    """Précharge les ressources de rendu dans le processus courant."""
+    from reportlab import rl_config
+    from reportlab.pdfbase import pdfmetrics
+    from entete import registre as registre_entetes
+    from ressources import image
+    import creationdossier  # noqa: F401
+    import creationfacture  # noqa: F401
+
+    # Flux binaires plutôt qu'en ASCII85 pour tous les PDF du processus de
+    # rendu : sans l'accélérateur C (rl_accel), l'encodage ASCII85 du logo
+    # coûtait plus que tout le reste du rendu
+    rl_config.useA85 = 0
+    for police in ("Helvetica", "Helvetica-Bold", "Helvetica-Oblique"):
+        pdfmetrics.getFont(police)
+    registre_entetes.version(CHEMIN_ENTETE)
+    image("logo.png")
+    if prechauffer:
+        from demarrage import rendu_exemple
+        rendu_exemple()
+
+
+def _contexte():
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    contexte = multiprocessing.get_context("forkserver")
+    contexte.set_forkserver_preload(["rendu_precharge"])
+    return contexte
+
+
+def _prechauffer():
+    return os.getpid()
+
+
+def pool():
+    """Pool partagé du processus courant, créé et préchauffé au premier appel."""
+    global _pool, _pool_pid, _prechauffage
+    with _verrou:
+        # Après un fork (gunicorn), le pool du parent n'est pas utilisable
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(
+                max_workers=max(TAILLE_POOL, 1),
+                mp_context=_contexte(),
+                initializer=initialiser_processus,
+            )
+            _pool_pid = os.getpid()
+            # Les processus sont créés à la demande : on les démarre tous
+            _prechauffage = [_pool.submit(_prechauffer) for _ in range(max(TAILLE_POOL, 1))]
+        return _pool
+
+
+def pret(timeout=TIMEOUT_RENDU):
+    """Attend que les processus du pool soient démarrés et préchauffés."""
+    wait(_prechauffage, timeout=timeout)
+
+
+def _reinitialiser(ancien):
+    global _pool
+    with _verrou:
+        if _pool is ancien:
+            _pool = None
+    ancien.shutdown(wait=False, cancel_futures=True)
+
+
+def executer(fonction, *args, timeout=TIMEOUT_RENDU):
+    """Exécute `fonction(*args)` sur le pool et attend au plus `timeout` secondes.
+
+    Lève `DelaiDepasse` si le rendu est trop long. Un processus bloqué ne
+    peut pas être interrompu : il reste occupé jusqu'à la fin de son rendu.
+    """
+    if TAILLE_POOL <= 0:
+        return deballer(fonction(*args))
+
+    executeur = pool()
+    try:
+        futur = executeur.submit(fonction, *args)
+        try:
+            with metriques.etape("pool_rendu"):
+                resultat = futur.result(timeout=timeout)
+            return deballer(resultat)
+        except DelaiDepasse:
+            futur.cancel()
+            raise
+    except BrokenProcessPool:
+        # Un processus enfant est mort : le pool sera recréé au prochain appel
+        _reinitialiser(executeur)
+        raise
+
+
+async def executer_async(fonction, *args, timeout=TIMEOUT_RENDU):
+    """Comme `executer`, mais la boucle asyncio reste libre pendant le rendu."""
+    boucle = asyncio.get_running_loop()
+    if TAILLE_POOL <= 0:
+        return deballer(await boucle.run_in_executor(None, fonction, *args))
+
+    executeur = pool()
+    try:
+        futur = executeur.submit(fonction, *args)
+        try:
+            with metriques.etape("pool_rendu"):
+                resultat = await asyncio.wait_for(asyncio.wrap_future(futur), timeout)
+            return deballer(resultat)
+        except DelaiDepasse:
+            futur.cancel()
+            raise
+    except BrokenProcessPool:
+        _reinitialiser(executeur)
+        raise
+
+
+def version_facture(chemin_entete=CHEMIN_ENTETE):
+    """Version du rendu des factures, utilisée dans la clé du cache PDF.
+
+    Comprend les réglages qui changent le PDF produit : optimisation et
+    adresse Supabase (elle figure dans le QR code).
+    """
+    from creationfacture import VERSION_RENDU
+    from donnees import SUPABASE_URL
+    from entete import registre as registre_entetes
+    from optimisation_pdf import reglages
+
+    return f"{VERSION_RENDU}:{registre_entetes.version(chemin_entete)}:{reglages()}:{SUPABASE_URL}"
+
+
+def deballer(resultat):
+    """Reprend les mesures d'étapes faites dans le processus de rendu et
+    retourne les octets du PDF."""
+    contenu, mesures = resultat
+    metriques.ajouter(mesures)
+    return contenu
+
+
+def rendre_facture(chemin_entete, data):
+    """Exécuté dans un processus du pool : retourne (octets du PDF, mesures)."""
+    from creationfacture import generer_facture_eden_dynamique
+
+    jeton = metriques.debut_collecte()
+    try:
+        pdf_buffer = generer_facture_eden_dynamique(chemin_entete, data)
+    finally:
+        mesures = metriques.fin_collecte(jeton)
+    if not hasattr(pdf_buffer, "getvalue"):
+        erreur = pdf_buffer.get("error") if isinstance(pdf_buffer, dict) else None
+        raise RuntimeError(erreur or "Erreur lors de la génération de la facture")
+    return pdf_buffer.getvalue(), mesures
+
+
+def rendre_dossier(data):
+    """Exécuté dans un processus du pool : retourne (octets du PDF, mesures)."""
+    from creationdossier import create_dossier
+
+    jeton = metriques.debut_collecte()
+    try:
+        contenu = create_dossier(data).getvalue()
+    finally:
+        mesures = metriques.fin_collecte(jeton)
+    return contenu, mesures
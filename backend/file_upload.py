@@ -0,0 +1,515 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from metriques import etape
+
+# ===================== FILE D'ATTENTE DES UPLOADS =====================
+# Les PDF à envoyer vers Supabase Storage sont déposés dans un répertoire de
+# spool et référencés dans une base SQLite locale. Un thread par worker
+# consomme la file : l'upload ne fait plus partie du temps de réponse HTTP.
+# La file survit à un redémarrage et peut être partagée par plusieurs workers
+# (la réservation d'une tâche est atomique).
+#
+# Le rendu étant reproductible, l'empreinte sha256 du dernier contenu envoyé
+# pour chaque fichier est gardée dans la table `objets` (et dans les
+# métadonnées de l'objet côté Storage) : un PDF identique n'est ni mis en
+# file ni renvoyé. Tant qu'un envoi est en cours pour le fichier, l'objet
+# stocké va changer et le nouveau contenu est toujours mis en file : si
+# l'envoi réussit avec le même contenu, la tâche suivante le voit dans
+# `objets` et finit INCHANGEE sans rien envoyer ; s'il échoue, c'est elle qui
+# envoie le contenu. Les envois d'un même fichier ne sont jamais réservés en
+# parallèle, pour que le dernier soumis gagne.
+#
+# Un échec dû à une panne de Storage (délai dépassé, disjoncteur ouvert, voir
+# resilience.py) ne compte pas comme une tentative : la tâche est reprogrammée
+# après le Retry-After annoncé, aussi longtemps que dure la panne. Seules les
+# autres erreurs consomment les EDEN_UPLOAD_TENTATIVES tentatives.
+# Un envoi hors délai n'est qu'abandonné et peut encore aboutir : la tâche
+# garde sa réservation jusqu'à la fin réelle de l'appel, et aucun envoi du
+# même fichier ne part avant. Chaque réservation incrémente la génération de
+# la tâche ; un résultat n'est enregistré que si la génération n'a pas changé
+# (sinon la réservation a expiré et un autre worker a repris la tâche).
+#
+# Une tâche en échec garde son contenu, déplacé dans le sous-répertoire
+# "echecs" du spool : `relancer(job_id)` la remet en file. Il est supprimé dès
+# qu'une version plus récente du même fichier est stockée, ou à la purge.
+# Les tâches finies depuis plus de EDEN_UPLOAD_JOURS jours sont effacées de
+# la base (purge faite par le thread consommateur, au plus une fois par heure).
+
+UPLOAD_DB = os.environ.get(
+    "EDEN_UPLOAD_DB", os.path.join(tempfile.gettempdir(), "eden_uploads.sqlite3")
+)
+UPLOAD_SPOOL = os.environ.get(
+    "EDEN_UPLOAD_SPOOL", os.path.join(tempfile.gettempdir(), "eden_uploads")
+)
+MAX_TENTATIVES = int(os.environ.get("EDEN_UPLOAD_TENTATIVES", "5"))
+DELAI_BASE = float(os.environ.get("EDEN_UPLOAD_DELAI", "2"))
+DELAI_MAX = 300
+JOURS_CONSERVATION = float(os.environ.get("EDEN_UPLOAD_JOURS", "14"))
+INTERVALLE_PURGE = 3600
+# Au-delà, une tâche "en_cours" est considérée comme abandonnée (worker tué).
+# Bien plus long qu'un envoi vers Storage, borné par le client HTTP (donnees.py)
+DUREE_RESERVATION = 120
+
+EN_ATTENTE = "en_attente"
+EN_COURS = "en_cours"
+TERMINEE = "terminee"
+ECHEC = "echec"
+REMPLACEE = "remplacee"
+INCHANGEE = "inchangee"
+FINIES = (TERMINEE, ECHEC, REMPLACEE, INCHANGEE)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    fichier TEXT NOT NULL,
+    spool TEXT NOT NULL,
+    statut TEXT NOT NULL,
+    tentatives INTEGER NOT NULL DEFAULT 0,
+    prochain_essai REAL NOT NULL,
+    reserve_jusqua REAL,
+    erreur TEXT,
+    url TEXT,
+    cree_le REAL NOT NULL,
+    maj_le REAL NOT NULL,
+    empreinte TEXT,
+    generation INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS uploads_statut ON uploads (statut, prochain_essai);
+CREATE INDEX IF NOT EXISTS uploads_fichier ON uploads (fichier);
+CREATE TABLE IF NOT EXISTS objets (
+    fichier TEXT PRIMARY KEY,
+    empreinte TEXT NOT NULL,
+    maj_le REAL NOT NULL
+);
+"""
+
+# Bases créées avant l'ajout d'une colonne
+_MIGRATIONS = (
+    "ALTER TABLE uploads ADD COLUMN empreinte TEXT",
+    "ALTER TABLE uploads ADD COLUMN generation INTEGER NOT NULL DEFAULT 0",
+)
+
+_COLONNES = ("id", "fichier", "statut", "tentatives", "prochain_essai", "erreur", "url", "cree_le", "maj_le")
+
+
+class FileUpload:
+    def __init__(self, envoyer, chemin_db=UPLOAD_DB, spool=UPLOAD_SPOOL,
+                 max_tentatives=MAX_TENTATIVES, delai_base=DELAI_BASE, empreinte_distante=None,
+                 jours_conservation=JOURS_CONSERVATION):
+        """`envoyer(contenu, fichier, empreinte)` doit renvoyer {"success": bool, ...},
+        avec "retry_after" (secondes) si le service est momentanément indisponible
+        et "abandonnes" (futurs) si des envois hors délai tournent encore.
+
+        `empreinte_distante(fichier)`, optionnelle, lit l'empreinte de l'objet
+        déjà stocké quand la base locale ne la connaît pas.
+        """
+        self.envoyer = envoyer
+        self.empreinte_distante = empreinte_distante
+        self.chemin_db = chemin_db
+        self.spool = spool
+        self.max_tentatives = max_tentatives
+        self.delai_base = delai_base
+        self.jours_conservation = jours_conservation
+        self._derniere_purge = 0
+        self._reveil = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._schema_ok = False
+
+    def _connexion(self):
+        cnx = sqlite3.connect(self.chemin_db, timeout=30, isolation_level=None)
+        if not self._schema_ok:
+            cnx.executescript(_SCHEMA)
+            for migration in _MIGRATIONS:
+                try:
+                    cnx.execute(migration)
+                except sqlite3.OperationalError:
+                    pass  # colonne déjà présente
+            self._schema_ok = True
+        return cnx
+
+    # ---------- empreintes ----------
+    def empreinte(self, fichier):
+        """Empreinte du dernier contenu envoyé sous le nom `fichier`, ou None."""
+        cnx = self._connexion()
+        try:
+            ligne = cnx.execute("SELECT empreinte FROM objets WHERE fichier = ?", (fichier,)).fetchone()
+        finally:
+            cnx.close()
+        return ligne[0] if ligne else None
+
+    def _noter_empreinte(self, cnx, fichier, empreinte):
+        cnx.execute(
+            "INSERT INTO objets (fichier, empreinte, maj_le) VALUES (?, ?, ?) "
+            "ON CONFLICT (fichier) DO UPDATE SET empreinte = excluded.empreinte, maj_le = excluded.maj_le",
+            (fichier, empreinte, time.time()),
+        )
+
+    # ---------- côté producteur ----------
+    def soumettre(self, contenu, fichier):
+        """Met `contenu` en file pour être envoyé sous le nom `fichier`.
+
+        Retourne l'identifiant de la tâche, ou None si ce contenu est déjà
+        celui de l'objet stocké et qu'aucun envoi n'est en cours pour ce
+        fichier. Une tâche encore en attente pour le même fichier est
+        remplacée : seule la dernière version est envoyée.
+        """
+        empreinte = hashlib.sha256(contenu).hexdigest()
+        maintenant = time.time()
+        spool = None
+        cnx = self._connexion()
+        try:
+            cnx.execute("BEGIN IMMEDIATE")
+            anciennes = cnx.execute(
+                "SELECT id, spool FROM uploads WHERE fichier = ? AND statut = ?",
+                (fichier, EN_ATTENTE),
+            ).fetchall()
+            for job_id, ancien_spool in anciennes:
+                cnx.execute(
+                    "UPDATE uploads SET statut = ?, maj_le = ? WHERE id = ?",
+                    (REMPLACEE, maintenant, job_id),
+                )
+                _supprimer(ancien_spool)
+
+            # Vérifié après le remplacement : une version différente encore en
+            # attente écraserait sinon l'objet à jour. Un envoi en cours (ou
+            # abandonné mais pas fini) peut encore changer l'objet : le
+            # contenu n'est jamais écarté pendant ce temps.
+            en_cours = cnx.execute(
+                "SELECT 1 FROM uploads WHERE fichier = ? AND (statut = ? OR reserve_jusqua >= ?)",
+                (fichier, EN_COURS, maintenant),
+            ).fetchone()
+            stockee = cnx.execute("SELECT empreinte FROM objets WHERE fichier = ?", (fichier,)).fetchone()
+            if not en_cours and stockee and stockee[0] == empreinte:
+                cnx.execute("COMMIT")
+                return None
+
+            spool = self._ecrire_spool(contenu)
+            cur = cnx.execute(
+                "INSERT INTO uploads (fichier, spool, statut, prochain_essai, cree_le, maj_le, empreinte) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (fichier, spool, EN_ATTENTE, maintenant, maintenant, maintenant, empreinte),
+            )
+            cnx.execute("COMMIT")
+        except Exception:
+            cnx.execute("ROLLBACK")
+            if spool:
+                _supprimer(spool)
+            raise
+        finally:
+            cnx.close()
+
+        self._reveil.set()
+        return cur.lastrowid
+
+    def _ecrire_spool(self, contenu):
+        os.makedirs(self.spool, exist_ok=True)
+        fd, spool = tempfile.mkstemp(dir=self.spool, suffix=".pdf")
+        with os.fdopen(fd, "wb") as f:
+            f.write(contenu)
+        return spool
+
+    def statut(self, job_id):
+        cnx = self._connexion()
+        try:
+            ligne = cnx.execute(
+                f"SELECT {', '.join(_COLONNES)} FROM uploads WHERE id = ?", (job_id,)
+            ).fetchone()
+        finally:
+            cnx.close()
+        return dict(zip(_COLONNES, ligne)) if ligne else None
+
+    def taches(self, fichier=None, limite=50):
+        requete = f"SELECT {', '.join(_COLONNES)} FROM uploads"
+        params = []
+        if fichier:
+            requete += " WHERE fichier = ?"
+            params.append(fichier)
+        requete += " ORDER BY id DESC LIMIT ?"
+        params.append(limite)
+        cnx = self._connexion()
+        try:
+            lignes = cnx.execute(requete, params).fetchall()
+        finally:
+            cnx.close()
+        return [dict(zip(_COLONNES, ligne)) for ligne in lignes]
+
+    def relancer(self, job_id):
+        """Remet en file une tâche en échec, avec toutes ses tentatives.
+
+        Refusé si une version plus récente du fichier a été soumise depuis :
+        l'ancienne l'écraserait.
+        """
+        cnx = self._connexion()
+        try:
+            cnx.execute("BEGIN IMMEDIATE")
+            ligne = cnx.execute(
+                "SELECT fichier, spool, statut FROM uploads WHERE id = ?", (job_id,)
+            ).fetchone()
+            if ligne is None:
+                erreur = "Tâche introuvable"
+            elif ligne[2] != ECHEC:
+                erreur = f"Tâche {ligne[2]}, seule une tâche en échec peut être relancée"
+            elif not os.path.exists(ligne[1]):
+                erreur = "Contenu de la tâche supprimé"
+            elif cnx.execute(
+                "SELECT 1 FROM uploads WHERE fichier = ? AND id > ?", (ligne[0], job_id)
+            ).fetchone():
+                erreur = "Une version plus récente du fichier a été soumise"
+            else:
+                erreur = None
+                maintenant = time.time()
+                cnx.execute(
+                    "UPDATE uploads SET statut = ?, tentatives = 0, prochain_essai = ?, maj_le = ? "
+                    "WHERE id = ?",
+                    (EN_ATTENTE, maintenant, maintenant, job_id),
+                )
+            cnx.execute("COMMIT")
+        except Exception:
+            cnx.execute("ROLLBACK")
+            raise
+        finally:
+            cnx.close()
+
+        if erreur:
+            return {"success": False, "error": erreur}
+        self._reveil.set()
+        return {"success": True, "id": job_id}
+
+    def purger(self, jours=None):
+        """Efface les tâches finies depuis plus de `jours` jours. Retourne leur nombre."""
+        jours = self.jours_conservation if jours is None else jours
+        limite = time.time() - jours * 86400
+        marques = ", ".join("?" * len(FINIES))
+        cnx = self._connexion()
+        try:
+            cnx.execute("BEGIN IMMEDIATE")
+            spools = cnx.execute(
+                f"DELETE FROM uploads WHERE statut IN ({marques}) AND maj_le < ? RETURNING spool",
+                (*FINIES, limite),
+            ).fetchall()
+            cnx.execute("COMMIT")
+        except Exception:
+            cnx.execute("ROLLBACK")
+            raise
+        finally:
+            cnx.close()
+        # Seules les tâches en échec ont encore un spool
+        for (spool,) in spools:
+            _supprimer(spool)
+        return len(spools)
+
+    # ---------- côté consommateur ----------
+    def _reserver(self):
+        maintenant = time.time()
+        cnx = self._connexion()
+        try:
+            cnx.execute("BEGIN IMMEDIATE")
+            # Pas de tâche d'un fichier dont un autre envoi est en cours, ou
+            # abandonné mais pas fini (réservation gardée, quel que soit le
+            # statut) : il pourrait finir après elle et remettre l'ancienne version
+            ligne = cnx.execute(
+                "SELECT id, fichier, spool, tentatives FROM uploads AS u "
+                "WHERE ((statut = ? AND prochain_essai <= ? AND (reserve_jusqua IS NULL OR reserve_jusqua < ?)) "
+                "   OR (statut = ? AND reserve_jusqua < ?)) "
+                "  AND NOT EXISTS (SELECT 1 FROM uploads AS autre WHERE autre.fichier = u.fichier "
+                "                  AND autre.id != u.id AND autre.reserve_jusqua >= ?) "
+                "ORDER BY prochain_essai LIMIT 1",
+                (EN_ATTENTE, maintenant, maintenant, EN_COURS, maintenant, maintenant),
+            ).fetchone()
+            if ligne:
+                generation = cnx.execute(
+                    "UPDATE uploads SET statut = ?, reserve_jusqua = ?, generation = generation + 1, "
+                    "maj_le = ? WHERE id = ? RETURNING generation",
+                    (EN_COURS, maintenant + DUREE_RESERVATION, maintenant, ligne[0]),
+                ).fetchone()[0]
+                ligne = (*ligne, generation)
+            cnx.execute("COMMIT")
+        except Exception:
+            cnx.execute("ROLLBACK")
+            raise
+        finally:
+            cnx.close()
+        return ligne
+
+    def _terminer(self, job_id, generation, statut, tentatives, erreur=None, url=None,
+                  prochain_essai=None, empreinte=None, spool=None, en_vol=False):
+        """Enregistre le résultat de la réservation `generation` de la tâche.
+
+        Retourne False, sans rien changer, si la tâche a été réservée à
+        nouveau entre-temps. Avec `en_vol`, la réservation est gardée : un
+        envoi abandonné tourne encore (voir `_liberer_apres`).
+        """
+        maintenant = time.time()
+        cnx = self._connexion()
+        try:
+            cnx.execute("BEGIN IMMEDIATE")
+            fichier = cnx.execute(
+                "UPDATE uploads SET statut = ?, tentatives = ?, erreur = ?, url = ?, "
+                "prochain_essai = COALESCE(?, prochain_essai), spool = COALESCE(?, spool), "
+                "reserve_jusqua = CASE WHEN ? THEN reserve_jusqua END, maj_le = ? "
+                "WHERE id = ? AND generation = ? RETURNING fichier",
+                (statut, tentatives, erreur, url, prochain_essai, spool, en_vol, maintenant,
+                 job_id, generation),
+            ).fetchone()
+            if empreinte and fichier:
+                self._noter_empreinte(cnx, fichier[0], empreinte)
+                # Les versions précédentes en échec ne seront plus relancées
+                obsoletes = cnx.execute(
+                    "UPDATE uploads SET statut = ?, maj_le = ? "
+                    "WHERE fichier = ? AND id < ? AND statut = ? RETURNING spool",
+                    (REMPLACEE, maintenant, fichier[0], job_id, ECHEC),
+                ).fetchall()
+            else:
+                obsoletes = []
+            cnx.execute("COMMIT")
+        except Exception:
+            cnx.execute("ROLLBACK")
+            raise
+        finally:
+            cnx.close()
+        for (spool,) in obsoletes:
+            _supprimer(spool)
+        if fichier is None:
+            print(f"Tâche d'upload {job_id} reprise par un autre worker : résultat ignoré")
+        return fichier is not None
+
+    def _liberer_apres(self, job_id, generation, futurs):
+        """Rend la réservation de la tâche quand tous les `futurs` (envois
+        abandonnés) sont finis, s'il n'a pas été repris entre-temps."""
+        restants = [len(futurs)]
+        verrou = threading.Lock()
+
+        def fini(_futur):
+            with verrou:
+                restants[0] -= 1
+                if restants[0]:
+                    return
+            try:
+                cnx = self._connexion()
+                try:
+                    cnx.execute(
+                        "UPDATE uploads SET reserve_jusqua = NULL WHERE id = ? AND generation = ?",
+                        (job_id, generation),
+                    )
+                finally:
+                    cnx.close()
+            except sqlite3.Error as e:
+                # La réservation expirera d'elle-même
+                print(f"Réservation de la tâche d'upload {job_id} non rendue : {e}")
+            self._reveil.set()
+
+        for futur in futurs:
+            futur.add_done_callback(fini)
+
+    def _archiver_spool(self, spool):
+        """Déplace le contenu d'une tâche en échec dans spool/echecs et
+        retourne son nouveau chemin (None s'il n'a pas bougé)."""
+        echecs = os.path.join(self.spool, "echecs")
+        if os.path.dirname(spool) == echecs:
+            return None  # tâche relancée, déjà archivée
+        archive = os.path.join(echecs, os.path.basename(spool))
+        try:
+            os.makedirs(echecs, exist_ok=True)
+            os.replace(spool, archive)
+        except OSError as e:
+            print(f"Spool non archivé ({spool}) : {e}")
+            return None
+        return archive
+
+    def _deja_stocke(self, fichier, empreinte):
+        """Vrai si l'objet stocké a déjà ce contenu (base locale, puis Storage)."""
+        connue = self.empreinte(fichier)
+        if connue is None and self.empreinte_distante is not None:
+            try:
+                with etape("upload_empreinte"):
+                    connue = self.empreinte_distante(fichier)
+            except Exception as e:
+                print(f"Empreinte distante illisible ({fichier}) : {e}")
+        return connue == empreinte
+
+    def traiter_une(self):
+        """Traite une tâche échue. Retourne False si la file est vide."""
+        ligne = self._reserver()
+        if ligne is None:
+            return False
+
+        job_id, fichier, spool, tentatives, generation = ligne
+        tentatives += 1
+        try:
+            with open(spool, "rb") as f:
+                contenu = f.read()
+        except OSError as e:
+            self._terminer(job_id, generation, ECHEC, tentatives, erreur=f"Spool illisible : {e}")
+            return True
+
+        empreinte = hashlib.sha256(contenu).hexdigest()
+        if self._deja_stocke(fichier, empreinte):
+            if self._terminer(job_id, generation, INCHANGEE, tentatives, empreinte=empreinte):
+                _supprimer(spool)
+            return True
+
+        try:
+            with etape("upload_storage"):
+                resultat = self.envoyer(contenu, fichier, empreinte)
+        except Exception as e:
+            resultat = {"success": False, "error": str(e)}
+
+        if resultat.get("success"):
+            if self._terminer(job_id, generation, TERMINEE, tentatives, url=resultat.get("url"),
+                              empreinte=empreinte):
+                _supprimer(spool)
+        elif resultat.get("retry_after") is not None:
+            # Panne du service : réessayée sans limite, sans consommer de tentative
+            delai = min(max(float(resultat["retry_after"]), self.delai_base), DELAI_MAX)
+            abandonnes = resultat.get("abandonnes") or ()
+            if self._terminer(
+                job_id, generation, EN_ATTENTE, tentatives - 1, erreur=resultat.get("error"),
+                prochain_essai=time.time() + delai, en_vol=bool(abandonnes),
+            ) and abandonnes:
+                self._liberer_apres(job_id, generation, abandonnes)
+        elif tentatives >= self.max_tentatives:
+            print(f"Upload abandonné ({fichier}) : {resultat.get('error')}")
+            archive = self._archiver_spool(spool)
+            if not self._terminer(job_id, generation, ECHEC, tentatives, erreur=resultat.get("error"),
+                                  spool=archive) and archive:
+                os.replace(archive, spool)  # la tâche reprise lit toujours l'ancien chemin
+        else:
+            delai = min(self.delai_base * (2 ** (tentatives - 1)), DELAI_MAX)
+            self._terminer(
+                job_id, generation, EN_ATTENTE, tentatives,
+                erreur=resultat.get("error"), prochain_essai=time.time() + delai,
+            )
+        return True
+
+    def _boucle(self):
+        while True:
+            try:
+                if time.time() - self._derniere_purge > INTERVALLE_PURGE:
+                    self._derniere_purge = time.time()
+                    self.purger()
+                if self.traiter_une():
+                    continue
+            except Exception as e:
+                print(f"Erreur file d'upload : {e}")
+            self._reveil.wait(timeout=1)
+            self._reveil.clear()
+
+    def demarrer(self):
+        """Démarre le thread consommateur (une fois par processus)."""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._boucle, name="file-upload", daemon=True)
+        self._thread.start()
+
+
+def _supprimer(chemin):
+    try:
+        os.remove(chemin)
+    except OSError:
+        pass
@@ -0,0 +1,349 @@
+import copy
+import io
+import threading
+from reportlab.pdfbase.pdfdoc import PDFImageXObject
+from reportlab.pdfgen import canvas as rl_canvas
+from reportlab.lib.units import mm
+from ressources import image
+from texte import tronquer_texte
+
+# ===================== GABARITS DECLARATIFS =====================
+# Un gabarit est une liste d'éléments (textes fixes, valeurs liées aux
+# données, champs, cases à cocher, cadres, bandeaux, colonnes libellé/valeur).
+# Il est compilé une seule fois en une liste plate d'opérations ; chaque
+# requête ne fait que rejouer cette liste avec ses données.
+#
+# Une opération est un tuple (statique, op, args) :
+#   - op est le nom d'une méthode du canvas (appel direct avec args), ou une
+#     fonction appelée avec (c, data, ctx, *args) pour ce qui dépend des données ;
+#   - statique indique si l'opération est identique pour toutes les requêtes
+#     (None pour les opérations de structure, communes aux deux couches).
+#
+# La couche statique peut être rendue une seule fois par processus (FondStatique)
+# puis posée comme form XObject : chaque requête ne dessine plus que les valeurs.
+# Les images (logo) en font partie : elles sont encodées une fois par processus.
+
+_METHODES_TEXTE = {
+    "gauche": "drawString",
+    "droite": "drawRightString",
+    "centre": "drawCentredString",
+}
+
+
+def lire(data, cle, defaut=None):
+    """Lit une valeur par chemin pointé ("facture.numero") dans `data`."""
+    valeur = data
+    for partie in cle.split("."):
+        if not isinstance(valeur, dict):
+            return defaut
+        valeur = valeur.get(partie, defaut)
+    return valeur
+
+
+# ---------- éléments ----------
+def Texte(x, y, texte, police="Helvetica", taille=12, align="gauche"):
+    return ("texte", x, y, texte, police, taille, align)
+
+
+def Valeur(x, y, cle, police="Helvetica", taille=12, align="gauche",
+           format=str, defaut="", largeur=None, si_vide=True):
+    """Valeur lue dans les données. `largeur` tronque le texte (ellipse),
+    `si_vide=False` n'affiche rien quand la valeur est vide."""
+    return ("valeur", x, y, cle, police, taille, align, format, defaut, largeur, si_vide)
+
+
+def Choix(cle, options, defaut):
+    """Libellé choisi selon la valeur de `cle` (ex: import/export), à utiliser dans Colonnes."""
+    return ("choix", cle, dict(options), defaut)
+
+
+def Pointilles(x, y, largeur):
+    return ("pointilles", x, y, largeur)
+
+
+def Champ(x, y, label, cle, largeur=80*mm, largeur_label=35*mm):
+    """Libellé, ligne pointillée et valeur, comme sur un formulaire papier."""
+    return ("champ", x, y, label, cle, largeur, largeur_label)
+
+
+def Case(x, y, cote, cle, attendu, police="Helvetica-Bold", taille=12):
+    """Case à cocher, marquée d'un X si data[cle] vaut `attendu`."""
+    return ("case", x, y, cote, cle, attendu, police, taille)
+
+
+def Cadre(x, y, largeur, hauteur):
+    return ("cadre", x, y, largeur, hauteur)
+
+
+def Ligne(x1, y1, x2, y2):
+    return ("ligne", x1, y1, x2, y2)
+
+
+def Trait(epaisseur):
+    return ("trait", epaisseur)
+
+
+def Bandeau(y, titre, x1, x2, police="Helvetica-Bold", taille=26):
+    """Titre de section encadré de deux doubles filets."""
+    return ("bandeau", y, titre, x1, x2, police, taille)
+
+
+def Colonnes(x_label, x_valeur, y, pas, lignes, police_label="Helvetica-Bold",
+             police_valeur="Helvetica", taille=8.5, largeur=None):
+    """Colonnes libellé/valeur, une ligne tous les `pas` points.
+
+    `lignes` : [(libellé ou Choix(...), clé[, format]), ...]
+    """
+    return ("colonnes", x_label, x_valeur, y, pas, tuple(lignes), police_label,
+            police_valeur, taille, largeur)
+
+
+def Image(nom, x, y, largeur):
+    return ("image", nom, x, y, largeur)
+
+
+def Decalage(nom):
+    """Les éléments suivants sont descendus de ctx[nom] points (jusqu'à FinDecalage)."""
+    return ("decalage", nom)
+
+
+def FinDecalage():
+    return ("fin_decalage",)
+
+
+def Dessin(fonction):
+    """Échappatoire pour les parties dynamiques : fonction(c, data, ctx)."""
+    return ("dessin", fonction)
+
+
+# ---------- opérations dynamiques ----------
+def _op_valeur(c, data, ctx, methode, x, y, cle, format, defaut, largeur, si_vide, police, taille):
+    valeur = lire(data, cle, defaut)
+    if not si_vide and not valeur:
+        return
+    texte = format(valeur)
+    if largeur is not None:
+        texte = tronquer_texte(texte, police, taille, largeur)
+    getattr(c, methode)(x, y, texte)
+
+
+def _op_choix(c, data, ctx, methode, x, y, cle, options, defaut):
+    getattr(c, methode)(x, y, options.get(lire(data, cle), defaut))
+
+
+def _op_case(c, data, ctx, x, y, cle, attendu):
+    if str(lire(data, cle, "") or "").lower() == attendu:
+        c.drawString(x, y, "X")
+
+
+def _op_image(c, data, ctx, nom, x, y, largeur):
+    img = image(nom)
+    if img is not None:
+        c.drawImage(img, x, y, width=largeur, preserveAspectRatio=True, mask='auto')
+
+
+def _op_decalage(c, data, ctx, nom):
+    c.saveState()
+    c.translate(0, -ctx.get(nom, 0))
+
+
+def _op_dessin(c, data, ctx, fonction):
+    fonction(c, data, ctx)
+
+
+# ---------- compilation ----------
+def _police(police, taille):
+    return (True, "setFont", (police, taille))
+
+
+def _compiler_element(el):
+    genre = el[0]
+    if genre == "texte":
+        _, x, y, texte, police, taille, align = el
+        return [_police(police, taille), (True, _METHODES_TEXTE[align], (x, y, texte))]
+    if genre == "valeur":
+        _, x, y, cle, police, taille, align, format, defaut, largeur, si_vide = el
+        return [
+            (False, "setFont", (police, taille)),
+            (False, _op_valeur, (_METHODES_TEXTE[align], x, y, cle, format, defaut,
+                                 largeur, si_vide, police, taille)),
+        ]
+    if genre == "pointilles":
+        _, x, y, largeur = el
+        return [
+            (True, "setDash", (1, 2)),
+            (True, "line", (x, y, x + largeur, y)),
+            (True, "setDash", ()),
+        ]
+    if genre == "champ":
+        _, x, y, label, cle, largeur, largeur_label = el
+        debut = x + largeur_label
+        return (
+            _compiler_element(Texte(x, y, label, "Helvetica", 12))
+            + _compiler_element(Pointilles(debut, y - 2, largeur))
+            + _compiler_element(Valeur(debut + 2, y + 1, cle, "Helvetica", 11, si_vide=False))
+        )
+    if genre == "case":
+        _, x, y, cote, cle, attendu, police, taille = el
+        return [
+            (True, "rect", (x, y - 1*mm, cote, cote)),
+            (False, "setFont", (police, taille)),
+            (False, _op_case, (x + 1*mm, y, cle, attendu)),
+        ]
+    if genre == "cadre":
+        _, x, y, largeur, hauteur = el
+        return [(True, "rect", (x, y, largeur, hauteur))]
+    if genre == "ligne":
+        return [(True, "line", el[1:])]
+    if genre == "trait":
+        return [(True, "setLineWidth", (el[1],))]
+    if genre == "bandeau":
+        _, y, titre, x1, x2, police, taille = el
+        return [
+            (True, "line", (x1, y, x2, y)),
+            (True, "line", (x1, y - 1*mm, x2, y - 1*mm)),
+            _police(police, taille),
+            (True, "drawCentredString", ((x1 + x2) / 2, y - 11*mm, titre)),
+            (True, "line", (x1, y - 15*mm, x2, y - 15*mm)),
+            (True, "line", (x1, y - 16*mm, x2, y - 16*mm)),
+        ]
+    if genre == "colonnes":
+        _, x_label, x_valeur, y, pas, lignes, police_label, police_valeur, taille, largeur = el
+        ops = []
+        for i, (label, cle, *format) in enumerate(lignes):
+            y_ligne = y - i * pas
+            if isinstance(label, tuple):
+                _, cle_choix, options, defaut = label
+                ops += [
+                    (False, "setFont", (police_label, taille)),
+                    (False, _op_choix, ("drawString", x_label, y_ligne, cle_choix, options, defaut)),
+                ]
+            else:
+                ops += _compiler_element(Texte(x_label, y_ligne, label, police_label, taille))
+            ops += _compiler_element(Valeur(x_valeur, y_ligne, cle, police_valeur, taille,
+                                            format=format[0] if format else str,
+                                            defaut=None, largeur=largeur))
+        return ops
+    if genre == "image":
+        return [(True, _op_image, el[1:])]
+    if genre == "decalage":
+        return [(None, _op_decalage, el[1:])]
+    if genre == "fin_decalage":
+        return [(None, "restoreState", ())]
+    if genre == "dessin":
+        return [(False, _op_dessin, el[1:])]
+    raise ValueError(f"Élément de gabarit inconnu : {genre}")
+
+
+def _optimiser(ops):
+    """Retire les setFont redondants (police déjà active)."""
+    resultat = []
+    police = None
+    for op in ops:
+        statique, nom, args = op
+        if nom == "setFont":
+            if args == police:
+                continue
+            police = args
+        elif not isinstance(nom, str) or nom == "restoreState":
+            # Dessin libre ou fin de décalage : la police active est inconnue
+            if nom not in (_op_valeur, _op_choix, _op_case, _op_image, _op_decalage):
+                police = None
+        resultat.append(op)
+    return resultat
+
+
+STATIQUE = "statique"
+DYNAMIQUE = "dynamique"
+
+
+def compiler(gabarit, couche=None):
+    """Compile une liste d'éléments en liste plate d'opérations.
+
+    `couche` (STATIQUE ou DYNAMIQUE) ne garde que les opérations de cette
+    couche, plus les opérations de structure (décalages).
+    """
+    ops = []
+    for element in gabarit:
+        ops += _compiler_element(element)
+    if couche is not None:
+        garder = couche == STATIQUE
+        ops = [op for op in ops if op[0] is None or op[0] == garder]
+    return tuple(_optimiser(ops))
+
+
+def rendre(ops, c, data, ctx=None):
+    """Rejoue les opérations compilées sur le canvas `c` avec `data`."""
+    if ctx is None:
+        ctx = {}
+    for _, op, args in ops:
+        if op.__class__ is str:
+            getattr(c, op)(*args)
+        else:
+            op(c, data, ctx, *args)
+    return ctx
+
+
+class FondStatique:
+    """Couche statique d'un gabarit, rendue une fois par processus.
+
+    Le flux d'opérations PDF de la couche est capturé une fois pour chaque
+    combinaison de décalages (ctx), puis réinjecté comme form XObject dans
+    chaque nouveau canvas : la requête ne paie plus que le dessin des valeurs.
+    """
+
+    def __init__(self, gabarit, nom="Fond"):
+        self.nom = nom
+        self.ops = compiler(gabarit, STATIQUE)
+        self.decalages = tuple(args[0] for _, op, args in self.ops if op is _op_decalage)
+        self._captures = {}
+        self._verrou = threading.Lock()
+
+    def _capturer(self, pagesize, ctx):
+        sonde = rl_canvas.Canvas(io.BytesIO(), pagesize=pagesize)
+        sonde.beginForm(self.nom)
+        rendre(self.ops, sonde, {}, dict(ctx))
+        # Les noms internes des polices (/F1, /F2...) dépendent de leur ordre d'apparition
+        polices = tuple(sonde._doc.fontMapping.items())
+        # Les images sont nommées par l'empreinte de leur contenu : leurs objets
+        # déjà encodés sont réutilisés tels quels dans chaque document
+        images = tuple(
+            (nom, objet) for nom, objet in sonde._doc.idToObject.items()
+            if isinstance(objet, PDFImageXObject)
+        )
+        return tuple(sonde._code), polices, images, tuple(sonde._formsinuse)
+
+    def dessiner(self, c, ctx=None):
+        """Pose la couche statique sur la page courante de `c`.
+
+        À appeler avant toute autre opération sur un canvas neuf, pour que
+        les polices y reçoivent les mêmes noms internes qu'à la capture.
+        """
+        ctx = ctx or {}
+        cle = (c._pagesize, tuple(ctx.get(nom, 0) for nom in self.decalages))
+        capture = self._captures.get(cle)
+        if capture is None:
+            with self._verrou:
+                capture = self._captures.get(cle)
+                if capture is None:
+                    capture = self._capturer(c._pagesize, ctx)
+                    self._captures[cle] = capture
+        code, polices, images, formes = capture
+
+        c.beginForm(self.nom)
+        for police, nom_interne in polices:
+            if c._doc.getInternalFontName(police) != nom_interne:
+                # Canvas déjà utilisé : on rejoue simplement la couche
+                rendre(self.ops, c, {}, dict(ctx))
+                break
+        else:
+            for nom, objet in images:
+                if nom not in c._doc.idToObject:
+                    # Copie sans le nom interne posé par l'enregistrement dans la sonde
+                    copie = copy.copy(objet)
+                    del copie.__InternalName__
+                    c._doc.Reference(copie, nom)
+            c._code.extend(code)
+            c._formsinuse.extend(formes)
+        c.endForm()
+        c.doForm(self.nom)
@@ -0,0 +1,49 @@
+import gc
+import os
+
+# ===================== CONFIGURATION GUNICORN =====================
+# Lancement : gunicorn -c gunicorn.conf.py app:app
+#
+# Le maître importe l'app une seule fois (preload_app) : les ressources de
+# rendu préchargées sont partagées par les workers forkés en copie sur
+# écriture. Chaque worker démarre ensuite ses propres threads et son pool,
+# puis fait un rendu de préchauffage avant d'accepter des requêtes. Les
+# processus de rendu ne sont pas forkés depuis le maître : ils partagent le
+# préchargement de leur propre serveur de processus (voir executeur.py).
+#
+# EDEN_PRECHARGEMENT=0 revient au chargement de l'app dans chaque worker.
+#
+# WEB_CONCURRENCY est aussi lu par executeur.py pour partager les cœurs entre
+# les pools de rendu des workers : il est fixé ici avant l'import de l'app.
+
+os.environ.setdefault("EDEN_PRECHARGEMENT", "1")
+os.environ.setdefault("WEB_CONCURRENCY", "2")
+
+bind = os.environ.get("EDEN_BIND", f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ["WEB_CONCURRENCY"])
+threads = int(os.environ.get("EDEN_THREADS", "4"))
+timeout = int(os.environ.get("EDEN_GUNICORN_TIMEOUT", "60"))
+preload_app = os.environ["EDEN_PRECHARGEMENT"] == "1"
+
+
+def on_starting(server):
+    # Instantanés des métriques laissés par une exécution précédente
+    from metriques import DOSSIER_PARTAGE
+    if DOSSIER_PARTAGE and os.path.isdir(DOSSIER_PARTAGE):
+        for nom in os.listdir(DOSSIER_PARTAGE):
+            if nom.endswith(".json"):
+                os.remove(os.path.join(DOSSIER_PARTAGE, nom))
+
+
+def when_ready(server):
+    # Les objets préchargés ne sont plus parcourus par le ramasse-miettes :
+    # leurs pages mémoire restent partagées entre les workers
+    if preload_app:
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    # Appelé dans le worker après le fork, avant qu'il accepte des requêtes
+    if preload_app:
+        from demarrage import demarrer_worker
+        demarrer_worker()
@@ -0,0 +1,268 @@
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# ===================== METRIQUES DE PERFORMANCE =====================
+# Chaque étape chaude (select Supabase, QR, dessin, fusion pypdf, écriture,
+# mise en file de l'upload...) est chronométrée avec `etape(nom)`.
+#   - pendant une requête, les mesures sont collectées pour l'en-tête
+#     Server-Timing puis versées dans les histogrammes à la fin de la requête ;
+#   - hors requête (thread d'upload...), elles vont directement dans les
+#     histogrammes.
+# Les histogrammes sont exposés au format Prometheus par /metrics.
+#
+# Chaque worker (gunicorn ou uvicorn) a ses propres compteurs : il en écrit
+# un instantané toutes les INTERVALLE_PARTAGE secondes dans
+# EDEN_METRIQUES_DIR, et /metrics additionne ceux de tous les workers
+# vivants, quel que soit le worker qui répond. Les jauges (valeurs
+# instantanées) ne s'additionnent pas : chacune porte le label worker=<pid>.
+# Un instantané non rafraîchi depuis EXPIRATION_PARTAGE secondes est celui
+# d'un worker arrêté : il est ignoré puis supprimé (ses compteurs repartent
+# de zéro, ce que Prometheus traite comme un redémarrage).
+#
+# EDEN_METRIQUES_DIR : répertoire des instantanés ("" : chaque worker
+#                      n'expose que ses propres compteurs)
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+DOSSIER_PARTAGE = os.environ.get("EDEN_METRIQUES_DIR", os.path.join(tempfile.gettempdir(), "eden_metriques"))
+INTERVALLE_PARTAGE = 2
+EXPIRATION_PARTAGE = 30
+
+_mesures_requete = contextvars.ContextVar("mesures_requete", default=None)
+
+
+class Histogramme:
+    def __init__(self, nom, aide, label, buckets=BUCKETS):
+        self.nom = nom
+        self.aide = aide
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._verrou = threading.Lock()
+
+    def observer(self, valeur_label, duree):
+        with self._verrou:
+            serie = self._series.get(valeur_label)
+            if serie is None:
+                serie = self._series[valeur_label] = [[0] * len(self.buckets), 0.0, 0]
+            compteurs = serie[0]
+            for i, borne in enumerate(self.buckets):
+                if duree <= borne:
+                    compteurs[i] += 1
+            serie[1] += duree
+            serie[2] += 1
+
+    def etat(self):
+        with self._verrou:
+            return {k: [list(v[0]), v[1], v[2]] for k, v in self._series.items()}
+
+    def exposition(self, etats=None):
+        """Lignes Prometheus ; `etats` : ceux de plusieurs workers, additionnés."""
+        lignes = [f"# HELP {self.nom} {self.aide}", f"# TYPE {self.nom} histogram"]
+        series = {}
+        for etat in etats if etats is not None else [self.etat()]:
+            for valeur_label, (compteurs, somme, total) in etat.items():
+                serie = series.setdefault(valeur_label, [[0] * len(self.buckets), 0.0, 0])
+                serie[0] = [a + b for a, b in zip(serie[0], compteurs)]
+                serie[1] += somme
+                serie[2] += total
+        for valeur_label, (compteurs, somme, total) in sorted(series.items()):
+            etiquette = f'{self.label}="{valeur_label}"'
+            for borne, compte in zip(self.buckets, compteurs):
+                lignes.append(f'{self.nom}_bucket{{{etiquette},le="{borne}"}} {compte}')
+            lignes.append(f'{self.nom}_bucket{{{etiquette},le="+Inf"}} {total}')
+            lignes.append(f"{self.nom}_sum{{{etiquette}}} {somme}")
+            lignes.append(f"{self.nom}_count{{{etiquette}}} {total}")
+        return lignes
+
+
+class Compteur:
+    def __init__(self, nom, aide, labels):
+        self.nom = nom
+        self.aide = aide
+        self.labels = labels
+        self._valeurs = {}
+        self._verrou = threading.Lock()
+
+    def incrementer(self, *valeurs_labels):
+        with self._verrou:
+            self._valeurs[valeurs_labels] = self._valeurs.get(valeurs_labels, 0) + 1
+
+    def etat(self):
+        with self._verrou:
+            return [[list(k), v] for k, v in self._valeurs.items()]
+
+    def exposition(self, etats=None):
+        lignes = [f"# HELP {self.nom} {self.aide}", f"# TYPE {self.nom} counter"]
+        valeurs = {}
+        for etat in etats if etats is not None else [self.etat()]:
+            for valeurs_labels, total in etat:
+                valeurs[tuple(valeurs_labels)] = valeurs.get(tuple(valeurs_labels), 0) + total
+        for valeurs_labels, total in sorted(valeurs.items()):
+            etiquettes = ",".join(f'{l}="{v}"' for l, v in zip(self.labels, valeurs_labels))
+            lignes.append(f"{self.nom}{{{etiquettes}}} {total}")
+        return lignes
+
+
+class Jauge:
+    """Valeurs instantanées, lues au moment de l'exposition : `lire()` -> {valeur du label: nombre}."""
+
+    def __init__(self, nom, aide, label, lire):
+        self.nom = nom
+        self.aide = aide
+        self.label = label
+        self.lire = lire
+
+    def etat(self):
+        return {str(k): v for k, v in self.lire().items()}
+
+    def exposition(self, etats=None):
+        """`etats` : {pid du worker: état} ; chaque worker garde ses valeurs."""
+        lignes = [f"# HELP {self.nom} {self.aide}", f"# TYPE {self.nom} gauge"]
+        if etats is None:
+            for valeur_label, valeur in sorted(self.etat().items()):
+                lignes.append(f'{self.nom}{{{self.label}="{valeur_label}"}} {valeur}')
+            return lignes
+        for pid, etat in sorted(etats.items()):
+            for valeur_label, valeur in sorted(etat.items()):
+                lignes.append(f'{self.nom}{{{self.label}="{valeur_label}",worker="{pid}"}} {valeur}')
+        return lignes
+
+
+ETAPES = Histogramme(
+    "eden_etape_duree_secondes", "Durée des étapes du rendu et des appels externes.", "etape"
+)
+REQUETES = Histogramme(
+    "eden_requete_duree_secondes", "Durée totale des requêtes HTTP par route.", "route"
+)
+_registre = [ETAPES, REQUETES]
+
+
+def enregistrer(metrique):
+    """Ajoute une métrique (tout objet avec nom, etat() et exposition()) à /metrics."""
+    _registre.append(metrique)
+    return metrique
+
+
+def observer(nom, duree):
+    """Enregistre une durée d'étape (dans la requête en cours s'il y en a une)."""
+    mesures = _mesures_requete.get()
+    if mesures is not None:
+        mesures.append((nom, duree))
+    else:
+        ETAPES.observer(nom, duree)
+
+
+@contextmanager
+def etape(nom):
+    debut = time.perf_counter()
+    try:
+        yield
+    finally:
+        observer(nom, time.perf_counter() - debut)
+
+
+# ---------- collecte par requête ----------
+def debut_collecte():
+    """Ouvre une collecte pour la requête (ou le rendu) en cours."""
+    return _mesures_requete.set([])
+
+
+def fin_collecte(jeton):
+    """Ferme la collecte et retourne la liste [(étape, durée), ...]."""
+    mesures = _mesures_requete.get() or []
+    _mesures_requete.reset(jeton)
+    return mesures
+
+
+def ajouter(mesures):
+    """Reprend des mesures faites ailleurs (processus de rendu)."""
+    for nom, duree in mesures:
+        observer(nom, duree)
+
+
+def publier(mesures):
+    for nom, duree in mesures:
+        ETAPES.observer(nom, duree)
+
+
+def server_timing(mesures):
+    """Valeur de l'en-tête Server-Timing (durées en millisecondes)."""
+    return ", ".join(f"{nom};dur={duree * 1000:.2f}" for nom, duree in mesures)
+
+
+# ---------- partage entre workers ----------
+def _chemin_instantane(pid):
+    return os.path.join(DOSSIER_PARTAGE, f"{pid}.json")
+
+
+def ecrire_instantane():
+    """Écrit l'état des métriques de ce worker dans le répertoire partagé."""
+    etat = {metrique.nom: metrique.etat() for metrique in _registre}
+    chemin = _chemin_instantane(os.getpid())
+    temporaire = f"{chemin}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(DOSSIER_PARTAGE, exist_ok=True)
+        with open(temporaire, "w") as f:
+            json.dump(etat, f)
+        os.replace(temporaire, chemin)
+    except OSError as e:
+        print(f"Instantané des métriques non écrit ({chemin}) : {e}")
+
+
+def _instantanes():
+    """{pid: état} des workers vivants, celui-ci compris."""
+    etats = {}
+    limite = time.time() - EXPIRATION_PARTAGE
+    for nom in os.listdir(DOSSIER_PARTAGE):
+        if not nom.endswith(".json"):
+            continue
+        chemin = os.path.join(DOSSIER_PARTAGE, nom)
+        try:
+            if os.stat(chemin).st_mtime < limite:
+                os.remove(chemin)
+                continue
+            with open(chemin) as f:
+                etats[nom[:-len(".json")]] = json.load(f)
+        except (OSError, ValueError):
+            continue  # supprimé ou remplacé entre-temps
+    return etats
+
+
+def _boucle_partage():
+    while True:
+        time.sleep(INTERVALLE_PARTAGE)
+        ecrire_instantane()
+
+
+_partage_pid = None
+
+
+def demarrer():
+    """Démarre l'écriture périodique de l'instantané (une fois par processus)."""
+    global _partage_pid
+    if not DOSSIER_PARTAGE or _partage_pid == os.getpid():
+        return
+    _partage_pid = os.getpid()
+    ecrire_instantane()
+    threading.Thread(target=_boucle_partage, name="metriques", daemon=True).start()
+
+
+def exposition():
+    lignes = []
+    if _partage_pid != os.getpid():
+        for metrique in _registre:
+            lignes += metrique.exposition()
+        return "\n".join(lignes) + "\n"
+
+    ecrire_instantane()
+    instantanes = _instantanes()
+    for metrique in _registre:
+        etats = {pid: etat[metrique.nom] for pid, etat in instantanes.items() if metrique.nom in etat}
+        lignes += metrique.exposition(etats if isinstance(metrique, Jauge) else list(etats.values()))
+    return "\n".join(lignes) + "\n"
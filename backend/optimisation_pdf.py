@@ -0,0 +1,284 @@
+"""Optimisation des PDF générés (factures et dossiers).
+
+Usage :
+    python optimisation_pdf.py                  # rapport de taille sur des documents types
+    python optimisation_pdf.py fichier.pdf      # rapport pour un PDF existant
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DictionaryObject, NameObject
+from reportlab.pdfgen import canvas
+
+try:
+    import pikepdf
+except ImportError:  # optionnel : seulement pour la linéarisation
+    pikepdf = None
+
+# ===================== OPTIMISATION DES PDF =====================
+# La facture est écrite page par page (archive.DocumentEntete) : ses flux de
+# contenu sont compressés au niveau EDEN_PDF_COMPRESSION, polices et entête
+# n'y sont écrits qu'une fois. Pour un PDF déjà écrit (dossier, fichier passé
+# en argument), l'étape s'applique à un PdfWriter :
+#   - compression des flux de contenu (Flate) ;
+#   - fusion des objets identiques et suppression des objets orphelins ;
+#   - suppression des ressources de page inutilisées (polices, XObjects...) ;
+#   - linéarisation optionnelle ("fast web view"), si pikepdf est installé.
+# Le dossier sort déjà compressé de ReportLab (pageCompression) et n'a pas
+# d'objets en double : seule la linéarisation le concerne.
+# L'image de l'entête peut aussi être ré-échantillonnée une fois au chargement
+# (EDEN_PDF_ENTETE_DPI) : c'est elle qui fait l'essentiel du poids d'une
+# facture. Les polices sont les 14 polices standard, non embarquées : il
+# n'y a rien à sous-ensembler.
+#
+# EDEN_PDF_OPTIMISER      : 0 pour désactiver l'étape (défaut : 1)
+# EDEN_PDF_COMPRESSION    : niveau zlib des flux de contenu (défaut : 6)
+# EDEN_PDF_LINEARISER     : 1 pour linéariser (nécessite pikepdf)
+# EDEN_PDF_ENTETE_DPI     : résolution maximale des images de l'entête (0 : inchangée)
+# EDEN_PDF_QUALITE_JPEG   : qualité JPEG des images ré-échantillonnées (défaut : 85)
+
+OPTIMISER = os.environ.get("EDEN_PDF_OPTIMISER", "1") != "0"
+NIVEAU_COMPRESSION = int(os.environ.get("EDEN_PDF_COMPRESSION", "6"))
+LINEARISER = os.environ.get("EDEN_PDF_LINEARISER", "0") == "1"
+DPI_ENTETE = int(os.environ.get("EDEN_PDF_ENTETE_DPI", "0"))
+QUALITE_JPEG = int(os.environ.get("EDEN_PDF_QUALITE_JPEG", "85"))
+
+if LINEARISER and pikepdf is None:
+    print("EDEN_PDF_LINEARISER ignoré : pikepdf n'est pas installé")
+
+
+def reglages():
+    """Réglages qui changent les octets d'une facture (entrent dans la version du cache).
+
+    La réduction des images de l'entête est déjà suivie par la version de
+    l'entête (voir entete.py).
+    """
+    return f"opt={int(OPTIMISER)},zlib={NIVEAU_COMPRESSION},lin={int(LINEARISER and pikepdf is not None)}"
+
+_CATEGORIES_RESSOURCES = ("/Font", "/XObject", "/ExtGState", "/Pattern", "/Shading", "/ColorSpace")
+_NOM = re.compile(rb"/([^\s/\[\]<>(){}%]+)")
+_AFFICHAGE_IMAGE = re.compile(
+    rb"(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+-?[\d.]+\s+-?[\d.]+\s+cm\s*/([^\s/]+)\s+Do"
+)
+
+
+# ---------- ressources inutilisées ----------
+def retirer_ressources_inutilisees(page):
+    """Retire des ressources de `page` les noms jamais cités dans son contenu.
+
+    Les dictionnaires de ressources peuvent être partagés entre pages : la page
+    reçoit des copies filtrées, les originaux ne sont jamais modifiés.
+    """
+    ressources = page.get("/Resources")
+    contenu = page.get_contents()
+    if ressources is None or contenu is None:
+        return
+    noms = {nom.decode("latin-1") for nom in _NOM.findall(contenu.get_data())}
+    filtrees = DictionaryObject()
+    for categorie, valeur in ressources.get_object().items():
+        # /ProcSet est ignoré par les lecteurs depuis PDF 1.4
+        if categorie == "/ProcSet":
+            continue
+        if categorie in _CATEGORIES_RESSOURCES:
+            dictionnaire = valeur.get_object()
+            valeur = DictionaryObject({k: v for k, v in dictionnaire.items() if k[1:] in noms})
+            if not valeur:
+                continue
+        filtrees[NameObject(categorie)] = valeur
+    page[NameObject("/Resources")] = filtrees
+
+
+def optimiser_writer(writer, optimiser=None):
+    """Optimise en place un PdfWriter avant son écriture
+    (`optimiser` : OPTIMISER par défaut)."""
+    if not (OPTIMISER if optimiser is None else optimiser):
+        return writer
+    for page in writer.pages:
+        retirer_ressources_inutilisees(page)
+        page.compress_content_streams(level=NIVEAU_COMPRESSION)
+    writer.compress_identical_objects(remove_duplicates=True, remove_unreferenced=True)
+    return writer
+
+
+def ecrire(writer, optimiser=None):
+    """Optimise et écrit `writer`. Retourne un BytesIO positionné au début."""
+    optimiser_writer(writer, optimiser)
+    output = io.BytesIO()
+    writer.write(output)
+    if LINEARISER and pikepdf is not None:
+        output = io.BytesIO(lineariser(output.getvalue()))
+    output.seek(0)
+    return output
+
+
+def optimiser_octets(contenu, optimiser=None):
+    """Optimise un PDF déjà écrit (ex: sortie ReportLab du dossier)."""
+    optimiser = OPTIMISER if optimiser is None else optimiser
+    if not optimiser and not LINEARISER:
+        return contenu
+    return ecrire(PdfWriter(clone_from=PdfReader(io.BytesIO(contenu))), optimiser).getvalue()
+
+
+def lineariser(contenu):
+    if pikepdf is None:
+        return contenu
+    sortie = io.BytesIO()
+    with pikepdf.open(io.BytesIO(contenu)) as pdf:
+        pdf.save(sortie, linearize=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+    return sortie.getvalue()
+
+
+# ---------- images de l'entête ----------
+def _tailles_affichage(page):
+    """{nom d'image: (largeur, hauteur) affichées en points}, d'après les `cm` du contenu."""
+    contenu = page.get_contents()
+    if contenu is None:
+        return {}
+    tailles = {}
+    for a, b, c, d, nom in _AFFICHAGE_IMAGE.findall(contenu.get_data()):
+        a, b, c, d = (float(v) for v in (a, b, c, d))
+        tailles["/" + nom.decode("latin-1")] = ((a * a + b * b) ** 0.5, (c * c + d * d) ** 0.5)
+    return tailles
+
+
+def reduire_images(contenu, dpi=DPI_ENTETE, qualite=QUALITE_JPEG):
+    """Ré-échantillonne les images JPEG plus fines que `dpi` à leur taille
+    d'affichage. Retourne le PDF inchangé si rien n'est à réduire."""
+    if dpi <= 0:
+        return contenu
+    from PIL import Image
+
+    writer = PdfWriter(clone_from=PdfReader(io.BytesIO(contenu)))
+    modifie = False
+    for page in writer.pages:
+        xobjets = page.get("/Resources", {}).get("/XObject", {})
+        for nom, (largeur_pt, hauteur_pt) in _tailles_affichage(page).items():
+            if nom not in xobjets:
+                continue
+            image = xobjets[nom].get_object()
+            if (image.get("/Subtype") != "/Image" or image.get("/Filter") != "/DCTDecode"
+                    or image.get("/ColorSpace") not in ("/DeviceRGB", "/DeviceGray")
+                    or "/SMask" in image or "/Decode" in image):
+                continue
+            largeur = max(1, round(largeur_pt / 72 * dpi))
+            hauteur = max(1, round(hauteur_pt / 72 * dpi))
+            if largeur >= image["/Width"]:
+                continue
+            fichier_image = page.images[nom]
+            with Image.open(io.BytesIO(fichier_image.data)) as originale:
+                reduite = originale.convert("RGB" if image["/ColorSpace"] == "/DeviceRGB" else "L")
+                reduite = reduite.resize((largeur, hauteur), Image.LANCZOS)
+            # Remplace l'objet image du writer (JPEG, /Width et /Height compris)
+            fichier_image.replace(reduite, quality=qualite, optimize=True)
+            modifie = True
+
+    if not modifie:
+        return contenu
+    sortie = io.BytesIO()
+    writer.write(sortie)
+    return sortie.getvalue()
+
+
+# ===================== SORTIE REPRODUCTIBLE =====================
+# Les mêmes données donnent toujours les mêmes octets : dates du document
+# tirées des données (date de la facture...) et identifiant /ID calculé à
+# partir d'elles. Le hash du PDF suffit alors à savoir si l'objet déjà
+# envoyé dans Supabase Storage est à jour (voir file_upload.py).
+
+# Date utilisée quand les données n'en contiennent aucune (celle de ReportLab
+# en mode invariant)
+DATE_PAR_DEFAUT = datetime(2000, 1, 1)
+
+
+def date_document(*valeurs):
+    """Première date ISO valide parmi `valeurs`, sinon DATE_PAR_DEFAUT."""
+    for valeur in valeurs:
+        try:
+            return datetime.fromisoformat(str(valeur))
+        except ValueError:
+            continue
+    return DATE_PAR_DEFAUT
+
+
+def date_pdf(date):
+    # Sans fuseau : la date est celle saisie dans l'application
+    return date.strftime("D:%Y%m%d%H%M%S")
+
+
+def identifiant(*parties):
+    """Identifiant /ID (16 octets) dérivé des données du document."""
+    return hashlib.md5(json.dumps(parties, sort_keys=True, default=str).encode()).digest()
+
+
+def canvas_reproductible(flux, date, **options):
+    """Canvas ReportLab en mode invariant, daté de `date` au lieu de l'heure du rendu.
+
+    En mode invariant, le /ID de ReportLab est l'empreinte du contenu.
+    """
+    c = canvas.Canvas(flux, invariant=1, **options)
+    c.setDateFormatter(lambda *_: date_pdf(date))
+    return c
+
+
+# ===================== RAPPORT =====================
+def _rapport(nom, brut, optimise, duree=None):
+    gain = 100 * (1 - optimise / brut) if brut else 0
+    suffixe = f"  ({duree * 1000:.1f} ms)" if duree is not None else ""
+    print(f"{nom:<34} {brut / 1024:>9.1f} Ko -> {optimise / 1024:>9.1f} Ko  -{gain:4.1f} %{suffixe}")
+
+
+def _mesurer(fonction):
+    debut = time.perf_counter()
+    resultat = fonction()
+    return resultat, time.perf_counter() - debut
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        for chemin in argv:
+            with open(chemin, "rb") as f:
+                contenu = f.read()
+            optimise, duree = _mesurer(lambda: optimiser_octets(contenu))
+            _rapport(os.path.basename(chemin), len(contenu), len(optimise), duree)
+        return 0
+
+    import benchmark
+    import creationdossier
+    import creationfacture
+    from executeur import CHEMIN_ENTETE
+
+    print(f"{'document':<34} {'brut':>12}    {'optimisé':>12}")
+    for n_lignes in (3, 60):
+        data = benchmark.facture(n_lignes, "import")
+        tailles = {}
+        for actif in (False, True):
+            tailles[actif], duree = _mesurer(lambda: creationfacture.ecrire_facture(
+                CHEMIN_ENTETE, data, benchmark.URL_QR, io.BytesIO(), optimiser=actif))
+        _rapport(f"facture {n_lignes} lignes", tailles[False], tailles[True], duree)
+
+    # Le dossier sort déjà compressé de ReportLab : le passage par pypdf n'est
+    # mesuré que pour mémoire, il n'est pas appliqué au rendu
+    for texte_long in (False, True):
+        data = benchmark.dossier(texte_long, "import")
+        brut = creationdossier.create_dossier(data).getvalue()
+        optimise, duree = _mesurer(lambda: optimiser_octets(brut, optimiser=True))
+        _rapport(f"dossier {'long' if texte_long else 'court'} (pypdf)", len(brut), len(optimise), duree)
+
+    with open(CHEMIN_ENTETE, "rb") as f:
+        entete = f.read()
+    for dpi in (300, 200, 150):
+        reduite, duree = _mesurer(lambda: reduire_images(entete, dpi))
+        _rapport(f"entête à {dpi} dpi", len(entete), len(reduite), duree)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
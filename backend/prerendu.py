@@ -0,0 +1,235 @@
+import fcntl
+import hmac
+import os
+import queue
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from cache_pdf import cache_factures, cle_cache
+from donnees import client, facture_data, invalider_facture, lire
+from executeur import CHEMIN_ENTETE, executer, rendre_facture, version_facture
+from metriques import etape
+
+# ===================== PRE-RENDU DES FACTURES =====================
+# Les factures insérées ou modifiées sont rendues à l'avance, dans le cache
+# disque partagé (et envoyées vers Supabase Storage par la file d'upload) :
+# le téléchargement sert ensuite directement le PDF stocké.
+#
+# Deux sources, utilisables ensemble :
+#   - le webhook de base de données Supabase (POST /webhooks/factures), sur
+#     INSERT, UPDATE et DELETE : c'est aussi lui qui invalide le cache des
+#     data_json (donnees.py) quand une facture est modifiée ou supprimée,
+#     y compris quand elle part en cascade avec son dossier ;
+#   - une scrutation périodique des factures modifiées depuis la précédente
+#     (EDEN_PRERENDU_INTERVALLE en secondes, 0 pour la désactiver). Un seul
+#     worker scrute à la fois.
+#
+# La scrutation suit la colonne EDEN_PRERENDU_COLONNE (défaut : updated_at) de
+# la table factures, mise à jour à chaque modification :
+#     alter table factures add column updated_at timestamptz not null default now();
+#     create extension if not exists moddatetime;
+#     create trigger factures_updated_at before update on factures
+#         for each row execute procedure moddatetime (updated_at);
+#     create index factures_updated_at on factures (updated_at, id);
+# Elle lit par pages de EDEN_PRERENDU_FENETRE lignes, triées par (colonne, id),
+# à partir de la plus grande valeur vue moins MARGE_SCRUTATION secondes : une
+# transaction validée après une plus récente n'est pas manquée, et une facture
+# relue alors que son PDF est déjà en cache n'est pas rendue. La première
+# scrutation d'un worker ne lit que les EDEN_PRERENDU_FENETRE dernières
+# factures modifiées.
+#
+# Le contenu du webhook n'est jamais rendu tel quel : seul l'id est utilisé
+# et la facture est relue dans la base. Le webhook exige l'en-tête
+# X-Webhook-Secret égal à EDEN_WEBHOOK_SECRET : sans secret configuré, il
+# refuse tous les appels (la scrutation reste disponible).
+#
+# Un seul thread de pré-rendu par worker : les rendus passent l'un après
+# l'autre dans le pool et n'accaparent pas les processus des requêtes.
+
+SECRET_WEBHOOK = os.environ.get("EDEN_WEBHOOK_SECRET", "")
+INTERVALLE_SCRUTATION = float(os.environ.get("EDEN_PRERENDU_INTERVALLE", "0"))
+FENETRE_SCRUTATION = int(os.environ.get("EDEN_PRERENDU_FENETRE", "200"))
+COLONNE_SCRUTATION = os.environ.get("EDEN_PRERENDU_COLONNE", "updated_at")
+MARGE_SCRUTATION = 60
+TAILLE_FILE = int(os.environ.get("EDEN_PRERENDU_FILE", "1000"))
+VERROU_SCRUTATION = os.environ.get(
+    "EDEN_PRERENDU_VERROU", os.path.join(tempfile.gettempdir(), "eden_prerendu.lock")
+)
+
+
+def secret_valide(valeur):
+    """Vérifie l'en-tête secret du webhook (toujours faux si aucun secret n'est configuré)."""
+    if not SECRET_WEBHOOK:
+        return False
+    return hmac.compare_digest((valeur or "").encode(), SECRET_WEBHOOK.encode())
+
+
+class PreRendu:
+    def __init__(self, taille_file=TAILLE_FILE, intervalle=INTERVALLE_SCRUTATION,
+                 fenetre=FENETRE_SCRUTATION, chemin_verrou=VERROU_SCRUTATION, colonne=COLONNE_SCRUTATION):
+        self.intervalle = intervalle
+        self.fenetre = fenetre
+        self.colonne = colonne
+        # Plus grande valeur de `colonne` vue par la scrutation (datetime)
+        self._curseur = None
+        self.chemin_verrou = chemin_verrou
+        self._file = queue.Queue(maxsize=taille_file)
+        # facture_id -> data_json connu (ou None : à relire) ; une facture
+        # modifiée plusieurs fois avant son rendu n'est rendue qu'une fois
+        self._en_attente = {}
+        self._verrou = threading.Lock()
+        self._verrou_fd = None
+        self._threads = []
+        self._pid = None
+
+    # ---------- côté producteur ----------
+    def planifier(self, facture_id, data=None):
+        with self._verrou:
+            deja_en_file = facture_id in self._en_attente
+            self._en_attente[facture_id] = data
+        if deja_en_file:
+            return True
+        try:
+            self._file.put_nowait(facture_id)
+        except queue.Full:
+            with self._verrou:
+                self._en_attente.pop(facture_id, None)
+            print(f"File de pré-rendu pleine : facture {facture_id} ignorée")
+            return False
+        return True
+
+    def recevoir(self, evenement):
+        """Traite un événement de webhook Supabase {"type", "record", "old_record"}.
+
+        Retourne l'id de la facture concernée, ou None si l'événement est ignoré.
+        """
+        if not isinstance(evenement, dict) or evenement.get("table", "factures") != "factures":
+            return None
+        genre = evenement.get("type")
+        ligne = evenement.get("record") or evenement.get("old_record") or {}
+        facture_id = ligne.get("id")
+        if not isinstance(facture_id, int):
+            return None
+
+        invalider_facture(facture_id)
+        if genre in ("INSERT", "UPDATE"):
+            self.planifier(facture_id)
+        return facture_id
+
+    # ---------- côté consommateur ----------
+    def rendre(self, facture_id, data=None):
+        """Rend la facture dans le cache si elle n'y est pas déjà. Retourne True si rendue."""
+        if data is None:
+            data = facture_data(facture_id)
+        if not data:
+            return False
+
+        cle = cle_cache(data, version_facture())
+        if cache_factures.existe(cle):
+            return False
+        with etape("prerendu"):
+            contenu = executer(rendre_facture, CHEMIN_ENTETE, data)
+        cache_factures.ecrire(cle, contenu, memoire=False)
+        cache_factures.associer(facture_id, cle, data.get("facture", {}).get("numero", facture_id))
+        return True
+
+    def _boucle(self):
+        while True:
+            facture_id = self._file.get()
+            with self._verrou:
+                data = self._en_attente.pop(facture_id, None)
+            try:
+                self.rendre(facture_id, data)
+            except Exception as e:
+                print(f"Erreur pré-rendu facture {facture_id} : {e}")
+
+    # ---------- scrutation ----------
+    def _est_scrutateur(self):
+        # Verrou exclusif gardé tant que le processus vit : un seul worker scrute
+        if self._verrou_fd is not None:
+            return True
+        fd = os.open(self.chemin_verrou, os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._verrou_fd = fd
+        return True
+
+    def _page(self, apres=None, depuis=None):
+        """Une page de factures triées par (colonne, id) : après la ligne
+        `apres`, ou à partir de `depuis` (datetime) ; sans l'un ni l'autre,
+        les dernières modifiées."""
+        colonne = self.colonne
+        requete = client().table("factures").select(f"id, data_json, {colonne}")
+        if apres is None and depuis is None:
+            requete = requete.order(colonne, desc=True).order("id", desc=True)
+        else:
+            if apres is not None:
+                valeur = apres[colonne]
+                requete = requete.or_(f'{colonne}.gt."{valeur}",and({colonne}.eq."{valeur}",id.gt.{apres["id"]})')
+            else:
+                requete = requete.gte(colonne, depuis.isoformat())
+            requete = requete.order(colonne).order("id")
+        return lire(requete.limit(self.fenetre)).data or []
+
+    def _modifiees(self):
+        """Factures modifiées depuis la dernière scrutation (marge comprise)."""
+        if self._curseur is None:
+            lignes = self._page()
+        else:
+            page = self._page(depuis=self._curseur - timedelta(seconds=MARGE_SCRUTATION))
+            lignes = list(page)
+            while len(page) == self.fenetre:
+                page = self._page(apres=page[-1])
+                lignes += page
+        for ligne in lignes:
+            valeur = ligne.get(self.colonne)
+            if valeur:
+                modifiee = datetime.fromisoformat(valeur)
+                if self._curseur is None or modifiee > self._curseur:
+                    self._curseur = modifiee
+        return lignes
+
+    def scruter(self):
+        """Planifie les factures modifiées dont le PDF n'est pas encore en cache."""
+        with etape("prerendu_scrutation"):
+            lignes = self._modifiees()
+        version = version_facture()
+        planifiees = 0
+        for ligne in lignes:
+            data = ligne.get("data_json")
+            if data and not cache_factures.existe(cle_cache(data, version)):
+                planifiees += self.planifier(ligne["id"], data)
+        return planifiees
+
+    def _boucle_scrutation(self):
+        while True:
+            time.sleep(self.intervalle)
+            try:
+                if self._est_scrutateur():
+                    self.scruter()
+            except Exception as e:
+                print(f"Erreur scrutation pré-rendu : {e}")
+
+    def demarrer(self):
+        """Démarre les threads de pré-rendu (une fois par processus)."""
+        if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+            return
+        self._pid = os.getpid()
+        # Le verrou hérité d'un parent (fork) n'appartient pas à ce processus
+        self._verrou_fd = None
+        self._curseur = None
+        self._threads = [threading.Thread(target=self._boucle, name="prerendu", daemon=True)]
+        if self.intervalle > 0:
+            self._threads.append(
+                threading.Thread(target=self._boucle_scrutation, name="prerendu-scrutation", daemon=True)
+            )
+        for thread in self._threads:
+            thread.start()
+
+
+prerendu = PreRendu()
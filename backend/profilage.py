@@ -0,0 +1,156 @@
+import cProfile
+import hmac
+import io
+import json
+import marshal
+import os
+import pstats
+import re
+import tempfile
+import threading
+import time
+
+from executeur import executer, executer_async
+
+# ===================== PROFILAGE A LA DEMANDE =====================
+# Avec EDEN_PROFILAGE=1, une requête /generate-pdf ou /facture/<id> qui porte
+# l'en-tête X-Profilage voit son rendu profilé avec cProfile, dans le
+# processus du pool qui l'exécute (ReportLab, pypdf, gabarits...). Les
+# statistiques sont écrites au format pstats dans EDEN_PROFILAGE_DIR, et le
+# nom du profil est renvoyé dans l'en-tête X-Profil. Une facture profilée
+# est toujours rendue, même si son PDF est en cache.
+#
+#   GET /profils                    : liste des profils, du plus récent au plus ancien
+#   GET /profils/<nom>              : fichier .pstats (python -m pstats, snakeviz...)
+#   GET /profils/<nom>?format=texte : résumé trié par temps cumulé
+#
+# Une requête sans l'en-tête ne paie que sa lecture.
+#
+# EDEN_PROFILAGE        : 1 pour accepter les demandes de profilage
+# EDEN_PROFILAGE_SECRET : si défini, valeur attendue de l'en-tête X-Profilage
+#                         (exigée aussi pour lister et télécharger)
+# EDEN_PROFILAGE_DIR    : répertoire des profils
+# EDEN_PROFILAGE_MAX    : profils gardés, les plus anciens sont supprimés (défaut : 100)
+
+ACTIF = os.environ.get("EDEN_PROFILAGE", "0") == "1"
+SECRET = os.environ.get("EDEN_PROFILAGE_SECRET", "")
+DOSSIER = os.environ.get("EDEN_PROFILAGE_DIR", os.path.join(tempfile.gettempdir(), "eden_profils"))
+MAX_PROFILS = int(os.environ.get("EDEN_PROFILAGE_MAX", "100"))
+
+ENTETE = "X-Profilage"
+_NOM_PROFIL = re.compile(r"^[\w.-]+\.pstats$")
+
+# Un seul profileur actif par processus (rendu sans pool, dans les threads)
+_verrou_profileur = threading.Lock()
+_verrou_ecriture = threading.Lock()
+
+
+def demande(valeur):
+    """True si la requête demande un profilage (valeur de l'en-tête X-Profilage)."""
+    return valeur is not None and autorise(valeur)
+
+
+def autorise(valeur):
+    """True si le profilage est actif et `valeur` correspond au secret éventuel."""
+    if not ACTIF:
+        return False
+    if not SECRET:
+        return True
+    return hmac.compare_digest((valeur or "").encode(), SECRET.encode())
+
+
+# ---------- rendu profilé ----------
+def profiler(fonction, *args):
+    """Exécuté dans un processus du pool : ((contenu, statistiques), mesures)."""
+    with _verrou_profileur:
+        profil = cProfile.Profile()
+        contenu, mesures = profil.runcall(fonction, *args)
+    profil.create_stats()
+    # Même format que pstats.Stats.dump_stats
+    return (contenu, marshal.dumps(profil.stats)), mesures
+
+
+def executer_profile(route, cible, fonction, *args):
+    """Comme executeur.executer, en profilant le rendu. Retourne (contenu, nom du profil)."""
+    debut = time.perf_counter()
+    contenu, statistiques = executer(profiler, fonction, *args)
+    return contenu, enregistrer(route, cible, statistiques, time.perf_counter() - debut)
+
+
+async def executer_profile_async(route, cible, fonction, *args):
+    debut = time.perf_counter()
+    contenu, statistiques = await executer_async(profiler, fonction, *args)
+    return contenu, enregistrer(route, cible, statistiques, time.perf_counter() - debut)
+
+
+# ---------- stockage ----------
+def _chemin(nom):
+    return os.path.join(DOSSIER, nom)
+
+
+def enregistrer(route, cible, statistiques, duree):
+    """Écrit le profil et sa description ; retourne le nom du profil (ou None)."""
+    horodatage = time.strftime("%Y%m%d-%H%M%S")
+    cible = re.sub(r"[^\w-]", "_", str(cible))[:40]
+    nom = f"{horodatage}_{route}_{cible}_{os.getpid()}_{time.monotonic_ns() % 10**6:06d}.pstats"
+    description = {
+        "nom": nom, "route": route, "cible": cible, "duree_s": round(duree, 4),
+        "cree_le": time.strftime("%Y-%m-%dT%H:%M:%S"), "pid": os.getpid(),
+    }
+    try:
+        os.makedirs(DOSSIER, exist_ok=True)
+        with open(_chemin(nom), "wb") as f:
+            f.write(statistiques)
+        with open(_chemin(nom[:-len(".pstats")] + ".json"), "w") as f:
+            json.dump(description, f)
+    except OSError as e:
+        print(f"Profil non enregistré ({DOSSIER}) : {e}")
+        return None
+    _elaguer()
+    return nom
+
+
+def _elaguer():
+    """Supprime les profils les plus anciens au-delà de MAX_PROFILS."""
+    with _verrou_ecriture:
+        noms = sorted(n for n in os.listdir(DOSSIER) if n.endswith(".pstats"))
+        for nom in noms[:max(len(noms) - MAX_PROFILS, 0)]:
+            for chemin in (_chemin(nom), _chemin(nom[:-len(".pstats")] + ".json")):
+                try:
+                    os.remove(chemin)
+                except OSError:
+                    pass
+
+
+def index():
+    """Descriptions des profils enregistrés, du plus récent au plus ancien."""
+    try:
+        noms = sorted((n for n in os.listdir(DOSSIER) if n.endswith(".pstats")), reverse=True)
+    except OSError:
+        return []
+    profils = []
+    for nom in noms:
+        try:
+            with open(_chemin(nom[:-len(".pstats")] + ".json")) as f:
+                description = json.load(f)
+            description["octets"] = os.path.getsize(_chemin(nom))
+        except (OSError, ValueError):
+            continue
+        profils.append(description)
+    return profils
+
+
+def chemin_profil(nom):
+    """Chemin du fichier .pstats `nom`, ou None s'il n'existe pas (ou nom invalide)."""
+    if not _NOM_PROFIL.match(nom or ""):
+        return None
+    chemin = _chemin(nom)
+    return chemin if os.path.isfile(chemin) else None
+
+
+def texte(chemin, limite=40):
+    """Résumé pstats : les `limite` fonctions les plus coûteuses en temps cumulé."""
+    sortie = io.StringIO()
+    stats = pstats.Stats(chemin, stream=sortie)
+    stats.strip_dirs().sort_stats("cumulative").print_stats(limite)
+    return sortie.getvalue()
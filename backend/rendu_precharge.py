@@ -0,0 +1,18 @@
+import gc
+
+# ===================== PRÉCHARGEMENT DU SERVEUR DE PROCESSUS =====================
+# Importé une seule fois par le serveur « forkserver » de multiprocessing
+# (voir executeur.py) : les ressources de rendu sont chargées avant que les
+# processus du pool soient forkés depuis lui, et partagées avec eux en copie
+# sur écriture. gc.freeze() évite que le ramasse-miettes des enfants ne
+# réécrive ces pages.
+
+try:
+    from executeur import initialiser_processus
+
+    initialiser_processus()
+except Exception as e:
+    # Le serveur ne doit pas mourir : chaque processus refera le chargement
+    # dans son initialisation
+    print(f"Préchargement du serveur de rendu impossible : {e}")
+gc.freeze()
@@ -0,0 +1,243 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metriques
+
+# ===================== APPELS SUPABASE BORNES =====================
+# Tous les appels à Supabase (PostgREST et Storage) passent par ici :
+#   - délai maximum par appel : l'appel part dans un thread annexe et la
+#     requête n'attend pas au-delà, même si le serveur répond au compte-gouttes
+#     (le timeout httpx ne borne que chaque lecture, pas l'appel entier) ;
+#   - disjoncteur : après EDEN_DISJONCTEUR_SEUIL échecs consécutifs, les appels
+#     échouent tout de suite pendant EDEN_DISJONCTEUR_PAUSE secondes, puis un
+#     seul appel d'essai décide de la reprise. Les routes servent alors les PDF
+#     déjà en cache (voir cache_pdf.py) ou répondent 503 avec Retry-After ;
+#   - lecture de secours : une lecture idempotente en échec est relancée une
+#     fois, tout de suite ; avec EDEN_SUPABASE_COUVERTURE, une lecture lente
+#     l'est aussi après ce délai et la première réponse est gardée.
+# Les disjoncteurs sont propres à chaque worker.
+#
+# EDEN_SUPABASE_DELAI_DB      : délai d'une requête PostgREST (défaut : 3 s)
+# EDEN_SUPABASE_DELAI_STORAGE : délai d'un appel Storage (défaut : 15 s)
+# EDEN_SUPABASE_COUVERTURE    : délai avant la lecture de secours (0 : désactivé)
+# EDEN_DISJONCTEUR_SEUIL      : échecs consécutifs avant ouverture (défaut : 5)
+# EDEN_DISJONCTEUR_PAUSE      : secondes d'ouverture avant un essai (défaut : 30)
+
+DELAI_DB = float(os.environ.get("EDEN_SUPABASE_DELAI_DB", "3"))
+DELAI_STORAGE = float(os.environ.get("EDEN_SUPABASE_DELAI_STORAGE", "15"))
+COUVERTURE = float(os.environ.get("EDEN_SUPABASE_COUVERTURE", "0"))
+SEUIL = int(os.environ.get("EDEN_DISJONCTEUR_SEUIL", "5"))
+PAUSE = float(os.environ.get("EDEN_DISJONCTEUR_PAUSE", "30"))
+THREADS_APPELS = int(os.environ.get("EDEN_SUPABASE_THREADS", "32"))
+
+FERME, OUVERT, ESSAI = 0, 1, 2
+
+ECHECS = metriques.enregistrer(metriques.Compteur(
+    "eden_supabase_echecs_total", "Appels Supabase en échec, par service et cause.", ("service", "cause")
+))
+COUVERTURES = metriques.enregistrer(metriques.Compteur(
+    "eden_supabase_secours_total", "Lectures de secours lancées, par service.", ("service",)
+))
+
+_executeur = None
+_executeur_pid = None
+_verrou_executeur = threading.Lock()
+
+
+class Indisponible(Exception):
+    """Supabase n'a pas répondu à temps, a échoué, ou le disjoncteur est ouvert.
+
+    Mêmes attributs que `admission.Refus`, pour la même réponse HTTP.
+    `abandonnes` : futurs des appels synchrones hors délai, qui tournent
+    encore (leur fin n'est plus attendue par personne).
+    """
+
+    def __init__(self, message, retry_after=1, abandonnes=()):
+        super().__init__(message)
+        self.statut = 503
+        self.message = message
+        self.retry_after = retry_after
+        self.abandonnes = tuple(abandonnes)
+
+
+# Erreurs PostgREST sans statut HTTP : leur code dit s'il s'agit d'une panne
+# (PGRST0xx : base injoignable, PGRSTX00 : erreur interne) ou d'une requête
+# refusée (PGRST1xx à 3xx). Les codes SQLSTATE de PostgreSQL sont classés par
+# leurs deux premiers caractères : connexion (08), ressources (53), arrêt ou
+# délai d'instruction (57), système (58) et erreur interne (XX).
+_PREFIXES_PANNE_PGRST = ("PGRST0", "PGRSTX")
+_CLASSES_PANNE_SQL = ("08", "53", "57", "58", "XX")
+
+
+def _code_en_panne(code):
+    if code.upper().startswith("PGRST"):
+        return code.upper().startswith(_PREFIXES_PANNE_PGRST)
+    return code[:2].upper() in _CLASSES_PANNE_SQL
+
+
+def _est_panne(erreur):
+    """Une réponse 4xx (objet absent, requête refusée) prouve que le service
+    répond : elle est renvoyée telle quelle et ne compte pas pour le disjoncteur."""
+    statut = getattr(erreur, "status", None) or getattr(erreur, "status_code", None)
+    code = getattr(erreur, "code", None)
+    if not statut and isinstance(code, str) and code:
+        # postgrest.APIError : code PostgREST ou SQLSTATE (chaîne) ; le statut
+        # HTTP n'y figure, en entier, que si la réponse n'était pas du JSON
+        return _code_en_panne(code)
+    try:
+        return not 400 <= int(statut or code) < 500
+    except (TypeError, ValueError):
+        return True
+
+
+def _executeur_appels():
+    """Threads des appels synchrones (recréés après un fork)."""
+    global _executeur, _executeur_pid
+    with _verrou_executeur:
+        if _executeur is None or _executeur_pid != os.getpid():
+            _executeur = ThreadPoolExecutor(max_workers=THREADS_APPELS, thread_name_prefix="supabase")
+            _executeur_pid = os.getpid()
+    return _executeur
+
+
+class Disjoncteur:
+    def __init__(self, seuil=SEUIL, pause=PAUSE):
+        self.seuil = max(seuil, 1)
+        self.pause = pause
+        self.etat = FERME
+        self._echecs = 0
+        self._ouvert_le = 0.0
+        self._verrou = threading.Lock()
+
+    def autoriser(self):
+        """True si l'appel peut partir : un seul appel d'essai par pause
+        (un essai abandonné n'empêche pas le suivant)."""
+        with self._verrou:
+            if self.etat == FERME:
+                return True
+            if time.monotonic() - self._ouvert_le >= self.pause:
+                self.etat = ESSAI
+                self._ouvert_le = time.monotonic()
+                return True
+            return False
+
+    def succes(self):
+        with self._verrou:
+            self.etat = FERME
+            self._echecs = 0
+
+    def echec(self):
+        with self._verrou:
+            self._echecs += 1
+            if self.etat == ESSAI or self._echecs >= self.seuil:
+                self.etat = OUVERT
+                self._ouvert_le = time.monotonic()
+
+    def retry_after(self):
+        with self._verrou:
+            if self.etat == FERME:
+                return 1
+            return max(1, math.ceil(self.pause - (time.monotonic() - self._ouvert_le)))
+
+
+class Service:
+    def __init__(self, nom, delai, couverture=COUVERTURE, disjoncteur=None):
+        self.nom = nom
+        self.delai = delai
+        self.couverture = couverture
+        self.disjoncteur = disjoncteur or Disjoncteur()
+
+    def _autoriser(self):
+        if not self.disjoncteur.autoriser():
+            ECHECS.incrementer(self.nom, "ouvert")
+            raise Indisponible(f"Supabase {self.nom} indisponible", self.disjoncteur.retry_after())
+
+    def _echouer(self, cause, erreur=None, abandonnes=()):
+        ECHECS.incrementer(self.nom, cause)
+        self.disjoncteur.echec()
+        if cause == "delai":
+            message = f"Supabase {self.nom} : pas de réponse après {self.delai:g} s"
+        else:
+            message = f"Supabase {self.nom} : {erreur}"
+        return Indisponible(message, self.disjoncteur.retry_after(), abandonnes)
+
+    # ---------- appels synchrones ----------
+    def appeler(self, fonction, *args, idempotent=False):
+        """Résultat de `fonction(*args)` avant le délai, ou lève `Indisponible`."""
+        self._autoriser()
+        echeance = time.monotonic() + self.delai
+        executeur = _executeur_appels()
+        en_cours = {executeur.submit(fonction, *args)}
+        relance = idempotent
+        erreur = None
+
+        while en_cours:
+            reste = echeance - time.monotonic()
+            if reste <= 0:
+                break
+            attente = min(reste, self.couverture) if relance and self.couverture > 0 else reste
+            faits, en_cours = wait(en_cours, attente, FIRST_COMPLETED)
+            for futur in faits:
+                erreur = futur.exception()
+                if erreur is None or not _est_panne(erreur):
+                    self.disjoncteur.succes()
+                    return futur.result()
+            if relance and (faits or attente < reste):
+                # Lecture en échec ou lente : une seconde tentative, une seule fois
+                COUVERTURES.incrementer(self.nom)
+                en_cours.add(executeur.submit(fonction, *args))
+                relance = False
+
+        if en_cours:
+            # Les threads ne s'interrompent pas : l'appel se termine seul
+            # (délais du client HTTP), l'appelant peut attendre `abandonnes`
+            raise self._echouer("delai", abandonnes=en_cours)
+        raise self._echouer("erreur", erreur) from erreur
+
+    # ---------- appels asynchrones ----------
+    async def appeler_async(self, fabrique, idempotent=False):
+        """Comme `appeler`, pour `fabrique()` qui retourne une coroutine
+        (rappelée pour la lecture de secours)."""
+        self._autoriser()
+        echeance = time.monotonic() + self.delai
+        en_cours = {asyncio.ensure_future(fabrique())}
+        relance = idempotent
+        erreur = None
+
+        try:
+            while en_cours:
+                reste = echeance - time.monotonic()
+                if reste <= 0:
+                    break
+                attente = min(reste, self.couverture) if relance and self.couverture > 0 else reste
+                faits, en_cours = await asyncio.wait(en_cours, timeout=attente, return_when=asyncio.FIRST_COMPLETED)
+                for tache in faits:
+                    erreur = tache.exception()
+                    if erreur is None or not _est_panne(erreur):
+                        self.disjoncteur.succes()
+                        return tache.result()
+                if relance and (faits or attente < reste):
+                    COUVERTURES.incrementer(self.nom)
+                    en_cours.add(asyncio.ensure_future(fabrique()))
+                    relance = False
+        finally:
+            # Les appels perdants ou hors délai sont abandonnés
+            for tache in en_cours:
+                tache.cancel()
+
+        if en_cours:
+            raise self._echouer("delai")
+        raise self._echouer("erreur", erreur) from erreur
+
+
+db = Service("db", DELAI_DB)
+storage = Service("storage", DELAI_STORAGE)
+
+metriques.enregistrer(metriques.Jauge(
+    "eden_supabase_disjoncteur", "État du disjoncteur (0 fermé, 1 ouvert, 2 essai), par service.", "service",
+    lambda: {s.nom: s.disjoncteur.etat for s in (db, storage)},
+))
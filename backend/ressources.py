@@ -0,0 +1,39 @@
+import os
+import threading
+from reportlab.lib.utils import ImageReader
+
+# ===================== RESSOURCES IMAGES =====================
+# Les images (logo, ...) sont résolues par rapport au dossier du backend, et
+# non au répertoire courant, puis décodées une seule fois par processus.
+# ReportLab reçoit directement l'ImageReader déjà décodé.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_images = {}
+_verrou = threading.Lock()
+
+
+def chemin_ressource(nom):
+    return nom if os.path.isabs(nom) else os.path.join(BASE_DIR, nom)
+
+
+def image(nom):
+    """ImageReader partagé pour `nom`, ou None si le fichier est absent."""
+    try:
+        return _images[nom]
+    except KeyError:
+        pass
+
+    with _verrou:
+        if nom not in _images:
+            chemin = chemin_ressource(nom)
+            if os.path.exists(chemin):
+                reader = ImageReader(chemin)
+                # Force le décodage maintenant : les rendus suivants réutilisent
+                # les pixels (et le canal alpha) déjà en mémoire
+                reader.getRGBData()
+                _images[nom] = reader
+            else:
+                print(f"Attention : image non trouvée à {chemin}")
+                _images[nom] = None
+        return _images[nom]
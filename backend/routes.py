@@ -0,0 +1,207 @@
+import json
+from urllib.parse import quote
+
+import profilage
+from admission import Refus, admission, admission_async
+from cache_pdf import cache_factures, cle_cache
+from donnees import facture_data, facture_data_async
+from executeur import (
+    CHEMIN_ENTETE, DelaiDepasse, executer as executer_rendu, executer_async as executer_rendu_async,
+    rendre_dossier, rendre_facture, version_facture,
+)
+from metriques import etape
+from resilience import Indisponible
+
+# ===================== ROUTES COMMUNES FLASK / ASGI =====================
+# /generate-pdf et /facture/<id> sont servies par app.py (Flask, un thread par
+# requête) et par asgi.py (boucle asyncio). Leur logique n'est écrite qu'ici :
+# chaque route est un générateur qui cède ses opérations bloquantes sous la
+# forme (OPERATION, *arguments) et retourne une `Reponse`. `executer` fait
+# ces opérations directement, `executer_async` avec leurs versions
+# asynchrones (client Supabase asynchrone, attente du pool sans bloquer la
+# boucle). app.py et asgi.py ne font que convertir la `Reponse`.
+
+ORIGINES_AUTORISEES = ("https://eden-tir.vercel.app",)
+
+LIRE_FACTURE = "lire_facture"
+ADMETTRE = "admettre"
+RENDRE = "rendre"
+
+
+class Reponse:
+    def __init__(self, statut, corps=b"", type_contenu=None, entetes=None):
+        self.statut = statut
+        self.corps = corps
+        self.entetes = list(entetes or [])
+        if type_contenu:
+            self.entetes.append(("Content-Type", type_contenu))
+
+
+def reponse_json(statut, objet):
+    return Reponse(statut, json.dumps(objet).encode(), "application/json")
+
+
+def reponse_pdf(contenu, nom_fichier, etag=None):
+    try:
+        nom_fichier.encode("ascii")
+        disposition = f'attachment; filename="{nom_fichier}"'
+    except UnicodeEncodeError:
+        disposition = f"attachment; filename*=UTF-8''{quote(nom_fichier)}"
+    reponse = Reponse(200, contenu, "application/pdf", [("Content-Disposition", disposition)])
+    if etag:
+        # Le navigateur doit revalider à chaque fois : la facture peut être modifiée
+        reponse.entetes += [("ETag", f'"{etag}"'), ("Cache-Control", "private, no-cache")]
+    return reponse
+
+
+def reponse_non_modifiee(etag):
+    return Reponse(304, entetes=[("ETag", f'"{etag}"'), ("Cache-Control", "private, no-cache")])
+
+
+def reponse_refus(refus):
+    """Réponse rapide d'une requête refusée (contrôle d'admission, Supabase indisponible)."""
+    reponse = reponse_json(refus.statut, {"error": refus.message})
+    reponse.entetes.append(("Retry-After", str(refus.retry_after)))
+    return reponse
+
+
+def reponse_perimee(facture_id, erreur, entetes):
+    """Supabase indisponible : dernier PDF connu de la facture, sinon 503."""
+    dernier = cache_factures.dernier(facture_id)
+    if dernier is None:
+        return reponse_refus(erreur)
+    cle, numero, contenu = dernier
+    if cle in etags(entetes.get("If-None-Match", "")):
+        reponse = reponse_non_modifiee(cle)
+    else:
+        reponse = reponse_pdf(contenu, f"Facture_{numero}.pdf", etag=cle)
+    reponse.entetes.append(("Warning", '110 - "Response is Stale"'))
+    return reponse
+
+
+def etags(valeur):
+    """Valeurs d'un en-tête If-None-Match, sans guillemets ni préfixe W/."""
+    return {e.strip().removeprefix("W/").strip('"') for e in (valeur or "").split(",") if e.strip()}
+
+
+def _profil(reponse, nom):
+    if nom:
+        reponse.entetes.append(("X-Profil", nom))
+    return reponse
+
+
+# ---------- routes ----------
+def dossier(corps, entetes):
+    """POST /generate-pdf : `corps` est le JSON brut de la requête."""
+    try:
+        data = json.loads(corps or b"null")
+    except ValueError:
+        return reponse_json(400, {"error": "JSON invalide"})
+    if not data:
+        return reponse_json(400, {"error": "No data provided"})
+
+    profiler = profilage.demande(entetes.get(profilage.ENTETE))
+    try:
+        ticket = yield ADMETTRE, "dossier"
+        with ticket:
+            contenu, profil = yield RENDRE, "dossier", data.get("dossier_no"), profiler, rendre_dossier, data
+    except Refus as e:
+        return reponse_refus(e)
+    except DelaiDepasse:
+        return reponse_json(504, {"error": "Délai de génération dépassé"})
+    except Exception as e:
+        print(f"Erreur: {e}")
+        return reponse_json(500, {"error": str(e)})
+    return _profil(reponse_pdf(contenu, f"Dossier_{data.get('dossier_no', 'export')}.pdf"), profil)
+
+
+def facture(facture_id, entetes):
+    """GET /facture/<id> : PDF en cache ou rendu, 304 si le client l'a déjà."""
+    try:
+        data = yield LIRE_FACTURE, facture_id
+    except Indisponible as e:
+        return reponse_perimee(facture_id, e, entetes)
+    if not data:
+        return reponse_json(404, {"error": "Facture introuvable"})
+
+    numero = data["facture"]["numero"]
+    cle = cle_cache(data, version_facture())
+    # Une facture profilée est toujours rendue
+    profiler = profilage.demande(entetes.get(profilage.ENTETE))
+    profil = None
+
+    if cle in etags(entetes.get("If-None-Match", "")) and not profiler:
+        return reponse_non_modifiee(cle)
+
+    with etape("cache_lecture"):
+        contenu = None if profiler else cache_factures.lire(cle)
+    if contenu is None:
+        try:
+            ticket = yield ADMETTRE, "facture"
+            with ticket:
+                contenu, profil = yield RENDRE, "facture", facture_id, profiler, rendre_facture, CHEMIN_ENTETE, data
+        except Refus as e:
+            return reponse_refus(e)
+        except DelaiDepasse:
+            return reponse_json(504, {"error": "Délai de génération dépassé"})
+        except Exception as e:
+            print(f"Erreur génération : {e}")
+            return reponse_json(500, {"error": "Erreur lors de la génération de la facture"})
+        with etape("cache_ecriture"):
+            cache_factures.ecrire(cle, contenu)
+    cache_factures.associer(facture_id, cle, numero)
+
+    return _profil(reponse_pdf(contenu, f"Facture_{numero}.pdf", etag=cle), profil)
+
+
+# ---------- exécution ----------
+def _rendre(nature, cible, profiler, fonction, *args):
+    if profiler:
+        return profilage.executer_profile(nature, cible, fonction, *args)
+    return executer_rendu(fonction, *args), None
+
+
+async def _rendre_async(nature, cible, profiler, fonction, *args):
+    if profiler:
+        return await profilage.executer_profile_async(nature, cible, fonction, *args)
+    return await executer_rendu_async(fonction, *args), None
+
+
+_OPERATIONS = {LIRE_FACTURE: facture_data, ADMETTRE: admission, RENDRE: _rendre}
+_OPERATIONS_ASYNC = {LIRE_FACTURE: facture_data_async, ADMETTRE: admission_async, RENDRE: _rendre_async}
+
+
+def executer(route):
+    """Exécute une route dans le thread courant et retourne sa `Reponse`."""
+    resultat, erreur = None, None
+    try:
+        while True:
+            try:
+                operation, *args = route.throw(erreur) if erreur else route.send(resultat)
+            except StopIteration as fin:
+                return fin.value
+            try:
+                resultat, erreur = _OPERATIONS[operation](*args), None
+            except BaseException as e:
+                resultat, erreur = None, e
+    finally:
+        route.close()
+
+
+async def executer_async(route):
+    """Comme `executer`, sans bloquer la boucle asyncio."""
+    resultat, erreur = None, None
+    try:
+        while True:
+            try:
+                operation, *args = route.throw(erreur) if erreur else route.send(resultat)
+            except StopIteration as fin:
+                return fin.value
+            try:
+                resultat, erreur = await _OPERATIONS_ASYNC[operation](*args), None
+            except BaseException as e:
+                # Y compris l'annulation (client parti) : le ticket
+                # d'admission est rendu par le `with` de la route
+                resultat, erreur = None, e
+    finally:
+        route.close()
@@ -0,0 +1,27 @@
+import pytest
+
+import donnees
+import resilience
+from tests.doublure import DoublureSupabase
+
+# Lancer depuis backend/ : python -m pytest -q
+
+
+@pytest.fixture
+def doublure():
+    """Doublure locale de Supabase (sans facture), arrêtée après le test."""
+    doublure = DoublureSupabase({})
+    doublure.url = doublure.demarrer()
+    yield doublure
+    doublure.arreter()
+
+
+@pytest.fixture
+def supabase(doublure, monkeypatch):
+    """Clients de donnees.py dirigés vers la doublure, disjoncteurs neufs."""
+    monkeypatch.setattr(donnees, "SUPABASE_URL", doublure.url)
+    monkeypatch.setattr(donnees, "SUPABASE_KEY", "cle-service-doublure")
+    monkeypatch.setattr(donnees, "_clients_pid", None)
+    monkeypatch.setattr(resilience, "db", resilience.Service("db", 2))
+    monkeypatch.setattr(resilience, "storage", resilience.Service("storage", 2))
+    return doublure
@@ -0,0 +1,136 @@
+"""Doublure locale de Supabase, partagée par les tests et par charge.py."""
+import collections
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+
+# ===================== DOUBLURE SUPABASE =====================
+# Un seul serveur HTTP local sert /rest/v1/factures (lectures PostgREST) et
+# /storage/v1/object/... (uploads et infos d'objets). Chaque côté a sa
+# latence (moyenne, tirée entre 0,5x et 1,5x) et son taux de pannes (503).
+
+class _Serveur(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Connexions coupées par les workers à l'arrêt du serveur testé
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class Injection:
+    def __init__(self, latence=0.0, echecs=0.0, rng=None):
+        self.latence = latence
+        self.echecs = echecs
+        self.rng = rng or random.Random()
+
+    def appliquer(self):
+        """Attend la latence simulée. Retourne True si la requête doit échouer."""
+        if self.latence > 0:
+            time.sleep(self.latence * self.rng.uniform(0.5, 1.5))
+        return self.rng.random() < self.echecs
+
+
+class DoublureSupabase:
+    def __init__(self, factures, db=None, storage=None):
+        self.factures = factures
+        self.db = db or Injection()
+        self.storage = storage or Injection()
+        self.objets = {}
+        self.stats = collections.Counter()
+        self._verrou = threading.Lock()
+        self._serveur = None
+
+    def _compter(self, cle):
+        with self._verrou:
+            self.stats[cle] += 1
+
+    def _lignes(self, requete):
+        filtre = requete.get("id", [""])[0]
+        if filtre.startswith("eq."):
+            ids = [int(filtre[3:])]
+        elif filtre.startswith("in.("):
+            ids = [int(i) for i in filtre[4:-1].split(",") if i]
+        else:
+            limite = int(requete.get("limit", ["1000"])[0])
+            decalage = int(requete.get("offset", ["0"])[0])
+            ids = sorted(self.factures, reverse=True)[decalage:decalage + limite]
+        return [{"id": i, "data_json": self.factures[i]} for i in ids if i in self.factures]
+
+    def demarrer(self, port=0):
+        doublure = self
+
+        class Gestionnaire(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _repondre(self, statut, objet):
+                corps = json.dumps(objet).encode()
+                self.send_response(statut)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(corps)))
+                self.end_headers()
+                self.wfile.write(corps)
+
+            def _panne(self, cote):
+                doublure._compter(f"{cote}_pannes")
+                self._repondre(503, {"statusCode": "503", "error": "panne simulée", "message": "panne simulée"})
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.startswith("/rest/v1/factures"):
+                    doublure._compter("db_lectures")
+                    if doublure.db.appliquer():
+                        return self._panne("db")
+                    lignes = doublure._lignes(parse_qs(url.query))
+                    if "vnd.pgrst.object" in self.headers.get("Accept", ""):
+                        if not lignes:
+                            return self._repondre(406, {"code": "PGRST116", "message": "0 rows",
+                                                        "details": None, "hint": None})
+                        return self._repondre(200, lignes[0])
+                    return self._repondre(200, lignes)
+
+                if url.path.startswith("/storage/v1/object/info/"):
+                    doublure._compter("storage_infos")
+                    if doublure.storage.appliquer():
+                        return self._panne("storage")
+                    cle = unquote(url.path[len("/storage/v1/object/info/"):])
+                    if cle not in doublure.objets:
+                        return self._repondre(400, {"statusCode": "404", "error": "not_found",
+                                                    "message": "Object not found"})
+                    return self._repondre(200, {"name": cle, "metadata": doublure.objets[cle]})
+                self._repondre(404, {"message": "route inconnue"})
+
+            def do_POST(self):
+                corps = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                url = urlparse(self.path)
+                if not url.path.startswith("/storage/v1/object/"):
+                    return self._repondre(404, {"message": "route inconnue"})
+                doublure._compter("storage_uploads")
+                if doublure.storage.appliquer():
+                    return self._panne("storage")
+                cle = unquote(url.path[len("/storage/v1/object/"):])
+                metadonnees = re.search(rb'name="metadata"\r\n\r\n(.*?)\r\n--', corps, re.S)
+                with doublure._verrou:
+                    doublure.objets[cle] = json.loads(metadonnees.group(1)) if metadonnees else {}
+                    doublure.stats["storage_octets"] += len(corps)
+                self._repondre(200, {"Key": cle})
+
+            do_PUT = do_POST
+
+        self._serveur = _Serveur(("127.0.0.1", port), Gestionnaire)
+        threading.Thread(target=self._serveur.serve_forever, name="doublure", daemon=True).start()
+        return f"http://127.0.0.1:{self._serveur.server_address[1]}/"
+
+    def arreter(self):
+        if self._serveur is not None:
+            self._serveur.shutdown()
+            self._serveur.server_close()
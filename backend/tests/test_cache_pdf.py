@@ -0,0 +1,115 @@
+import os
+import time
+
+import cache_pdf
+from cache_pdf import CachePdf, cle_cache
+
+
+def cle(i):
+    return cle_cache({"facture": i}, "v1")
+
+
+def cache_disque(tmp_path, **options):
+    """Cache sans LRU mémoire ni élagage en arrière-plan (lancé à la main)."""
+    cache = CachePdf(str(tmp_path), taille_max=0, **options)
+    cache._dernier_elagage = time.monotonic()
+    return cache
+
+
+def vieillir(cache, cle, jours):
+    chemin = cache._chemin(cle)
+    date = time.time() - jours * 86400
+    os.utime(chemin, (date, date))
+
+
+def pdf_sur_disque(cache):
+    return sorted(nom for _, _, noms in os.walk(cache.dossier) for nom in noms if nom.endswith(".pdf"))
+
+
+def test_cle_depend_des_donnees_et_de_la_version():
+    assert cle_cache({"a": 1, "b": 2}, "v1") == cle_cache({"b": 2, "a": 1}, "v1")
+    assert cle_cache({"a": 1}, "v1") != cle_cache({"a": 2}, "v1")
+    assert cle_cache({"a": 1}, "v1") != cle_cache({"a": 1}, "v2")
+
+
+def test_lecture_disque_partagee(tmp_path):
+    a = CachePdf(str(tmp_path), taille_max=0)
+    b = CachePdf(str(tmp_path), taille_max=0)
+    a.ecrire(cle(1), b"%PDF-1")
+    assert b.lire(cle(1)) == b"%PDF-1"
+    assert b.existe(cle(1))
+    assert b.lire(cle(2)) is None
+
+
+def test_elagage_par_age(tmp_path):
+    cache = cache_disque(tmp_path, disque_jours=30)
+    for i in range(3):
+        cache.ecrire(cle(i), b"%PDF")
+    vieillir(cache, cle(0), 31)
+
+    assert cache.elaguer() == 1
+    assert not cache.existe(cle(0))
+    assert cache.existe(cle(1)) and cache.existe(cle(2))
+
+
+def test_elagage_par_taille_moins_recemment_lus(tmp_path):
+    cache = cache_disque(tmp_path, disque_mo=2.5 / 1024, disque_jours=30)
+    for i in range(4):
+        cache.ecrire(cle(i), b"x" * 1024)
+        vieillir(cache, cle(i), 4 - i)
+    # Une lecture rafraîchit la date : cle(0) devient la plus récente
+    assert cache.lire(cle(0)) is not None
+
+    assert cache.elaguer() == 2
+    assert [cache.existe(cle(i)) for i in range(4)] == [True, False, False, True]
+
+
+def test_elagage_des_temporaires_abandonnes(tmp_path):
+    cache = cache_disque(tmp_path)
+    cache.ecrire(cle(1), b"%PDF")
+    sous_dossier = os.path.dirname(cache._chemin(cle(1)))
+    ancien = os.path.join(sous_dossier, "ancien.tmp")
+    recent = os.path.join(sous_dossier, "recent.tmp")
+    for chemin in (ancien, recent):
+        with open(chemin, "wb") as f:
+            f.write(b"%PD")
+    date = time.time() - cache_pdf.AGE_MAX_TEMPORAIRE - 1
+    os.utime(ancien, (date, date))
+
+    assert cache.elaguer() == 0
+    assert not os.path.exists(ancien)
+    assert os.path.exists(recent)
+    assert cache.existe(cle(1))
+
+
+def test_elagage_lance_au_plus_une_fois_par_intervalle(tmp_path, monkeypatch):
+    lances = []
+    cache = CachePdf(str(tmp_path), taille_max=0)
+    monkeypatch.setattr(cache, "elaguer", lambda: lances.append(1))
+    for i in range(3):
+        cache.ecrire(cle(i), b"%PDF")
+    time.sleep(0.05)
+    assert lances == [1]
+
+
+def test_lru_memoire(tmp_path):
+    cache = CachePdf(str(tmp_path), taille_max=2)
+    for i in range(3):
+        cache.ecrire(cle(i), b"%%PDF-%d" % i)
+    assert list(cache._memoire) == [cle(1), cle(2)]
+    # Toujours lisible depuis le disque
+    assert cache.lire(cle(0)) == b"%PDF-0"
+
+
+def test_dernier_pdf_de_la_facture(tmp_path):
+    cache = CachePdf(str(tmp_path), taille_max=0)
+    assert cache.dernier(7) is None
+    cache.ecrire(cle(1), b"%PDF-ancien")
+    cache.associer(7, cle(1), "F-7")
+    cache.ecrire(cle(2), b"%PDF-nouveau")
+    cache.associer(7, cle(2), "F-7")
+    assert cache.dernier(7) == (cle(2), "F-7", b"%PDF-nouveau")
+
+    os.remove(cache._chemin(cle(2)))
+    assert cache.dernier(7) is None
+    assert pdf_sur_disque(cache) == [f"{cle(1)}.pdf"]
@@ -0,0 +1,119 @@
+import time
+
+from donnees import CacheFactures
+
+
+def workers(tmp_path, nombre=2, **options):
+    """Caches de plusieurs workers partageant le même journal d'invalidations."""
+    journal = str(tmp_path / "invalidations")
+    return [CacheFactures(ttl=60, taille=100, journal=journal, **options) for _ in range(nombre)]
+
+
+def test_lecture_apres_ecriture():
+    cache = CacheFactures(ttl=60, taille=2, journal="/nonexistent/journal")
+    cache.ecrire(1, {"numero": "F-1"})
+    assert cache.lire(1) == {"numero": "F-1"}
+    assert cache.lire(2) is None
+
+
+def test_expiration():
+    cache = CacheFactures(ttl=0.01, taille=10, journal="/nonexistent/journal")
+    cache.ecrire(1, {"numero": "F-1"})
+    time.sleep(0.02)
+    assert cache.lire(1) is None
+
+
+def test_taille_bornee():
+    cache = CacheFactures(ttl=60, taille=2, journal="/nonexistent/journal")
+    for facture_id in (1, 2):
+        cache.ecrire(facture_id, {})
+    cache.lire(1)
+    cache.ecrire(3, {})
+    # 2 est la moins récemment utilisée
+    assert cache.lire(2) is None
+    assert cache.lire(1) == {} and cache.lire(3) == {}
+
+
+def test_invalidation_vue_par_les_autres_workers(tmp_path):
+    a, b = workers(tmp_path)
+    for cache in (a, b):
+        cache.ecrire(1, {"v": 1})
+        cache.ecrire(2, {"v": 2})
+
+    a.invalider(1)
+    assert a.lire(1) is None
+    assert b.lire(1) is None
+    # Les autres factures restent en cache
+    assert a.lire(2) == {"v": 2} and b.lire(2) == {"v": 2}
+
+
+def test_invalidation_de_tout_le_cache(tmp_path):
+    a, b = workers(tmp_path)
+    b.ecrire(1, {})
+    b.ecrire(2, {})
+    a.invalider()
+    assert b.lire(1) is None and b.lire(2) is None
+
+
+def test_invalidations_croisees(tmp_path):
+    """Chaque worker applique les lignes des autres, même écrites entre les siennes."""
+    a, b, c = workers(tmp_path, 3)
+    for cache in (a, b, c):
+        for facture_id in (1, 2, 3):
+            cache.ecrire(facture_id, {})
+
+    a.invalider(1)
+    b.invalider(2)
+    a.invalider(3)
+    for cache in (a, b, c):
+        assert [cache.lire(i) for i in (1, 2, 3)] == [None, None, None]
+
+
+def test_invalidations_anterieures_ignorees(tmp_path):
+    (a,) = workers(tmp_path, 1)
+    a.invalider(1)
+    # Un worker démarré après ne rejoue pas le journal existant
+    (b,) = workers(tmp_path, 1)
+    b.ecrire(1, {})
+    assert b.lire(1) == {}
+
+
+def test_journal_remplace(tmp_path):
+    """Au-delà de sa taille maximale le journal est remplacé : les autres
+    workers, qui ne savent plus ce qu'il contenait, vident leur cache."""
+    a, b = workers(tmp_path, taille_journal=40)
+    b.ecrire(1, {})
+    b.ecrire(2, {})
+    a.invalider(3)
+    assert b.lire(1) == {}
+
+    for facture_id in range(100, 110):
+        a.invalider(facture_id)
+    assert (tmp_path / "invalidations").stat().st_size <= 40
+    assert b.lire(1) is None and b.lire(2) is None
+
+    # Le nouveau journal est suivi normalement
+    b.ecrire(1, {})
+    b.ecrire(2, {})
+    a.invalider(1)
+    assert b.lire(1) is None
+    assert b.lire(2) == {}
+
+
+def test_remplacement_vu_sans_avoir_lu_le_journal(tmp_path):
+    """Un worker qui n'a pas lu les lignes de l'ancien journal voit quand
+    même son remplacement (l'inode du nouveau peut être celui de l'ancien)."""
+    a, b = workers(tmp_path, taille_journal=20)
+    b.ecrire(1, {})
+    a.invalider(1)
+    a.invalider(22222)  # au-delà de 20 octets : journal remplacé
+    assert b.lire(1) is None
+
+
+def test_journal_ancien_sans_en_tete(tmp_path):
+    journal = tmp_path / "invalidations"
+    journal.write_bytes(b"7\n8\n")
+    a, b = workers(tmp_path)
+    b.ecrire(7, {})
+    a.invalider(7)
+    assert b.lire(7) is None
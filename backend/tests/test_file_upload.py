@@ -0,0 +1,278 @@
+import hashlib
+import os
+import threading
+import time
+
+import creationfacture
+import resilience
+from file_upload import ECHEC, EN_ATTENTE, EN_COURS, FileUpload, INCHANGEE, REMPLACEE, TERMINEE
+
+
+class Envoi:
+    """`envoyer` factice : rend les résultats prévus, puis des succès."""
+
+    def __init__(self, *resultats):
+        self.resultats = list(resultats)
+        self.envois = []
+
+    def __call__(self, contenu, fichier, empreinte):
+        self.envois.append((contenu, fichier))
+        if self.resultats:
+            return self.resultats.pop(0)
+        return {"success": True, "url": f"https://stockage/{fichier}"}
+
+
+def file_upload(tmp_path, envoyer, **options):
+    return FileUpload(envoyer, chemin_db=str(tmp_path / "uploads.sqlite3"), spool=str(tmp_path / "spool"),
+                      delai_base=0.01, **options)
+
+
+def rendre_echues(file, job_id):
+    """Rend la tâche réservable tout de suite (saute le délai avant réessai)."""
+    cnx = file._connexion()
+    try:
+        cnx.execute("UPDATE uploads SET prochain_essai = 0 WHERE id = ?", (job_id,))
+    finally:
+        cnx.close()
+
+
+def test_envoi_reussi(tmp_path):
+    envoi = Envoi()
+    file = file_upload(tmp_path, envoi)
+    job_id = file.soumettre(b"pdf", "Facture_1.pdf")
+
+    assert file.traiter_une()
+    statut = file.statut(job_id)
+    assert statut["statut"] == TERMINEE
+    assert statut["url"] == "https://stockage/Facture_1.pdf"
+    assert envoi.envois == [(b"pdf", "Facture_1.pdf")]
+    assert os.listdir(tmp_path / "spool") == []
+    assert not file.traiter_une()
+
+
+def test_erreur_reessayee_puis_echec(tmp_path):
+    erreur = {"success": False, "error": "refusé"}
+    envoi = Envoi(*[erreur] * 3)
+    file = file_upload(tmp_path, envoi, max_tentatives=3)
+    job_id = file.soumettre(b"pdf", "Facture_1.pdf")
+
+    for tentative in (1, 2):
+        assert file.traiter_une()
+        statut = file.statut(job_id)
+        assert (statut["statut"], statut["tentatives"]) == (EN_ATTENTE, tentative)
+        assert statut["prochain_essai"] > time.time() - 1
+        rendre_echues(file, job_id)
+
+    assert file.traiter_une()
+    statut = file.statut(job_id)
+    assert (statut["statut"], statut["tentatives"], statut["erreur"]) == (ECHEC, 3, "refusé")
+    # Le contenu est gardé pour une relance
+    assert os.listdir(tmp_path / "spool" / "echecs")
+
+
+def test_panne_ne_consomme_pas_de_tentative(tmp_path):
+    panne = {"success": False, "error": "Supabase storage indisponible", "retry_after": 0}
+    envoi = Envoi(*[panne] * 5)
+    file = file_upload(tmp_path, envoi, max_tentatives=2)
+    job_id = file.soumettre(b"pdf", "Facture_1.pdf")
+
+    for _ in range(5):
+        assert file.traiter_une()
+        statut = file.statut(job_id)
+        assert (statut["statut"], statut["tentatives"]) == (EN_ATTENTE, 0)
+        rendre_echues(file, job_id)
+
+    assert file.traiter_une()
+    assert file.statut(job_id)["statut"] == TERMINEE
+    assert len(envoi.envois) == 6
+
+
+def test_version_en_attente_remplacee(tmp_path):
+    envoi = Envoi()
+    file = file_upload(tmp_path, envoi)
+    ancien = file.soumettre(b"v1", "Facture_1.pdf")
+    nouveau = file.soumettre(b"v2", "Facture_1.pdf")
+
+    assert file.statut(ancien)["statut"] == REMPLACEE
+    assert file.traiter_une()
+    assert not file.traiter_une()
+    assert file.statut(nouveau)["statut"] == TERMINEE
+    assert envoi.envois == [(b"v2", "Facture_1.pdf")]
+
+
+def test_relancer(tmp_path):
+    envoi = Envoi({"success": False, "error": "refusé"})
+    file = file_upload(tmp_path, envoi, max_tentatives=1)
+    job_id = file.soumettre(b"pdf", "Facture_1.pdf")
+    assert file.traiter_une()
+    assert file.statut(job_id)["statut"] == ECHEC
+
+    assert file.relancer(job_id) == {"success": True, "id": job_id}
+    assert file.statut(job_id)["tentatives"] == 0
+    assert file.traiter_une()
+    assert file.statut(job_id)["statut"] == TERMINEE
+    assert envoi.envois == [(b"pdf", "Facture_1.pdf")] * 2
+
+    assert not file.relancer(job_id)["success"]
+    assert file.relancer(job_id + 1) == {"success": False, "error": "Tâche introuvable"}
+
+
+def test_relance_refusee_apres_version_plus_recente(tmp_path):
+    envoi = Envoi({"success": False, "error": "refusé"}, {"success": False, "error": "refusé"})
+    file = file_upload(tmp_path, envoi, max_tentatives=1)
+    ancien = file.soumettre(b"v1", "Facture_1.pdf")
+    assert file.traiter_une()
+    file.soumettre(b"v2", "Facture_1.pdf")
+
+    resultat = file.relancer(ancien)
+    assert not resultat["success"]
+    assert "plus récente" in resultat["error"]
+
+
+def test_purger(tmp_path):
+    envoi = Envoi({"success": False, "error": "refusé"})
+    file = file_upload(tmp_path, envoi, max_tentatives=1)
+    echec = file.soumettre(b"v1", "Facture_1.pdf")
+    assert file.traiter_une()
+    termine = file.soumettre(b"v2", "Facture_2.pdf")
+    assert file.traiter_une()
+    en_attente = file.soumettre(b"v3", "Facture_3.pdf")
+
+    assert file.purger(jours=1) == 0
+    assert file.purger(jours=-1) == 2
+    assert file.statut(echec) is None and file.statut(termine) is None
+    assert file.statut(en_attente)["statut"] == EN_ATTENTE
+    assert os.listdir(tmp_path / "spool" / "echecs") == []
+
+
+def test_panne_storage_puis_reprise(tmp_path, supabase):
+    """Bout en bout avec upload_to_supabase et la doublure de Storage."""
+    supabase.storage.echecs = 1
+    file = file_upload(tmp_path, creationfacture.upload_to_supabase)
+    job_id = file.soumettre(b"%PDF-1.4 facture", "Facture_1.pdf")
+
+    assert file.traiter_une()
+    statut = file.statut(job_id)
+    assert (statut["statut"], statut["tentatives"]) == (EN_ATTENTE, 0)
+    assert statut["erreur"].startswith("Supabase storage")
+
+    supabase.storage.echecs = 0
+    rendre_echues(file, job_id)
+    assert file.traiter_une()
+    assert file.statut(job_id)["statut"] == TERMINEE
+    assert f"{creationfacture.BUCKET_NAME}/Facture_1.pdf" in supabase.objets
+    assert supabase.stats["storage_pannes"] == 1
+
+
+# ---------- déduplication par empreinte ----------
+def test_contenu_deja_stocke_non_soumis(tmp_path):
+    envoi = Envoi()
+    file = file_upload(tmp_path, envoi)
+    file.soumettre(b"v1", "Facture_1.pdf")
+    assert file.traiter_une()
+
+    assert file.soumettre(b"v1", "Facture_1.pdf") is None
+    assert file.soumettre(b"v2", "Facture_1.pdf") is not None
+
+
+def test_contenu_soumis_pendant_un_envoi(tmp_path):
+    """Pendant un envoi, le même contenu est mis en file : l'envoi peut échouer."""
+    soumis = []
+
+    def envoyer(contenu, fichier, empreinte):
+        soumis.append(file.soumettre(contenu, fichier))
+        return resultats.pop(0)
+
+    resultats = [{"success": True}, {"success": False, "error": "refusé"}, {"success": True}]
+    file = file_upload(tmp_path, envoyer, max_tentatives=1)
+
+    # Envoi réussi : la tâche suivante voit l'empreinte et n'envoie rien
+    premier = file.soumettre(b"v1", "Facture_1.pdf")
+    assert file.traiter_une()
+    assert soumis[0] is not None
+    assert file.traiter_une()
+    assert file.statut(soumis[0])["statut"] == INCHANGEE
+    assert file.statut(premier)["statut"] == TERMINEE
+
+    # Envoi en échec : c'est la tâche suivante qui envoie le contenu
+    echec = file.soumettre(b"v2", "Facture_1.pdf")
+    assert file.traiter_une()
+    assert file.statut(echec)["statut"] == ECHEC
+    assert file.traiter_une()
+    assert file.statut(soumis[1])["statut"] == TERMINEE
+    # La version en échec, dépassée, n'est plus relançable
+    assert file.statut(echec)["statut"] == REMPLACEE
+    assert file.empreinte("Facture_1.pdf") == hashlib.sha256(b"v2").hexdigest()
+
+
+def test_empreinte_distante(tmp_path, supabase):
+    """Base locale vide : l'empreinte gardée dans les métadonnées de l'objet suffit."""
+    file = file_upload(tmp_path, creationfacture.upload_to_supabase)
+    file.soumettre(b"%PDF-1.4 facture", "Facture_1.pdf")
+    assert file.traiter_une()
+
+    (tmp_path / "autre").mkdir()
+    autre = file_upload(tmp_path / "autre", creationfacture.upload_to_supabase,
+                        empreinte_distante=creationfacture.empreinte_supabase)
+    job_id = autre.soumettre(b"%PDF-1.4 facture", "Facture_1.pdf")
+    assert autre.traiter_une()
+    assert autre.statut(job_id)["statut"] == INCHANGEE
+    assert supabase.stats["storage_uploads"] == 1
+
+
+# ---------- envois abandonnés ----------
+def test_envoi_abandonne_termine_avant_le_suivant(tmp_path):
+    """Un envoi hors délai garde la réservation jusqu'à sa fin réelle : la
+    version suivante du fichier ne peut pas partir avant lui."""
+    service = resilience.Service("storage", 0.05, disjoncteur=resilience.Disjoncteur(seuil=5))
+    fin = threading.Event()
+    envois = []
+
+    def televerser(contenu):
+        if contenu == b"v1":
+            fin.wait(5)
+        envois.append(contenu)
+
+    def envoyer(contenu, fichier, empreinte):
+        try:
+            service.appeler(televerser, contenu)
+        except resilience.Indisponible as e:
+            return {"success": False, "error": str(e), "retry_after": 0, "abandonnes": e.abandonnes}
+        return {"success": True}
+
+    file = file_upload(tmp_path, envoyer)
+    ancien = file.soumettre(b"v1", "Facture_1.pdf")
+    assert file.traiter_une()
+    assert file.statut(ancien)["statut"] == EN_ATTENTE
+
+    nouveau = file.soumettre(b"v2", "Facture_1.pdf")
+    assert file.statut(ancien)["statut"] == REMPLACEE
+    assert not file.traiter_une()
+
+    fin.set()
+    limite = time.monotonic() + 5
+    while not file.traiter_une():
+        assert time.monotonic() < limite
+        time.sleep(0.01)
+    assert file.statut(nouveau)["statut"] == TERMINEE
+    assert envois == [b"v1", b"v2"]
+
+
+def test_resultat_ignore_si_la_tache_a_ete_reprise(tmp_path):
+    def envoyer(contenu, fichier, empreinte):
+        # Réservation expirée pendant l'envoi, tâche reprise par un autre worker
+        cnx = file._connexion()
+        try:
+            cnx.execute("UPDATE uploads SET reserve_jusqua = 0")
+        finally:
+            cnx.close()
+        assert file._reserver() is not None
+        return {"success": True}
+
+    file = file_upload(tmp_path, envoyer)
+    job_id = file.soumettre(b"v1", "Facture_1.pdf")
+    assert file.traiter_une()
+    assert file.statut(job_id)["statut"] == EN_COURS
+    assert file.empreinte("Facture_1.pdf") is None
+    # Le contenu reste disponible pour l'envoi repris
+    assert len(os.listdir(tmp_path / "spool")) == 1
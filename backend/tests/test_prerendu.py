@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import prerendu
+from prerendu import PreRendu, secret_valide
+
+DEBUT = datetime(2026, 10, 1, tzinfo=timezone.utc)
+
+
+# ---------- secret du webhook ----------
+def test_secret_absent_refuse_tout(monkeypatch):
+    monkeypatch.setattr(prerendu, "SECRET_WEBHOOK", "")
+    assert not secret_valide("")
+    assert not secret_valide(None)
+    assert not secret_valide("nimporte")
+
+
+@pytest.mark.parametrize("valeur, valide", [
+    ("secret-du-webhook", True),
+    ("secret-du-webhoo", False),
+    ("Secret-du-webhook", False),
+    ("", False),
+    (None, False),
+    ("secret-du-webhook ", False),
+    ("sécret", False),
+])
+def test_secret_configure(monkeypatch, valeur, valide):
+    monkeypatch.setattr(prerendu, "SECRET_WEBHOOK", "secret-du-webhook")
+    assert secret_valide(valeur) is valide
+
+
+# ---------- webhook ----------
+def test_evenements(monkeypatch):
+    invalidees = []
+    monkeypatch.setattr(prerendu, "invalider_facture", invalidees.append)
+    p = PreRendu(intervalle=0)
+
+    assert p.recevoir({"type": "UPDATE", "table": "factures", "record": {"id": 4}}) == 4
+    assert p.recevoir({"type": "DELETE", "table": "factures", "old_record": {"id": 5}}) == 5
+    assert p.recevoir({"type": "INSERT", "table": "dossiers", "record": {"id": 6}}) is None
+    assert p.recevoir({"type": "UPDATE", "record": {"id": "7"}}) is None
+    assert p.recevoir([]) is None
+    assert invalidees == [4, 5]
+    # Seule la facture modifiée est à rendre
+    assert list(p._en_attente) == [4]
+
+
+# ---------- scrutation ----------
+class Table:
+    """Table factures simulée : répond aux requêtes construites par `_page`."""
+
+    def __init__(self):
+        self.lignes = {}
+        self.requetes = []
+
+    def modifier(self, facture_id, secondes):
+        date = (DEBUT + timedelta(seconds=secondes)).isoformat()
+        self.lignes[facture_id] = {"id": facture_id, "data_json": {"id": facture_id}, "updated_at": date}
+
+    def lire(self, requete):
+        params = requete.request.params
+        self.requetes.append(params)
+        cle = lambda ligne: (datetime.fromisoformat(ligne["updated_at"]), ligne["id"])
+        lignes = sorted(self.lignes.values(), key=cle, reverse="desc" in params["order"])
+        if "updated_at" in params:
+            depuis = datetime.fromisoformat(params["updated_at"].removeprefix("gte."))
+            lignes = [l for l in lignes if cle(l)[0] >= depuis]
+        if "or" in params:
+            date, facture_id = params["or"].split('"')[1], int(params["or"].rsplit(".", 1)[1].rstrip(")"))
+            lignes = [l for l in lignes if cle(l) > (datetime.fromisoformat(date), facture_id)]
+
+        class Reponse:
+            data = lignes[:int(params["limit"])]
+        return Reponse
+
+
+@pytest.fixture
+def table(monkeypatch):
+    table = Table()
+    monkeypatch.setattr(prerendu, "lire", table.lire)
+    return table
+
+
+def ids(lignes):
+    return sorted(ligne["id"] for ligne in lignes)
+
+
+def test_premiere_scrutation_lit_les_dernieres_modifiees(table):
+    for facture_id in range(1, 6):
+        table.modifier(facture_id, facture_id)
+    table.modifier(1, 100)  # ancienne facture modifiée récemment
+
+    p = PreRendu(intervalle=0, fenetre=2)
+    assert ids(p._modifiees()) == [1, 5]
+    assert p._curseur == DEBUT + timedelta(seconds=100)
+
+
+def test_modification_d_une_ancienne_facture(table):
+    for facture_id in range(1, 300):
+        table.modifier(facture_id, 0)
+    p = PreRendu(intervalle=0, fenetre=50)
+    p._modifiees()
+
+    table.modifier(3, 3600)
+    assert 3 in ids(p._modifiees())
+    assert p._curseur == DEBUT + timedelta(seconds=3600)
+    table.modifier(8, 3600 + prerendu.MARGE_SCRUTATION + 1)
+    assert ids(p._modifiees()) == [3, 8]
+    # Plus de MARGE_SCRUTATION avant la dernière date vue : plus relue
+    assert ids(p._modifiees()) == [8]
+
+
+def test_pages_successives(table):
+    p = PreRendu(intervalle=0, fenetre=3)
+    table.modifier(1, 0)
+    p._modifiees()
+
+    # Plus de modifications qu'une page, dont plusieurs à la même date
+    for facture_id in range(10, 18):
+        table.modifier(facture_id, 1000 + facture_id // 3)
+    # La facture 1 est relue : dans la marge de la dernière date vue
+    assert ids(p._modifiees()) == [1, *range(10, 18)]
+    assert len(table.requetes) == 1 + 4
+
+
+def test_transaction_validee_en_retard_vue_dans_la_marge(table):
+    p = PreRendu(intervalle=0)
+    table.modifier(1, 1000)
+    p._modifiees()
+    # Validée après la scrutation, mais datée d'avant la dernière date vue
+    table.modifier(2, 1000 - prerendu.MARGE_SCRUTATION // 2)
+    assert 2 in ids(p._modifiees())
+
+
+def test_scruter_ne_planifie_que_les_pdf_absents(table, monkeypatch):
+    monkeypatch.setattr(prerendu, "version_facture", lambda: "v1")
+    en_cache = {prerendu.cle_cache({"id": 1}, "v1")}
+    monkeypatch.setattr(prerendu.cache_factures, "existe", lambda cle: cle in en_cache)
+    table.modifier(1, 0)
+    table.modifier(2, 0)
+
+    p = PreRendu(intervalle=0)
+    assert p.scruter() == 1
+    assert list(p._en_attente) == [2]
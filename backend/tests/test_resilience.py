@@ -0,0 +1,134 @@
+import threading
+import time
+
+import httpx
+import pytest
+from postgrest.exceptions import APIError
+from storage3.exceptions import StorageApiError
+
+from resilience import ESSAI, FERME, OUVERT, Disjoncteur, Indisponible, Service, _est_panne
+
+
+def erreur_postgrest(code):
+    return APIError({"code": code, "message": "erreur", "details": None, "hint": None})
+
+
+# ---------- disjoncteur ----------
+def test_disjoncteur_ferme_ouvert_essai():
+    disjoncteur = Disjoncteur(seuil=2, pause=0.05)
+    disjoncteur.echec()
+    assert disjoncteur.etat == FERME and disjoncteur.autoriser()
+
+    disjoncteur.echec()
+    assert disjoncteur.etat == OUVERT
+    assert not disjoncteur.autoriser()
+    assert disjoncteur.retry_after() >= 1
+
+    time.sleep(0.06)
+    assert disjoncteur.autoriser()
+    assert disjoncteur.etat == ESSAI
+    # Un seul appel d'essai par pause
+    assert not disjoncteur.autoriser()
+
+    # Essai en échec : rouvert pour une pause entière
+    disjoncteur.echec()
+    assert disjoncteur.etat == OUVERT
+    assert not disjoncteur.autoriser()
+
+    time.sleep(0.06)
+    assert disjoncteur.autoriser()
+    disjoncteur.succes()
+    assert disjoncteur.etat == FERME
+    # Les échecs repartent de zéro
+    disjoncteur.echec()
+    assert disjoncteur.etat == FERME
+
+
+def test_succes_remet_le_compte_a_zero():
+    disjoncteur = Disjoncteur(seuil=2, pause=30)
+    disjoncteur.echec()
+    disjoncteur.succes()
+    disjoncteur.echec()
+    assert disjoncteur.etat == FERME
+
+
+# ---------- classement des erreurs ----------
+@pytest.mark.parametrize("erreur, panne", [
+    (erreur_postgrest("PGRST116"), False),  # aucune ligne (maybe_single)
+    (erreur_postgrest("PGRST301"), False),  # JWT refusé
+    (erreur_postgrest("PGRST001"), True),   # base injoignable
+    (erreur_postgrest("PGRSTX00"), True),   # erreur interne
+    (erreur_postgrest("23505"), False),     # contrainte d'unicité
+    (erreur_postgrest("42P01"), False),     # table inconnue
+    (erreur_postgrest("08006"), True),      # connexion perdue
+    (erreur_postgrest("57014"), True),      # délai d'instruction
+    (erreur_postgrest("53300"), True),      # trop de connexions
+    (erreur_postgrest("XX000"), True),
+    (StorageApiError("Object not found", "not_found", 404), False),
+    (StorageApiError("Bad Gateway", "502", "502"), True),
+    (httpx.ConnectError("refusée"), True),
+    (httpx.ReadTimeout("délai"), True),
+    (ValueError("réponse illisible"), True),
+])
+def test_est_panne(erreur, panne):
+    assert _est_panne(erreur) is panne
+
+
+# ---------- appels bornés ----------
+def test_reponse_4xx_renvoyee_sans_ouvrir_le_disjoncteur():
+    service = Service("test", 1, disjoncteur=Disjoncteur(seuil=1))
+
+    def absent():
+        raise StorageApiError("Object not found", "not_found", 404)
+
+    with pytest.raises(StorageApiError):
+        service.appeler(absent)
+    assert service.disjoncteur.etat == FERME
+
+
+def test_panne_ouvre_le_disjoncteur():
+    service = Service("test", 1, disjoncteur=Disjoncteur(seuil=2, pause=30))
+
+    def panne():
+        raise httpx.ConnectError("refusée")
+
+    for _ in range(2):
+        with pytest.raises(Indisponible) as erreur:
+            service.appeler(panne)
+    assert service.disjoncteur.etat == OUVERT
+    assert erreur.value.statut == 503
+
+    # Disjoncteur ouvert : l'appel ne part pas
+    appels = []
+    with pytest.raises(Indisponible) as erreur:
+        service.appeler(appels.append, 1)
+    assert appels == []
+    assert erreur.value.retry_after > 1
+
+
+def test_lecture_relancee_une_fois():
+    service = Service("test", 1, disjoncteur=Disjoncteur(seuil=5))
+    appels = []
+
+    def lecture():
+        appels.append(1)
+        if len(appels) == 1:
+            raise httpx.ConnectError("refusée")
+        return "ok"
+
+    assert service.appeler(lecture, idempotent=True) == "ok"
+    assert len(appels) == 2
+    assert service.disjoncteur.etat == FERME
+
+
+def test_appel_hors_delai_abandonne():
+    service = Service("test", 0.05, disjoncteur=Disjoncteur(seuil=5))
+    fin = threading.Event()
+
+    with pytest.raises(Indisponible) as erreur:
+        service.appeler(fin.wait, 5)
+    # L'appel tourne encore : l'appelant peut attendre sa fin
+    (futur,) = erreur.value.abandonnes
+    assert not futur.done()
+    fin.set()
+    assert futur.result(timeout=1) is True
@@ -0,0 +1,104 @@
+from functools import lru_cache
+from reportlab.pdfbase import pdfmetrics
+
+# ===================== MESURE ET COUPURE DU TEXTE =====================
+# Tables de largeurs des glyphes (en 1/1000 d'em) construites une fois par
+# police à partir des métriques ReportLab, puis accumulation incrémentale des
+# largeurs mot par mot. Les résultats de coupure sont mémorisés par
+# (texte, police, taille, largeur).
+
+ELLIPSE = "…"
+
+
+class _TableLargeurs(dict):
+    """Largeur de chaque caractère ; les caractères absents (hors encodage
+    de la police) sont mesurés une fois par ReportLab puis conservés."""
+
+    def __init__(self, police):
+        super().__init__()
+        self.police = police
+        font = pdfmetrics.getFont(police)
+        for code, largeur in enumerate(font.widths):
+            try:
+                self[bytes([code]).decode("cp1252")] = largeur
+            except UnicodeDecodeError:
+                pass
+
+    def __missing__(self, caractere):
+        largeur = pdfmetrics.stringWidth(caractere, self.police, 1000)
+        self[caractere] = largeur
+        return largeur
+
+
+@lru_cache(maxsize=None)
+def table_largeurs(police):
+    return _TableLargeurs(police)
+
+
+def largeur_texte(texte, police, taille):
+    """Équivalent de canvas.stringWidth, sans passer par l'encodage ReportLab."""
+    table = table_largeurs(police)
+    return sum(table[ch] for ch in texte) * taille / 1000
+
+
+def _avec_ellipse(ligne, table, limite):
+    """Ajoute l'ellipse à `ligne` en retirant des caractères si nécessaire."""
+    reste = limite - table[ELLIPSE]
+    total = 0
+    for i, ch in enumerate(ligne):
+        total += table[ch]
+        if total > reste:
+            return ligne[:i].rstrip() + ELLIPSE
+    return ligne.rstrip() + ELLIPSE
+
+
+@lru_cache(maxsize=4096)
+def couper_texte(texte, police, taille, largeur_max, max_lignes=None, ellipse=True):
+    """Coupe `texte` en lignes d'au plus `largeur_max` points.
+
+    Un mot plus large que `largeur_max` reste seul sur sa ligne. Au-delà de
+    `max_lignes`, le texte est tronqué et la dernière ligne se termine par
+    une ellipse si `ellipse` est vrai. Retourne un tuple de lignes.
+    """
+    table = table_largeurs(police)
+    # Les largeurs sont comparées en 1/1000 d'em pour éviter une division par mot
+    limite = largeur_max * 1000 / taille
+    espace = table[" "]
+
+    lignes = []
+    courante = []
+    largeur_courante = 0
+    for mot in str(texte).split():
+        largeur_mot = sum(table[ch] for ch in mot)
+        if courante and largeur_courante + espace + largeur_mot > limite:
+            lignes.append(" ".join(courante))
+            courante = [mot]
+            largeur_courante = largeur_mot
+        else:
+            largeur_courante += (espace if courante else 0) + largeur_mot
+            courante.append(mot)
+    if courante:
+        lignes.append(" ".join(courante))
+
+    if max_lignes is not None and len(lignes) > max_lignes:
+        lignes = lignes[:max_lignes]
+        if ellipse:
+            lignes[-1] = _avec_ellipse(lignes[-1] + " ", table, limite)
+    return tuple(lignes)
+
+
+@lru_cache(maxsize=4096)
+def tronquer_texte(texte, police, taille, largeur_max, ellipse=True):
+    """Texte sur une seule ligne, tronqué pour tenir dans `largeur_max`."""
+    texte = str(texte)
+    table = table_largeurs(police)
+    limite = largeur_max * 1000 / taille
+    if sum(table[ch] for ch in texte) <= limite:
+        return texte
+    if not ellipse:
+        total = 0
+        for i, ch in enumerate(texte):
+            total += table[ch]
+            if total > limite:
+                return texte[:i]
+    return _avec_ellipse(texte, table, limite)